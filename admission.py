@@ -0,0 +1,269 @@
+"""
+In-process admission control for the expensive routes.
+
+Routes are grouped into classes (ROUTE_CLASSES). Each class runs at most
+``limit`` requests at once; up to ``queue_depth`` more may wait for a slot for
+``queue_timeout`` seconds, and anything beyond is answered at once with 503
+and Retry-After instead of tying up a worker. Each signed-in user also has a
+token bucket per class, refilled at ``rate`` requests per second up to
+``burst``, and gets 429 with Retry-After once it is empty. Routes outside
+these classes, such as getting a single recipe, are never held back, so they
+stay fast while the heavy routes are saturated.
+
+Limits are per process, like the caches. The ASGI app (asgi.py) uses the same
+classes and limits with AsyncConcurrencyLimit, which parks waiting requests on
+futures instead of threads.
+"""
+import asyncio
+import math
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+
+from flask import jsonify, request
+from flask_login import current_user
+
+# Endpoint -> route class
+ROUTE_CLASSES = {
+    'search_recipes': 'search',
+    'match_recipes': 'search',
+    'get_similar_recipes': 'search',
+    'login': 'auth',
+    'register_user': 'auth',
+    'get_recipes': 'listing',
+    'get_recipe_batch': 'listing',
+    'get_shopping_list': 'listing',
+    'import_recipes': 'bulk',
+    'export_recipes': 'bulk',
+}
+
+# Concurrent requests per route class
+ADMISSION_LIMITS = {'search': 8, 'auth': 4, 'listing': 8, 'bulk': 2}
+ADMISSION_QUEUE_DEPTH = 16
+ADMISSION_QUEUE_TIMEOUT = 2.0
+RATE_LIMIT_PER_SECOND = 10
+RATE_LIMIT_BURST = 50
+# Users with a token bucket; the least recently seen are dropped beyond this
+RATE_LIMIT_MAX_USERS = 10000
+# Retry-After for requests shed because a class is saturated
+BUSY_RETRY_AFTER = 1
+
+
+class ConcurrencyLimit:
+    """At most ``limit`` holders, with a bounded, time-limited wait for a slot."""
+
+    def __init__(self, limit, queue_depth=ADMISSION_QUEUE_DEPTH,
+                 queue_timeout=ADMISSION_QUEUE_TIMEOUT):
+        self.limit = limit
+        self.queue_depth = queue_depth
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = Counter()
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """Take a slot, waiting if allowed. Returns None, or why the request was shed."""
+        with self._condition:
+            if self.active >= self.limit:
+                if self.queued >= self.queue_depth:
+                    self.rejected['queue_full'] += 1
+                    return 'queue_full'
+                self.queued += 1
+                try:
+                    if not self._condition.wait_for(lambda: self.active < self.limit,
+                                                    self.queue_timeout):
+                        self.rejected['queue_timeout'] += 1
+                        return 'queue_timeout'
+                finally:
+                    self.queued -= 1
+            self.active += 1
+            self.admitted += 1
+            return None
+
+    def release(self):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify()
+
+    def stats(self):
+        with self._condition:
+            return {'active': self.active, 'queued': self.queued, 'limit': self.limit,
+                    'admitted': self.admitted, 'rejected': dict(self.rejected)}
+
+
+class AsyncConcurrencyLimit:
+    """
+    ConcurrencyLimit for a single event loop: ``acquire`` is a coroutine and a
+    released slot is handed straight to the longest waiting request.
+    """
+
+    def __init__(self, limit, queue_depth=ADMISSION_QUEUE_DEPTH,
+                 queue_timeout=ADMISSION_QUEUE_TIMEOUT):
+        self.limit = limit
+        self.queue_depth = queue_depth
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.admitted = 0
+        self.rejected = Counter()
+        self._waiters = deque()
+
+    async def acquire(self):
+        """Take a slot, waiting if allowed. Returns None, or why the request was shed."""
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            self.admitted += 1
+            return None
+        if len(self._waiters) >= self.queue_depth:
+            self.rejected['queue_full'] += 1
+            return 'queue_full'
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+        except asyncio.TimeoutError:
+            pass
+        except BaseException:
+            self._abandon(waiter)
+            raise
+        # The slot may have been handed over just as the wait timed out
+        if waiter.done():
+            self.admitted += 1
+            return None
+        self._abandon(waiter)
+        self.rejected['queue_timeout'] += 1
+        return 'queue_timeout'
+
+    def _abandon(self, waiter):
+        if waiter.done():
+            # Handed a slot it no longer wants: pass it on
+            self.release()
+        else:
+            waiter.cancel()
+            self._waiters.remove(waiter)
+
+    def release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # The slot changes hands, so active stays the same
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self):
+        return {'active': self.active, 'queued': len(self._waiters), 'limit': self.limit,
+                'admitted': self.admitted, 'rejected': dict(self.rejected)}
+
+
+class TokenBuckets:
+    """A token bucket per key, refilled at ``rate`` tokens per second up to ``burst``."""
+
+    def __init__(self, rate=RATE_LIMIT_PER_SECOND, burst=RATE_LIMIT_BURST,
+                 max_keys=RATE_LIMIT_MAX_USERS):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.rejected = 0
+        self._buckets = OrderedDict()   # key -> (tokens, last refill)
+        self._lock = threading.Lock()
+
+    def take(self, key):
+        """Take a token for ``key``. Returns 0, or the seconds until one is available."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                self.rejected += 1
+                wait = (1 - tokens) / self.rate
+            self._buckets[key] = (tokens, now)
+            # A dropped user simply starts again with a full bucket
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+class AdmissionController:
+    def __init__(self, limits=None, queue_depth=ADMISSION_QUEUE_DEPTH,
+                 queue_timeout=ADMISSION_QUEUE_TIMEOUT, rate=RATE_LIMIT_PER_SECOND,
+                 burst=RATE_LIMIT_BURST, routes=None, limit_class=ConcurrencyLimit):
+        self.routes = ROUTE_CLASSES if routes is None else routes
+        limits = limits or ADMISSION_LIMITS
+        self.limits = {name: limit_class(limit, queue_depth, queue_timeout)
+                       for name, limit in limits.items()}
+        self.buckets = {name: TokenBuckets(rate, burst) for name in limits} if rate else {}
+
+    @classmethod
+    def from_config(cls, config, **kwargs):
+        return cls(
+            limits=config.get('ADMISSION_LIMITS', ADMISSION_LIMITS),
+            queue_depth=config.get('ADMISSION_QUEUE_DEPTH', ADMISSION_QUEUE_DEPTH),
+            queue_timeout=config.get('ADMISSION_QUEUE_TIMEOUT_MS',
+                                     ADMISSION_QUEUE_TIMEOUT * 1000) / 1000,
+            rate=config.get('RATE_LIMIT_PER_SECOND', RATE_LIMIT_PER_SECOND),
+            burst=config.get('RATE_LIMIT_BURST', RATE_LIMIT_BURST),
+            **kwargs
+        )
+
+    def route_class(self, endpoint):
+        route_class = self.routes.get(endpoint)
+        return route_class if route_class in self.limits else None
+
+    def stats(self):
+        """Per route class: slots in use, waiting requests and rejections by reason."""
+        stats = {}
+        for name, limit in self.limits.items():
+            stats[name] = limit.stats()
+            if name in self.buckets:
+                stats[name]['rejected']['rate_limited'] = self.buckets[name].rejected
+        return stats
+
+
+def init_admission(app):
+    """
+    Hold back requests to the routes in ROUTE_CLASSES as configured, before their
+    handlers run. Returns the AdmissionController, or None when disabled.
+    """
+    if not app.config.get('ADMISSION_CONTROL', True):
+        return None
+    controller = AdmissionController.from_config(app.config)
+    app.extensions['admission'] = controller
+
+    def rejection(status, error, retry_after):
+        response = jsonify({'error': error})
+        response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+        return response, status
+
+    @app.before_request
+    def admit_request():
+        route_class = controller.route_class(request.endpoint)
+        if route_class is None:
+            return None
+
+        # Anonymous requests (login, registration) are bounded by the slots alone
+        buckets = controller.buckets.get(route_class)
+        if buckets is not None and current_user.is_authenticated:
+            wait = buckets.take(current_user.id)
+            if wait:
+                return rejection(429, 'Too many requests, please slow down', wait)
+
+        limit = controller.limits[route_class]
+        if limit.acquire() is not None:
+            return rejection(503, 'Server busy, please retry shortly', BUSY_RETRY_AFTER)
+        request.environ['admission.limit'] = limit
+        return None
+
+    @app.teardown_request
+    def release_slot(exception=None):
+        # With stream_with_context this runs once the streamed body is finished
+        limit = request.environ.pop('admission.limit', None)
+        if limit is not None:
+            limit.release()
+
+    return controller
@@ -0,0 +1,178 @@
+"""
+Optional ASGI serving mode: the routes of routes.register_routes on Starlette,
+with the database reached through SQLAlchemy's asyncio engine.
+
+    pip install -r requirements-asgi.txt
+    uvicorn asgi:app --workers 4
+
+Requests and responses are the same as with the Flask app, and so is the login
+cookie, so both can serve the same clients side by side. While a request waits
+on the database, its event loop serves other requests instead of tying up a
+worker thread. The handlers in asgi_routes.py run the query and write helpers
+of routes.py through AsyncSession.run_sync, so queries, validation, error
+responses and the signals that keep the caches current are shared with the
+Flask app rather than duplicated.
+"""
+import logging
+import math
+import time
+from contextlib import asynccontextmanager
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+
+import search  # registers the full-text index DDL on the metadata
+from admission import BUSY_RETRY_AFTER, AdmissionController, AsyncConcurrencyLimit
+from asgi_routes import build_routes, jsonify, load_current_user
+from config import Config
+from database import build_async_engine
+from metrics import MetricsRegistry, extension_samples, instrument_engine, request_stats
+from models import Base
+from passwords import PasswordHasher
+from routes import init_recipe_state
+
+logger = logging.getLogger(__name__)
+
+SLOW_REQUEST_THRESHOLD_MS = 500
+
+
+class AsgiState:
+    """What the Flask app keeps on ``app`` and in ``app.extensions``, for the ASGI app."""
+
+    def __init__(self, config):
+        self.config = config
+        self.extensions = {}
+        self.engine = build_async_engine(_ConfigObject(config))
+        self.sessions = async_sessionmaker(self.engine)
+        instrument_engine(self.engine.sync_engine)
+
+        init_recipe_state(config, self.extensions, self)
+        self.password_hasher = PasswordHasher.from_config(config)
+        self.extensions['password_hasher'] = self.password_hasher
+        self.admission = None
+        if config.get('ADMISSION_CONTROL', True):
+            self.admission = AdmissionController.from_config(
+                config, limit_class=AsyncConcurrencyLimit)
+            self.extensions['admission'] = self.admission
+        self.metrics = MetricsRegistry()
+        self.metrics.add_collector(lambda: extension_samples(self.extensions))
+
+    async def run(self, fn, *args):
+        """Call ``fn(session, *args)`` with a new session, as AsyncSession.run_sync does."""
+        async with self.sessions() as session:
+            return await session.run_sync(fn, *args)
+
+
+class _ConfigObject:
+    # database.build_async_engine reads attributes, like the Config class
+    def __init__(self, config):
+        self.__dict__.update(config)
+
+
+def create_asgi_app(config_object=Config):
+    config = {key: getattr(config_object, key) for key in dir(config_object) if key.isupper()}
+    state = AsgiState(config)
+
+    routes = [Route(path, _endpoint(state, handler), methods=methods, name=handler.__name__)
+              for path, methods, handler in build_routes(state)]
+    routes.append(Route('/metrics', _metrics_endpoint(state), methods=['GET'], name='metrics'))
+
+    @asynccontextmanager
+    async def lifespan(app):
+        async with state.engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+        try:
+            yield
+        finally:
+            await state.engine.dispose()
+
+    app = Starlette(routes=routes, lifespan=lifespan)
+    app.state.api = state
+    return app
+
+
+def _rejection(status, error, retry_after):
+    return jsonify({'error': error}, status,
+                   headers={'Retry-After': str(max(1, math.ceil(retry_after)))})
+
+
+async def _admit(state, endpoint, user):
+    """The held ConcurrencyLimit, or a 429/503 response (see admission.init_admission)."""
+    route_class = state.admission.route_class(endpoint) if state.admission else None
+    if route_class is None:
+        return None, None
+
+    buckets = state.admission.buckets.get(route_class)
+    if buckets is not None and user is not None:
+        wait = buckets.take(user.id)
+        if wait:
+            return None, _rejection(429, 'Too many requests, please slow down', wait)
+
+    limit = state.admission.limits[route_class]
+    if await limit.acquire() is not None:
+        return None, _rejection(503, 'Server busy, please retry shortly', BUSY_RETRY_AFTER)
+    return limit, None
+
+
+def _endpoint(state, handler):
+    """
+    Wrap ``handler`` with the change feed poll, user loading, admission control and
+    metrics of the Flask hooks.
+    """
+    endpoint = handler.__name__
+    threshold = state.config.get('SLOW_REQUEST_THRESHOLD_MS', SLOW_REQUEST_THRESHOLD_MS)
+    changes = state.extensions['recipe_changes']
+
+    async def run(request: Request) -> Response:
+        with request_stats() as stats:
+            if changes.due():
+                await state.run(changes.poll)
+            request.state.user = await load_current_user(state, request)
+            limit, response = await _admit(state, endpoint, request.state.user)
+            if response is None:
+                try:
+                    response = await handler(request)
+                except BaseException:
+                    if limit is not None:
+                        limit.release()
+                    raise
+                if limit is not None:
+                    if isinstance(response, StreamingResponse):
+                        # Hold the slot until the streamed body is finished
+                        response.body_iterator = _releasing(response.body_iterator, limit)
+                    else:
+                        limit.release()
+
+            elapsed = time.perf_counter() - stats.started
+            streamed = isinstance(response, StreamingResponse)
+            state.metrics.observe_request(endpoint, request.method, response.status_code,
+                                          elapsed, stats, None if streamed else len(response.body))
+            if threshold is not None and elapsed * 1000 >= threshold:
+                logger.warning(
+                    'Slow request: %s %s -> %s in %.1f ms, %d SQL statement(s) in %.1f ms, '
+                    'JSON %.1f ms', request.method, request.url.path, response.status_code,
+                    elapsed * 1000, stats.sql_count, stats.sql_time * 1000,
+                    (stats.json_encode_time + stats.json_decode_time) * 1000)
+            return response
+
+    return run
+
+
+async def _releasing(body_iterator, limit):
+    try:
+        async for chunk in body_iterator:
+            yield chunk
+    finally:
+        limit.release()
+
+
+def _metrics_endpoint(state):
+    async def metrics(request):
+        return Response(state.metrics.render(), media_type='text/plain; version=0.0.4')
+    return metrics
+
+
+app = create_asgi_app()
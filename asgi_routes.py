@@ -0,0 +1,507 @@
+"""
+The routes of routes.register_routes for the ASGI app (asgi.py).
+
+Each handler parses the request, then does its database work in a plain
+function run through ``state.run`` (AsyncSession.run_sync), reusing the query
+and write helpers of routes.py and the rest of the app unchanged. Responses are built
+exactly like Flask's: the same status codes, bodies, ETags and headers.
+"""
+import json
+import logging
+import time
+from datetime import timedelta
+
+from flask.sessions import SecureCookieSessionInterface
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from sqlalchemy.util import await_only
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response, StreamingResponse
+from werkzeug.datastructures import MultiDict
+from werkzeug.http import parse_etags, quote_etag
+
+from auth import USER_CACHE_SIZE, USER_CACHE_TTL, CachedUser
+from bulk import (EXPORT_FORMATS, IMPORT_BATCH_SIZE, MAX_IMPORT_BATCH_SIZE,
+                  export_chunks, gzip_chunks, import_ndjson)
+from cache import LRUCache, make_cached_response
+from metrics import current_request_stats
+from models import User
+from pagination import MAX_PAGE_SIZE, clamp_limit
+from projection import parse_fields
+from routes import (MAX_RECIPE_BATCH_SIZE, add_ingredients_body, create_recipe_body,
+                    delete_recipe_body, if_match_versions, login_body, pantry_matches,
+                    parse_recipe_ids, patch_ingredients_body, recipe_batch_body, recipe_body,
+                    recipe_listing, recipe_tag, register_user_body, search_body,
+                    similar_recipe_items, update_recipe_body)
+from search import normalize_query
+from shopping import parse_plan, shopping_list
+from signals import recipe_changed, user_changed
+
+logger = logging.getLogger(__name__)
+
+# Flask's defaults for the session cookie Flask-Login keeps the user id in
+SESSION_COOKIE_NAME = 'session'
+SESSION_LIFETIME = timedelta(days=31)
+
+
+def dumps(obj):
+    """JSON text as Flask's jsonify writes it: compact, sorted keys, trailing newline."""
+    stats = current_request_stats()
+    started = time.perf_counter()
+    text = json.dumps(obj, separators=(',', ':'), sort_keys=True) + '\n'
+    if stats is not None:
+        stats.json_encode_time += time.perf_counter() - started
+    return text
+
+
+def json_response(body, status=200, headers=None):
+    return Response(body, status_code=status, headers=headers, media_type='application/json')
+
+
+def jsonify(obj, status=200, headers=None):
+    return json_response(dumps(obj), status, headers)
+
+
+def cached_response(request, entry):
+    """Serve a cached body with its ETag, answering If-None-Match with 304."""
+    headers = dict(entry.headers)
+    headers['ETag'] = quote_etag(entry.etag)
+    if request.method in ('GET', 'HEAD') and \
+            parse_etags(request.headers.get('if-none-match')).contains_weak(entry.etag):
+        return Response(status_code=304, headers=headers)
+    return json_response(entry.body, headers=headers)
+
+
+def query_args(request):
+    """The query string as the MultiDict Flask's request.args is, for the shared helpers."""
+    return MultiDict(request.query_params.multi_items())
+
+
+async def get_json(request):
+    """The JSON body, or None when it is missing, malformed or not sent as JSON (silent=True)."""
+    mimetype = request.headers.get('content-type', '').split(';')[0].strip().lower()
+    if not (mimetype == 'application/json' or
+            (mimetype.startswith('application/') and mimetype.endswith('+json'))):
+        return None
+    body = await request.body()
+    stats = current_request_stats()
+    started = time.perf_counter()
+    try:
+        return json.loads(body)
+    except ValueError:
+        return None
+    finally:
+        if stats is not None:
+            stats.json_decode_time += time.perf_counter() - started
+
+
+def respond(body, status=200, headers=()):
+    """The response for a (body, status[, headers]) result of the write helpers in routes.py."""
+    if isinstance(body, str):
+        return json_response(body, status, dict(headers))
+    return jsonify(body, status, dict(headers))
+
+
+def request_versions(request):
+    """The recipe versions in If-Match; see routes.if_match_versions."""
+    return if_match_versions(parse_etags(request.headers.get('if-match')))
+
+
+class ThreadpoolHasher:
+    """
+    A PasswordHasher for code inside AsyncSession.run_sync: every hash is awaited
+    in Starlette's threadpool, so the event loop is never blocked on it.
+    """
+
+    def __init__(self, password_hasher):
+        self._hasher = password_hasher
+
+    def hash(self, password):
+        return await_only(run_in_threadpool(self._hasher.hash, password))
+
+    def verify(self, pwhash, password):
+        return await_only(run_in_threadpool(self._hasher.verify, pwhash, password))
+
+    def needs_rehash(self, pwhash):
+        return self._hasher.needs_rehash(pwhash)
+
+
+def session_serializer(secret_key):
+    """Signs and reads Flask's session cookie, so a login is valid on either app."""
+    interface = SecureCookieSessionInterface()
+    return URLSafeTimedSerializer(secret_key, salt=interface.salt, serializer=interface.serializer,
+                                  signer_kwargs={'key_derivation': interface.key_derivation,
+                                                 'digest_method': interface.digest_method})
+
+
+def init_user_loading(state):
+    user_cache = LRUCache(state.config.get('USER_CACHE_SIZE', USER_CACHE_SIZE),
+                          ttl=state.config.get('USER_CACHE_TTL', USER_CACHE_TTL))
+    state.extensions['user_cache'] = user_cache
+    state.session_serializer = session_serializer(state.config['SECRET_KEY'])
+
+    def invalidate_user(sender, user_id, **kwargs):
+        user_cache.discard(user_id)
+
+    user_changed.connect(invalidate_user, weak=False)
+
+
+async def load_current_user(state, request):
+    """The CachedUser logged in with the session cookie, or None (see auth.init_login)."""
+    cookie = request.cookies.get(SESSION_COOKIE_NAME)
+    if not cookie:
+        return None
+    try:
+        data = state.session_serializer.loads(cookie, max_age=SESSION_LIFETIME.total_seconds())
+        user_id = int(data['_user_id'])
+    except (BadSignature, KeyError, TypeError, ValueError):
+        return None
+
+    user_cache = state.extensions['user_cache']
+    cached = user_cache.get(user_id)
+    if cached is not None:
+        return cached
+
+    def load_user(session):
+        user = session.get(User, user_id)
+        return None if user is None else CachedUser.from_user(user)
+
+    generation = user_cache.generation
+    cached = await state.run(load_user)
+    if cached is not None:
+        user_cache.set(user_id, cached, generation=generation)
+    return cached
+
+
+def build_routes(state):
+    """``(path, methods, handler)`` for every route of routes.register_routes."""
+    init_user_loading(state)
+    config = state.config
+    recipe_cache = state.extensions['recipe_cache']
+    search_cache = state.extensions['search_cache']
+    search_generations = state.extensions['search_generations']
+    pantry_index = state.extensions['pantry_index']
+    similarity_index = state.extensions['similarity_index']
+    password_hasher = ThreadpoolHasher(state.password_hasher)
+    recipes_per_page = config['RECIPES_PER_PAGE']
+    max_recipes_per_page = config.get('MAX_RECIPES_PER_PAGE', MAX_PAGE_SIZE)
+    max_batch_size = config.get('MAX_RECIPE_BATCH_SIZE', MAX_RECIPE_BATCH_SIZE)
+
+    def current_user_id(request):
+        user = request.state.user
+        return user.id if user is not None else None
+
+    async def register_user(request):
+        data = await get_json(request)
+        return respond(*await state.run(register_user_body, password_hasher, data))
+
+    async def login(request):
+        data = await get_json(request)
+        result, user_id = await state.run(login_body, password_hasher, data)
+        response = respond(*result)
+        if user_id is not None:
+            response.set_cookie(
+                SESSION_COOKIE_NAME,
+                state.session_serializer.dumps({'_fresh': True, '_user_id': str(user_id)}),
+                httponly=True, samesite=None)
+        return response
+
+    async def get_recipes(request):
+        """The recipe listing; see routes.get_recipes."""
+        args = query_args(request)
+        cache_key = ('list', tuple(sorted(args.items(multi=True))))
+        entry = recipe_cache.get(cache_key)
+        if entry is not None:
+            return cached_response(request, entry)
+        generation = recipe_cache.generation
+
+        try:
+            fields = parse_fields(args.get('fields'),
+                                  default='full' if 'ids' in args else 'summary')
+        except ValueError as e:
+            return jsonify({'error': str(e)}, 400)
+
+        if 'ids' in args:
+            try:
+                recipe_ids = parse_recipe_ids(args.getlist('ids'))
+            except ValueError:
+                return jsonify({'error': 'Recipe ids must be integers'}, 400)
+            if len(recipe_ids) > max_batch_size:
+                return jsonify({'error': f'At most {max_batch_size} ids per request'}, 400)
+            try:
+                entry = make_cached_response(
+                    await state.run(recipe_batch_body, recipe_ids, fields, logger))
+            except Exception as e:
+                return jsonify({'error': 'An error occurred during recipe retrieval: {}'.format(str(e))}, 500)
+            recipe_cache.set(cache_key, entry, tags=[recipe_tag(i) for i in set(recipe_ids)],
+                             generation=generation)
+            return cached_response(request, entry)
+
+        try:
+            try:
+                listing = await state.run(recipe_listing, request.url.path, args, fields,
+                                          recipes_per_page, max_recipes_per_page, logger)
+            except ValueError as e:
+                return jsonify({'error': str(e)}, 400)
+            if listing is None:
+                return jsonify({'message': 'No recipes found'}, 404)
+
+            body, headers, tags = listing
+            entry = make_cached_response(body, headers)
+            recipe_cache.set(cache_key, entry, tags=tags, generation=generation)
+            return cached_response(request, entry)
+        except Exception as e:
+            return jsonify({'error': 'An error occurred during recipe retrieval: {}'.format(str(e))}, 500)
+
+    async def get_recipe(request):
+        recipe_id = request.path_params['recipe_id']
+        try:
+            fields = parse_fields(request.query_params.get('fields'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}, 400)
+
+        cache_key = ('recipe', recipe_id, fields)
+        entry = recipe_cache.get(cache_key)
+        if entry is not None:
+            return cached_response(request, entry)
+        generation = recipe_cache.generation
+
+        try:
+            found = await state.run(recipe_body, recipe_id, fields)
+            if found is None:
+                return jsonify({'error': 'Recipe not found'}, 404)
+
+            body, version = found
+            entry = make_cached_response(body, etag=str(version))
+            recipe_cache.set(cache_key, entry, tags=[recipe_tag(recipe_id)],
+                             generation=generation)
+            return cached_response(request, entry)
+
+        except Exception as e:
+            return jsonify({'error': 'An error occurred during recipe retrieval: {}'.format(str(e))}, 500)
+
+    async def get_recipe_batch(request):
+        try:
+            fields = parse_fields(request.query_params.get('fields'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}, 400)
+
+        data = await get_json(request)
+        if not isinstance(data, dict) or not isinstance(data.get('ids'), list):
+            return jsonify({'error': 'Body must be an object with an "ids" list'}, 400)
+        try:
+            recipe_ids = parse_recipe_ids(data['ids'])
+        except ValueError:
+            return jsonify({'error': 'Recipe ids must be integers'}, 400)
+        if len(recipe_ids) > max_batch_size:
+            return jsonify({'error': f'At most {max_batch_size} ids per request'}, 400)
+
+        try:
+            return json_response(await state.run(recipe_batch_body, recipe_ids, fields, logger))
+        except Exception as e:
+            return jsonify({'error': 'An error occurred during recipe retrieval: {}'.format(str(e))}, 500)
+
+    async def create_recipe(request):
+        data = await get_json(request)
+        return respond(*await state.run(create_recipe_body, state,
+                                        current_user_id(request), data))
+
+    async def import_recipes(request):
+        """Bulk create recipes from a streamed NDJSON body; see routes.import_recipes."""
+        user_id = current_user_id(request)
+        if user_id is None:
+            return jsonify({'error': 'User not authenticated'}, 401)
+
+        try:
+            batch_size = int(request.query_params['batch_size'])
+        except (KeyError, ValueError):
+            batch_size = None
+        batch_size = clamp_limit(batch_size, IMPORT_BATCH_SIZE, MAX_IMPORT_BATCH_SIZE)
+
+        def notify(recipe_ids):
+            for recipe_id in recipe_ids:
+                recipe_changed.send(state, recipe_id=recipe_id,
+                                    user_id=user_id, action='created')
+
+        def run_import(session):
+            return import_ndjson(session, _body_lines(request.stream()), user_id,
+                                 batch_size=batch_size, on_commit=notify)
+
+        try:
+            report = await state.run(run_import)
+            return jsonify(report.to_dict())
+        except Exception as e:
+            return jsonify({'error': f'An error occurred during recipe import: {str(e)}'}, 500)
+
+    async def export_recipes(request):
+        """Stream the recipes as NDJSON or CSV; see routes.export_recipes."""
+        args = query_args(request)
+        fmt = args.get('format', 'ndjson')
+        if fmt not in EXPORT_FORMATS:
+            return jsonify({'error': 'format must be "ndjson" or "csv"'}, 400)
+        compress = args.get('compress')
+        if compress not in (None, 'gzip'):
+            return jsonify({'error': 'compress must be "gzip"'}, 400)
+        user_id = args.get('user', type=int)
+
+        session = state.sessions()
+        chunks = export_chunks(session.sync_session, fmt=fmt, user_id=user_id)
+        headers = {'Content-Disposition': f'attachment; filename=recipes.{fmt}'}
+        if compress == 'gzip':
+            chunks = gzip_chunks(chunks)
+            headers['Content-Encoding'] = 'gzip'
+
+        async def body():
+            # One chunk per run_sync, so the loop serves other requests in between
+            try:
+                while True:
+                    chunk = await session.run_sync(lambda _: next(chunks, None))
+                    if chunk is None:
+                        break
+                    yield chunk
+            finally:
+                await session.close()
+
+        media_type = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+        return StreamingResponse(body(), media_type=media_type, headers=headers)
+
+    async def update_recipe(request):
+        data = await get_json(request)
+        return respond(*await state.run(update_recipe_body, state,
+                                        request.path_params['recipe_id'],
+                                        current_user_id(request), data,
+                                        request_versions(request)))
+
+    async def delete_recipe(request):
+        return respond(*await state.run(delete_recipe_body, state,
+                                        request.path_params['recipe_id'],
+                                        current_user_id(request)))
+
+    async def add_ingredients(request):
+        """Append ingredients; see routes.add_ingredients."""
+        data = await get_json(request)
+        return respond(*await state.run(add_ingredients_body, state,
+                                        request.path_params['recipe_id'],
+                                        current_user_id(request), data,
+                                        request_versions(request)))
+
+    async def patch_ingredients(request):
+        """Apply ingredient operations; see routes.patch_ingredients."""
+        data = await get_json(request)
+        return respond(*await state.run(patch_ingredients_body, state,
+                                        request.path_params['recipe_id'],
+                                        current_user_id(request), data,
+                                        request_versions(request)))
+
+    async def match_recipes(request):
+        """Pantry matches; see routes.match_recipes."""
+        data = await get_json(request)
+        if not isinstance(data, dict) or not isinstance(data.get('pantry'), list) \
+                or not all(isinstance(name, str) for name in data['pantry']):
+            return jsonify({'error': 'Body must be an object with a "pantry" list of names'}, 400)
+
+        max_missing = data.get('max_missing', 0)
+        if not isinstance(max_missing, int) or isinstance(max_missing, bool):
+            return jsonify({'error': 'max_missing must be an integer'}, 400)
+        limit = clamp_limit(data.get('limit') if isinstance(data.get('limit'), int) else None,
+                            recipes_per_page, max_recipes_per_page)
+
+        try:
+            return jsonify(await state.run(pantry_matches, pantry_index, data['pantry'],
+                                           max_missing, limit))
+        except ValueError as e:
+            return jsonify({'error': str(e)}, 400)
+
+    async def get_similar_recipes(request):
+        recipe_id = request.path_params['recipe_id']
+        k = clamp_limit(query_args(request).get('k', type=int), 10, max_recipes_per_page)
+        items = await state.run(similar_recipe_items, similarity_index, recipe_id, k)
+        if items is None:
+            return jsonify({'error': 'Recipe not found'}, 404)
+        return jsonify(items)
+
+    async def get_shopping_list(request):
+        """Merged ingredient totals for a meal plan; see routes.get_shopping_list."""
+        try:
+            plan = parse_plan(await get_json(request), max_batch_size)
+        except ValueError as e:
+            return jsonify({'error': str(e)}, 400)
+
+        try:
+            return jsonify(await state.run(shopping_list, plan))
+        except Exception as e:
+            return jsonify({'error': f'An error occurred building the shopping list: {str(e)}'}, 500)
+
+    async def cache_stats(request):
+        return jsonify({'recipes': recipe_cache.stats(), 'search': search_cache.stats(),
+                        'users': state.extensions['user_cache'].stats()})
+
+    async def search_recipes(request):
+        args = query_args(request)
+        keyword = args.get('q')
+        if not keyword:
+            return jsonify({'error': 'Query parameter "q" is required for search'}, 400)
+        try:
+            fields = parse_fields(args.get('fields'), default='summary')
+        except ValueError as e:
+            return jsonify({'error': str(e)}, 400)
+
+        try:
+            user_id = current_user_id(request)
+            if user_id is None:
+                return jsonify({'error': 'User not authenticated'}, 401)
+
+            page = max(args.get('page', 1, type=int), 1)
+            # The generation is read first: a write during the query leaves the
+            # result under a key that is already out of date
+            cache_key = (user_id, search_generations.get(user_id),
+                         normalize_query(state.engine.sync_engine, keyword), page, fields)
+            entry = search_cache.get(cache_key)
+            if entry is not None:
+                return cached_response(request, entry)
+
+            entry = make_cached_response(await state.run(
+                search_body, user_id, keyword, page, fields, recipes_per_page))
+            search_cache.set(cache_key, entry)
+            return cached_response(request, entry)
+
+        except Exception as e:
+            return jsonify({'error': 'An error occurred during search: ' + str(e)}, 500)
+
+    return [
+        ('/api/register', ['POST'], register_user),
+        ('/api/login', ['POST'], login),
+        ('/api/recipes', ['GET'], get_recipes),
+        ('/api/recipes', ['POST'], create_recipe),
+        # Literal paths before /api/recipes/{recipe_id:int}, as Werkzeug's ordering does
+        ('/api/recipes/batch', ['POST'], get_recipe_batch),
+        ('/api/recipes/import', ['POST'], import_recipes),
+        ('/api/recipes/export', ['GET'], export_recipes),
+        ('/api/recipes/match', ['POST'], match_recipes),
+        ('/api/recipes/search', ['GET'], search_recipes),
+        ('/api/recipes/{recipe_id:int}', ['GET'], get_recipe),
+        ('/api/recipes/{recipe_id:int}', ['PUT'], update_recipe),
+        ('/api/recipes/{recipe_id:int}', ['DELETE'], delete_recipe),
+        ('/api/recipes/{recipe_id:int}/ingredients', ['POST'], add_ingredients),
+        ('/api/recipes/{recipe_id:int}/ingredients', ['PATCH'], patch_ingredients),
+        ('/api/recipes/{recipe_id:int}/similar', ['GET'], get_similar_recipes),
+        ('/api/shopping-list', ['POST'], get_shopping_list),
+        ('/api/cache/stats', ['GET'], cache_stats),
+    ]
+
+
+def _body_lines(chunks):
+    """
+    The lines of an async iterator of byte chunks as a plain iterator, for code
+    running inside AsyncSession.run_sync (each read is awaited through its greenlet).
+    """
+    pending = b''
+    while True:
+        try:
+            chunk = await_only(chunks.__anext__())
+        except StopAsyncIteration:
+            break
+        pending += chunk
+        *lines, pending = pending.split(b'\n')
+        yield from lines
+    if pending:
+        yield pending
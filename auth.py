@@ -0,0 +1,73 @@
+from flask_login import LoginManager, UserMixin
+from sqlalchemy import event
+
+from cache import LRUCache
+from models import User
+from signals import user_changed
+
+USER_CACHE_SIZE = 10000
+USER_CACHE_TTL = 60
+
+
+class CachedUser(UserMixin):
+    """
+    The part of a User that request handlers need for authorization checks,
+    held by the user loader cache instead of a session-bound ORM object.
+    """
+
+    def __init__(self, id, username):
+        self.id = id
+        self.username = username
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(user.id, user.username)
+
+    def get_id(self):
+        return str(self.id)
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _user_written(mapper, connection, target):
+    user_changed.send(User, user_id=target.id)
+
+
+def init_login(app, session):
+    """
+    Set up Flask-Login for ``app`` with a user loader backed by a TTL-bounded
+    cache, so authenticated requests do not pay a query to rebuild current_user.
+    """
+    login_manager = LoginManager()
+    login_manager.init_app(app)
+
+    user_cache = LRUCache(app.config.get('USER_CACHE_SIZE', USER_CACHE_SIZE),
+                          ttl=app.config.get('USER_CACHE_TTL', USER_CACHE_TTL))
+    app.extensions['user_cache'] = user_cache
+
+    def invalidate_user(sender, user_id, **kwargs):
+        user_cache.discard(user_id)
+
+    user_changed.connect(invalidate_user, weak=False)
+
+    @login_manager.user_loader
+    def load_user(user_id):
+        try:
+            user_id = int(user_id)
+        except ValueError:
+            return None
+
+        cached = user_cache.get(user_id)
+        if cached is not None:
+            return cached
+
+        generation = user_cache.generation
+        user = session.get(User, user_id)
+        if user is None:
+            return None
+
+        cached = CachedUser.from_user(user)
+        user_cache.set(user_id, cached, generation=generation)
+        return cached
+
+    return login_manager
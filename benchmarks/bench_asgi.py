@@ -0,0 +1,212 @@
+"""
+Concurrency and latency of the ASGI app (asgi.py under uvicorn) against the
+Flask app (main.py under Werkzeug's threaded server) on the same catalog.
+
+Seeds a synthetic catalog like bench_routes, starts each server in its own
+process, and for every scenario and concurrency level keeps that many requests
+in flight from an asyncio client for --duration seconds. Requests/sec and
+p50/p95/p99 latencies are written to a JSON file:
+
+    pip install -r requirements-asgi.txt
+    python -m benchmarks.bench_asgi --recipes 10000 --concurrency 1,8,32,128
+
+Admission control is switched off in both servers so that neither sheds load.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+from benchmarks.bench_routes import (BENCH_PASSWORD, configure_environment, git_commit,
+                                     summarize)
+
+SERVERS = ('wsgi', 'asgi')
+SCENARIOS = ('get_recipe', 'list_page', 'search')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--recipes', type=int, default=10000,
+                        help='recipes in the synthetic catalog (default 10000)')
+    parser.add_argument('--users', type=int, default=100,
+                        help='users owning the recipes (default 100)')
+    parser.add_argument('--concurrency', default='1,8,32,128',
+                        help='comma separated requests in flight (default 1,8,32,128)')
+    parser.add_argument('--duration', type=float, default=5.0,
+                        help='seconds per scenario and concurrency level (default 5)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--database-url',
+                        help='database to use; seeded only when it has no recipes')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='disable the in-process response caches')
+    parser.add_argument('--server', action='append', choices=SERVERS,
+                        help='only benchmark the named server(s)')
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS,
+                        help='only run the named scenario(s)')
+    parser.add_argument('--output', default='bench_asgi_output.json',
+                        help='JSON file for the results (default bench_asgi_output.json)')
+    parser.add_argument('--serve', choices=SERVERS, help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def serve(server, port):
+    """Run one server in this process (started by main with --serve)."""
+    if server == 'asgi':
+        import uvicorn
+        uvicorn.run('asgi:app', host='127.0.0.1', port=port, log_level='warning')
+    else:
+        import logging
+
+        from werkzeug.serving import make_server
+
+        # Werkzeug logs every request otherwise
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+        from main import app
+        make_server('127.0.0.1', port, app, threaded=True).serve_forever()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(server):
+    port = free_port()
+    process = subprocess.Popen([sys.executable, '-m', 'benchmarks.bench_asgi',
+                                '--serve', server, '--port', str(port)])
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.1).close()
+            return process, f'http://127.0.0.1:{port}'
+        except OSError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.1)
+    process.kill()
+    raise SystemExit(f'{server} server did not start')
+
+
+def seed(args):
+    """Seed the catalog if needed and return the recipe id range."""
+    from sqlalchemy import func
+    from werkzeug.security import generate_password_hash
+
+    import db  # creates the tables
+    from benchmarks.catalog import seed_catalog
+    from models import Recipe, session
+
+    if not session.query(Recipe.id).limit(1).first():
+        print(f'Seeding {args.recipes} recipes for {args.users} users...', file=sys.stderr)
+        seed_catalog(session, args.users, args.recipes, seed=args.seed,
+                     password_hash=generate_password_hash(BENCH_PASSWORD, 'pbkdf2:sha256:1000'))
+    min_id, max_id, recipe_count = session.query(
+        func.min(Recipe.id), func.max(Recipe.id), func.count(Recipe.id)).one()
+    session.remove()
+    return min_id, max_id, recipe_count
+
+
+async def run_level(base_url, scenario, concurrency, duration, id_range, seed):
+    """Keep ``concurrency`` requests of ``scenario`` in flight for ``duration`` seconds."""
+    import httpx
+
+    min_id, max_id = id_range
+    keywords = ['garlic', 'soup', 'tomato', 'cream', 'rice', 'spicy', 'bread', 'lemon']
+    latencies = []
+    errors = 0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        login = await client.post('/api/login', json={'username': 'bench_user_0',
+                                                      'password': BENCH_PASSWORD})
+        if login.status_code != 200:
+            raise SystemExit(f'Could not log in as bench_user_0: {login.status_code}')
+
+        def request(rng):
+            if scenario == 'get_recipe':
+                return client.get(f'/api/recipes/{rng.randint(min_id, max_id)}')
+            if scenario == 'list_page':
+                return client.get('/api/recipes', params={'page': rng.randint(1, 50)})
+            return client.get('/api/recipes/search', params={'q': rng.choice(keywords),
+                                                             'page': rng.randint(1, 5)})
+
+        async def worker(number, stop_at):
+            nonlocal errors
+            rng = random.Random(seed * 1000 + number)
+            while time.perf_counter() < stop_at:
+                started = time.perf_counter()
+                response = await request(rng)
+                latencies.append(time.perf_counter() - started)
+                if response.status_code >= 400 and response.status_code != 404:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(number, started + duration)
+                               for number in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    result = summarize(latencies, errors, elapsed)
+    result['requests_per_sec'] = result.pop('ops_per_sec')
+    return result
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.serve:
+        return serve(args.serve, args.port)
+
+    # Children inherit the database and settings, admission control included
+    configure_environment(args)
+    min_id, max_id, recipe_count = seed(args)
+    levels = [int(level) for level in args.concurrency.split(',')]
+
+    results = {}
+    for server in args.server or SERVERS:
+        process, base_url = start_server(server)
+        try:
+            for scenario in args.scenario or SCENARIOS:
+                for concurrency in levels:
+                    result = asyncio.run(run_level(base_url, scenario, concurrency,
+                                                   args.duration, (min_id, max_id), args.seed))
+                    results.setdefault(server, {}).setdefault(scenario, {})[concurrency] = result
+                    print('{:<5} {:<11} c={:<4} {:>9} req/s  p50 {:>8} ms  p95 {:>8} ms  '
+                          'p99 {:>8} ms'.format(server, scenario, concurrency,
+                                                result['requests_per_sec'], result['p50_ms'],
+                                                result['p95_ms'], result['p99_ms']),
+                          file=sys.stderr)
+        finally:
+            process.terminate()
+            process.wait()
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'database': os.environ['DATABASE_URL'].split('@')[-1],
+            'recipes': recipe_count,
+            'users': args.users,
+            'duration_per_level': args.duration,
+            'response_cache': not args.no_cache,
+            'seed': args.seed,
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Wrote {args.output}', file=sys.stderr)
+    return report
+
+
+if __name__ == '__main__':
+    main()
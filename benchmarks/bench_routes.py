@@ -0,0 +1,248 @@
+"""
+Throughput and latency benchmark for the routes in register_routes.
+
+Seeds a synthetic catalog into its own database (a temporary SQLite file
+unless --database-url is given), drives every scenario through the Flask
+test client and writes ops/sec and p50/p95/p99 latencies to a JSON file so
+runs can be compared across commits and catalog sizes. Admission control is
+switched off, and a run where any scenario got a non-2xx response exits with
+status 1 after writing the file, since its numbers time the errors:
+
+    python -m benchmarks.bench_routes --recipes 10000 --output bench-10k.json
+    python -m benchmarks.bench_routes --recipes 100000 --operations 2000
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+BENCH_PASSWORD = 'benchmark-password'
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(pct / 100.0 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    to_ms = lambda value: None if value is None else round(value * 1000, 3)
+    return {
+        'operations': len(latencies),
+        'errors': errors,
+        'ops_per_sec': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'p50_ms': to_ms(percentile(latencies, 50)),
+        'p95_ms': to_ms(percentile(latencies, 95)),
+        'p99_ms': to_ms(percentile(latencies, 99)),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--recipes', type=int, default=10000,
+                        help='recipes in the synthetic catalog (default 10000)')
+    parser.add_argument('--users', type=int, default=100,
+                        help='users owning the recipes (default 100)')
+    parser.add_argument('--operations', type=int, default=500,
+                        help='requests per scenario (default 500)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--database-url',
+                        help='database to use; seeded only when it has no recipes')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='disable the in-process response, search and user caches')
+    parser.add_argument('--scenario', action='append',
+                        help='only run the named scenario(s)')
+    parser.add_argument('--output', default='bench_output.json',
+                        help='JSON file for the results (default bench_output.json)')
+    return parser.parse_args(argv)
+
+
+def configure_environment(args):
+    # Must happen before the app modules are imported: the engine is built at import
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    else:
+        directory = tempfile.mkdtemp(prefix='recipe-bench-')
+        os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(directory, 'bench.db')
+    os.environ['PASSWORD_HASH_WORKERS'] = '0'
+    # One user sends every request: its rate limit would turn most of them into 429s
+    os.environ['ADMISSION_CONTROL'] = '0'
+    os.environ.setdefault('SLOW_REQUEST_THRESHOLD_MS', str(10 ** 9))
+    if args.no_cache:
+        for setting in ('RECIPE_CACHE_SIZE', 'SEARCH_CACHE_SIZE', 'USER_CACHE_SIZE'):
+            os.environ[setting] = '0'
+
+
+def build_scenarios(client, context):
+    """Scenario name -> function(rng) performing one request and returning the response."""
+    from benchmarks.catalog import CatalogGenerator
+    from pagination import encode_cursor
+
+    generator = CatalogGenerator(seed=context['seed'] + 1)
+    limit = context['page_size']
+    last_page = max(1, context['recipe_count'] // limit)
+    min_id, max_id = context['min_id'], context['max_id']
+    own_ids = context['own_ids']
+    created = []
+    keywords = ['garlic', 'soup', 'tomato', 'cream', 'rice', 'spicy', 'bread', 'lemon']
+
+    def create(rng):
+        response = client.post('/api/recipes', json=generator.recipe(rng.randrange(10 ** 9)))
+        if response.status_code == 201:
+            created.append(response.json['id'])
+        return response
+
+    def delete(rng):
+        # Recipes made by create_recipe first, then the user's own (update_recipe and
+        # add_ingredients, which pick from own_ids, run before this scenario)
+        if created:
+            recipe_id = created.pop()
+        else:
+            recipe_id = own_ids.pop() if len(own_ids) > 1 else max_id + 1
+        return client.delete(f'/api/recipes/{recipe_id}')
+
+    return {
+        'list_page_shallow': lambda rng: client.get(
+            '/api/recipes', query_string={'page': rng.randint(1, 5)}),
+        'list_page_deep': lambda rng: client.get(
+            '/api/recipes', query_string={'page': rng.randint(max(1, last_page - 5), last_page)}),
+        'list_cursor_deep': lambda rng: client.get('/api/recipes', query_string={
+            'cursor': encode_cursor([rng.randint(max(min_id, max_id - 50 * limit), max_id)]),
+            'limit': limit}),
+        'list_ingredient_filter': lambda rng: client.get('/api/recipes', query_string={
+            'ingredient': rng.sample(['salt', 'garlic', 'onion', 'butter', 'egg'], 2)}),
+        'get_recipe': lambda rng: client.get(f'/api/recipes/{rng.randint(min_id, max_id)}'),
+        'get_recipe_batch': lambda rng: client.post('/api/recipes/batch', json={
+            'ids': [rng.randint(min_id, max_id) for _ in range(limit)]}),
+        'match_pantry': lambda rng: client.post('/api/recipes/match', json={
+            'pantry': rng.sample(generator.vocabulary[:200], 25), 'max_missing': 2}),
+        'similar_recipes': lambda rng: client.get(
+            f'/api/recipes/{rng.randint(min_id, max_id)}/similar'),
+        'shopping_list_week': lambda rng: client.post('/api/shopping-list', json={
+            'recipes': [{'id': rng.randint(min_id, max_id), 'multiplier': rng.choice([1, 2])}
+                        for _ in range(50)]}),
+        'search': lambda rng: client.get('/api/recipes/search',
+                                         query_string={'q': rng.choice(keywords)}),
+        'create_recipe': create,
+        'update_recipe': lambda rng: client.put(
+            f'/api/recipes/{rng.choice(own_ids)}',
+            json={'title': f'Updated {rng.randrange(10 ** 6)}',
+                  'ingredients': generator.ingredients()}),
+        'add_ingredients': lambda rng: client.post(
+            f'/api/recipes/{rng.choice(own_ids)}/ingredients',
+            json={'ingredients': [{'name': 'salt', 'quantity': '1 pinch'}]}),
+        'delete_recipe': delete,
+    }
+
+
+def run_scenario(scenario, operations, rng):
+    latencies = []
+    statuses = {}
+    started = time.perf_counter()
+    for _ in range(operations):
+        request_started = time.perf_counter()
+        response = scenario(rng)
+        latencies.append(time.perf_counter() - request_started)
+        if not 200 <= response.status_code < 300:
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+    result = summarize(latencies, sum(statuses.values()), time.perf_counter() - started)
+    # Non-2xx responses by status code, e.g. {"429": 150}
+    result['error_statuses'] = {str(status): count for status, count in sorted(statuses.items())}
+    return result
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    configure_environment(args)
+
+    from sqlalchemy import func
+    from werkzeug.security import generate_password_hash
+
+    from benchmarks.catalog import seed_catalog
+    from main import app
+    from models import Recipe, User, session
+
+    if not session.query(Recipe.id).limit(1).first():
+        print(f'Seeding {args.recipes} recipes for {args.users} users...', file=sys.stderr)
+        seeding_started = time.perf_counter()
+        seed_catalog(session, args.users, args.recipes, seed=args.seed,
+                     password_hash=generate_password_hash(BENCH_PASSWORD, 'pbkdf2:sha256:1000'))
+        print(f'Seeded in {time.perf_counter() - seeding_started:.1f}s', file=sys.stderr)
+
+    user = session.query(User).filter_by(username='bench_user_0').one()
+    min_id, max_id, recipe_count = session.query(
+        func.min(Recipe.id), func.max(Recipe.id), func.count(Recipe.id)).one()
+    context = {
+        'seed': args.seed,
+        'page_size': app.config['RECIPES_PER_PAGE'],
+        'recipe_count': recipe_count,
+        'min_id': min_id,
+        'max_id': max_id,
+        'own_ids': [recipe_id for (recipe_id,) in session.query(Recipe.id)
+                    .filter(Recipe.created_by == user.id).limit(1000)],
+    }
+    session.remove()
+
+    client = app.test_client()
+    login = client.post('/api/login', json={'username': 'bench_user_0',
+                                             'password': BENCH_PASSWORD})
+    if login.status_code != 200:
+        raise SystemExit(f'Could not log in as bench_user_0: {login.status_code}')
+
+    scenarios = build_scenarios(client, context)
+    selected = args.scenario or list(scenarios)
+    results = {}
+    for name in selected:
+        rng = random.Random(args.seed)
+        results[name] = run_scenario(scenarios[name], args.operations, rng)
+        print('{:<24} {:>9} ops/s  p50 {:>8} ms  p95 {:>8} ms  p99 {:>8} ms'.format(
+            name, results[name]['ops_per_sec'], results[name]['p50_ms'],
+            results[name]['p95_ms'], results[name]['p99_ms']), file=sys.stderr)
+        if results[name]['errors']:
+            print(f'  WARNING: {results[name]["errors"]} of {args.operations} responses were '
+                  f'not 2xx {results[name]["error_statuses"]}', file=sys.stderr)
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'database': app.config['DATABASE_URL'].split('@')[-1],
+            'recipes': recipe_count,
+            'users': args.users,
+            'operations_per_scenario': args.operations,
+            'response_cache': not args.no_cache,
+            'seed': args.seed,
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Wrote {args.output}', file=sys.stderr)
+    failed = [name for name, result in results.items() if result['errors']]
+    if failed:
+        raise SystemExit(f'Scenarios with non-2xx responses: {", ".join(failed)}')
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+Per-request cost of recipe body validation for growing ingredient lists.
+
+Times validation.load_new_recipe, which checks ingredients in one loop,
+against a straightforward marshmallow schema with a Nested(many=True)
+ingredient schema, and writes the median and p95 per call to a JSON file:
+
+    python -m benchmarks.bench_validation --sizes 10,100,1000,10000
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+from datetime import datetime, timezone
+
+from marshmallow import EXCLUDE, Schema, fields
+
+from benchmarks.bench_routes import git_commit, percentile
+
+
+class NestedIngredientSchema(Schema):
+    class Meta:
+        unknown = EXCLUDE
+
+    name = fields.String(required=True)
+    quantity = fields.Raw(allow_none=True)
+
+
+class NestedRecipeSchema(Schema):
+    class Meta:
+        unknown = EXCLUDE
+
+    title = fields.String(required=True)
+    description = fields.String(required=True, allow_none=True)
+    instructions = fields.String(required=True, allow_none=True)
+    ingredients = fields.List(fields.Nested(NestedIngredientSchema), required=True)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='10,100,1000,10000',
+                        help='comma-separated ingredient list sizes (default 10,100,1000,10000)')
+    parser.add_argument('--repeat', type=int, default=200,
+                        help='calls per size and validator (default 200)')
+    parser.add_argument('--output', default='bench_validation.json',
+                        help='JSON file for the results (default bench_validation.json)')
+    return parser.parse_args(argv)
+
+
+def recipe_body(size):
+    return {'title': 'Benchmark', 'description': 'desc', 'instructions': 'cook',
+            'ingredients': [{'name': f'ingredient {i}', 'quantity': f'{i} g'}
+                            for i in range(size)]}
+
+
+def time_calls(validate, body, repeat):
+    # Fewer calls for the largest lists keep the run short
+    repeat = max(5, min(repeat, 200000 // max(1, len(body['ingredients']))))
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        validate(body)
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    return {'calls': repeat,
+            'p50_us': round(percentile(latencies, 50) * 1e6, 1),
+            'p95_us': round(percentile(latencies, 95) * 1e6, 1)}
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    from validation import load_new_recipe
+
+    nested = NestedRecipeSchema()
+    validators = {'load_new_recipe': load_new_recipe, 'nested_schema': nested.load}
+    results = {}
+    for size in (int(value) for value in args.sizes.split(',')):
+        body = recipe_body(size)
+        results[size] = {name: time_calls(validate, body, args.repeat)
+                         for name, validate in validators.items()}
+        print('{:>6} ingredients  load_new_recipe p50 {:>10} us  nested p50 {:>10} us'.format(
+            size, results[size]['load_new_recipe']['p50_us'],
+            results[size]['nested_schema']['p50_us']), file=sys.stderr)
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Wrote {args.output}', file=sys.stderr)
+    return report
+
+
+if __name__ == '__main__':
+    main()
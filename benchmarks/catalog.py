@@ -0,0 +1,100 @@
+"""
+Synthetic recipe catalog for benchmarks.
+
+Ingredient popularity follows a Zipf-like distribution and the number of
+ingredients per recipe is log-normal (median around 8, long tail up to 40),
+which is roughly what real recipe collections look like.
+"""
+import json
+import random
+
+ADJECTIVES = ['quick', 'spicy', 'creamy', 'roasted', 'classic', 'smoky', 'crispy',
+              'lemony', 'rustic', 'garlicky', 'sweet', 'savory', 'herbed', 'golden']
+DISHES = ['soup', 'stew', 'salad', 'pasta', 'curry', 'risotto', 'tart', 'bread',
+          'pie', 'noodles', 'tacos', 'casserole', 'skillet', 'bowl', 'cake']
+BASE_INGREDIENTS = ['salt', 'pepper', 'olive oil', 'garlic', 'onion', 'butter', 'flour',
+                    'sugar', 'egg', 'milk', 'tomato', 'basil', 'lemon', 'rice', 'chicken',
+                    'carrot', 'potato', 'cumin', 'ginger', 'parsley', 'cream', 'cheese']
+UNITS = ['cup', 'cups', 'tbsp', 'tsp', 'g', 'kg', 'ml', 'l', 'oz', 'lb', 'pinch', '']
+QUANTITIES = ['1', '2', '3', '1/2', '1/4', '3/4', '1 1/2', '100', '250', '500']
+
+
+def ingredient_vocabulary(size):
+    names = list(BASE_INGREDIENTS)
+    i = 0
+    while len(names) < size:
+        names.append(f'{BASE_INGREDIENTS[i % len(BASE_INGREDIENTS)]} variety {i}')
+        i += 1
+    return names[:size]
+
+
+class CatalogGenerator:
+    def __init__(self, seed=0, vocabulary_size=2000):
+        self.random = random.Random(seed)
+        self.vocabulary = ingredient_vocabulary(vocabulary_size)
+        # Zipf weights: the k-th most popular ingredient is used ~1/k as often
+        self.weights = [1.0 / (rank + 1) for rank in range(len(self.vocabulary))]
+
+    def ingredient_count(self):
+        return max(1, min(40, int(self.random.lognormvariate(2.0, 0.5))))
+
+    def ingredients(self):
+        count = self.ingredient_count()
+        names = set()
+        while len(names) < count:
+            names.update(self.random.choices(self.vocabulary, self.weights, k=count - len(names)))
+        result = []
+        for name in names:
+            unit = self.random.choice(UNITS)
+            quantity = f'{self.random.choice(QUANTITIES)} {unit}'.strip()
+            result.append({'name': name, 'quantity': quantity if self.random.random() > 0.05 else ''})
+        return result
+
+    def recipe(self, number):
+        title = '{} {} {} #{}'.format(self.random.choice(ADJECTIVES),
+                                      self.random.choice(BASE_INGREDIENTS),
+                                      self.random.choice(DISHES), number)
+        steps = self.random.randint(3, 12)
+        return {
+            'title': title.capitalize(),
+            'description': 'A {} dish for {} people.'.format(
+                self.random.choice(ADJECTIVES), self.random.randint(1, 8)),
+            'instructions': ' '.join(f'Step {i + 1}: ' + 'stir and cook. ' * self.random.randint(1, 6)
+                                     for i in range(steps)),
+            'ingredients': self.ingredients(),
+        }
+
+    def ndjson_lines(self, count, start=0):
+        for number in range(start, start + count):
+            yield json.dumps(self.recipe(number))
+
+
+def seed_catalog(session, users, recipes, seed=0, batch_size=1000, password_hash='!'):
+    """
+    Create ``users`` users and ``recipes`` recipes spread evenly across them,
+    through the same batched import path as POST /api/recipes/import.
+    Returns the list of user ids.
+    """
+    from bulk import import_ndjson
+    from models import User
+
+    user_ids = []
+    for number in range(users):
+        user = User(username=f'bench_user_{number}', email=f'bench_user_{number}@example.com',
+                    password=password_hash)
+        session.add(user)
+        session.flush()
+        user_ids.append(user.id)
+    session.commit()
+
+    generator = CatalogGenerator(seed=seed)
+    per_user, remainder = divmod(recipes, max(users, 1))
+    start = 0
+    for index, user_id in enumerate(user_ids):
+        count = per_user + (1 if index < remainder else 0)
+        report = import_ndjson(session, generator.ndjson_lines(count, start), user_id,
+                               batch_size=batch_size)
+        if report.failed:
+            raise RuntimeError(f'Seeding failed: {report.errors[:3]}')
+        start += count
+    return user_ids
@@ -0,0 +1,206 @@
+"""
+Bulk import and export of recipes as NDJSON (one JSON recipe per line) or CSV.
+Both directions work in batches, so memory use depends on the batch size
+and not on the size of the catalog.
+"""
+import csv
+import io
+import json
+import logging
+import zlib
+
+from sqlalchemy import insert
+
+from models import Recipe, RecipeIngredient, is_named_ingredient, normalize_ingredients
+from validation import load_new_recipe
+
+IMPORT_BATCH_SIZE = 500
+MAX_IMPORT_BATCH_SIZE = 5000
+
+EXPORT_BATCH_SIZE = 1000
+EXPORT_FORMATS = ('ndjson', 'csv')
+CSV_FIELDS = ['id', 'title', 'description', 'ingredients', 'instructions', 'created_by']
+
+logger = logging.getLogger(__name__)
+
+# Only the first errors are kept, so a bad file cannot exhaust memory
+MAX_REPORTED_ERRORS = 1000
+
+
+class ImportReport:
+    def __init__(self):
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+
+    def add_error(self, line_number, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line_number, 'error': message})
+
+    def to_dict(self):
+        return {
+            'imported': self.imported,
+            'failed': self.failed,
+            'errors': self.errors,
+            'errors_truncated': self.failed > len(self.errors),
+        }
+
+
+def import_ndjson(session, lines, user_id, batch_size=IMPORT_BATCH_SIZE, on_commit=None):
+    """
+    Create recipes owned by ``user_id`` from an iterable of NDJSON lines
+    (str or bytes). Each record is validated with the same rules as
+    POST /api/recipes. Valid records are inserted ``batch_size`` at a time,
+    one transaction per batch, and ``on_commit`` is called with the ids of
+    every committed batch. Returns an ImportReport.
+    """
+    report = ImportReport()
+    batch = []
+    batch_lines = []
+    batch_rows = []
+
+    def flush():
+        session.add_all(batch)
+        try:
+            session.flush()
+            recipe_ids = [recipe.id for recipe in batch]
+            # The ingredient rows need no ids back, so they skip the unit of
+            # work and go in as one executemany
+            rows = [dict(values, recipe_id=recipe_id)
+                    for recipe_id, recipe_rows in zip(recipe_ids, batch_rows)
+                    for values in recipe_rows]
+            if rows:
+                session.execute(insert(RecipeIngredient.__table__), rows)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            for line_number in batch_lines:
+                report.add_error(line_number, f'Batch insert failed: {str(e)}')
+        else:
+            report.imported += len(batch)
+            if on_commit is not None:
+                on_commit(recipe_ids)
+        batch.clear()
+        batch_lines.clear()
+        batch_rows.clear()
+
+    for line_number, line in enumerate(lines, 1):
+        try:
+            if isinstance(line, bytes):
+                line = line.decode('utf-8')
+            line = line.strip()
+            if not line:
+                continue
+            data = json.loads(line)
+        except ValueError:
+            report.add_error(line_number, 'Invalid JSON')
+            continue
+
+        data, errors, message = load_new_recipe(data)
+        if errors:
+            report.add_error(line_number, message)
+            continue
+
+        # As Recipe.set_ingredients, with the rows kept out of the session
+        ingredients = normalize_ingredients(data['ingredients'])
+        recipe = Recipe(
+            title=data['title'],
+            description=data['description'],
+            ingredients=json.dumps(ingredients),
+            instructions=data['instructions'],
+            created_by=user_id
+        )
+        batch.append(recipe)
+        batch_lines.append(line_number)
+        batch_rows.append([RecipeIngredient.column_values(position, ingredient)
+                           for position, ingredient in enumerate(ingredients)
+                           if is_named_ingredient(ingredient)])
+
+        if len(batch) >= batch_size:
+            flush()
+
+    if batch:
+        flush()
+
+    return report
+
+
+def export_rows(session, user_id=None, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Iterate over all recipes, or the recipes of ``user_id``, in id order.
+    Rows are fetched ``batch_size`` at a time through yield_per, which uses a
+    server-side cursor where the database supports one.
+    """
+    query = session.query(
+        Recipe.id, Recipe.title, Recipe.description, Recipe.ingredients,
+        Recipe.instructions, Recipe.created_by, Recipe.payload
+    ).order_by(Recipe.id)
+    if user_id is not None:
+        query = query.filter(Recipe.created_by == user_id)
+    return query.yield_per(batch_size)
+
+
+def _batched(lines, batch_size):
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= batch_size:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+def _ndjson_lines(session, rows):
+    for row in rows:
+        if row.payload is not None:
+            yield row.payload + '\n'
+            continue
+        # Legacy rows without a stored payload
+        try:
+            yield session.get(Recipe, row.id).to_json() + '\n'
+        except ValueError as e:
+            logger.error(f'Skipping recipe with ID {row.id} in export: {str(e)}')
+
+
+def _csv_lines(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def take():
+        line = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return line
+
+    writer.writerow(CSV_FIELDS)
+    yield take()
+    for row in rows:
+        writer.writerow([row.id, row.title, row.description, row.ingredients,
+                         row.instructions, row.created_by])
+        yield take()
+
+
+def export_chunks(session, fmt='ndjson', user_id=None, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Yield the export as text chunks of about ``batch_size`` recipes each.
+    The CSV header is yielded on its own so output starts immediately.
+    """
+    rows = export_rows(session, user_id=user_id, batch_size=batch_size)
+    if fmt == 'csv':
+        lines = _csv_lines(rows)
+        yield next(lines)
+    else:
+        lines = _ndjson_lines(session, rows)
+    yield from _batched(lines, batch_size)
+
+
+def gzip_chunks(chunks, level=6):
+    """Compress text chunks into a gzip stream on the fly."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,144 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+CachedResponse = namedtuple('CachedResponse', ['body', 'etag', 'headers'])
+
+
+def make_cached_response(body, headers=(), etag=None):
+    """
+    Pair a response body and its extra headers with a strong ETag: ``etag`` when
+    given (a recipe version), else a digest of the exact bytes, headers included
+    so that changed metadata is never a 304.
+    """
+    if etag is not None:
+        return CachedResponse(body, etag, tuple(headers))
+    digest = hashlib.sha1(body.encode())
+    for name, value in headers:
+        digest.update(f'\n{name}: {value}'.encode())
+    return CachedResponse(body, digest.hexdigest(), tuple(headers))
+
+
+class LRUCache:
+    """
+    Thread-safe, size-bounded mapping with least-recently-used eviction.
+
+    Entries can carry tags so that a write can drop exactly the entries it
+    affects with ``invalidate(tag)``. Every invalidation bumps a generation
+    number; a reader that captured ``generation`` before going to the
+    database passes it to ``set`` so a value computed from data that has
+    been invalidated in the meantime is never stored.
+
+    With ``ttl`` (seconds), entries also expire that long after being stored.
+
+    The cache is per process: every worker keeps and invalidates its own.
+    """
+
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value, _, expires_at = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._discard(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, tags=(), generation=None):
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            if key in self._entries:
+                self._discard(key)
+            expires_at = None if self.ttl is None else time.monotonic() + self.ttl
+            self._entries[key] = (value, tuple(tags), expires_at)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                oldest = next(iter(self._entries))
+                self._discard(oldest)
+                self.evictions += 1
+
+    def discard(self, key):
+        with self._lock:
+            self.generation += 1
+            self._discard(key)
+
+    def invalidate(self, *tags):
+        with self._lock:
+            self.generation += 1
+            for tag in tags:
+                for key in self._tags.pop(tag, ()):
+                    self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._tags.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+            }
+            if self.ttl is not None:
+                stats['expirations'] = self.expirations
+                stats['ttl'] = self.ttl
+            return stats
+
+    def _discard(self, key):
+        _, tags, _ = self._entries.pop(key, (None, (), None))
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+class WriteGenerations:
+    """
+    Per-owner write counters. A cache key that includes its owner's current
+    generation stops matching as soon as the owner writes again, so stale entries
+    are never found and simply age out of the LRU, without any scan.
+    """
+
+    def __init__(self):
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def get(self, owner):
+        return self._generations.get(owner, 0)
+
+    def bump(self, owner):
+        with self._lock:
+            self._generations[owner] = self._generations.get(owner, 0) + 1
@@ -0,0 +1,191 @@
+"""
+Recipe writes shared between processes.
+
+Each worker keeps its own response caches and in-memory indexes, kept current
+through the recipe_changed signal, and a signal only reaches receivers in the
+process that sent it. So a flush hook also records every recipe write in
+recipe_changes, in the same transaction as the write, and every app follows
+that table with a ChangeFeed: at most every CHANGE_POLL_INTERVAL_MS it reads
+the rows added since its last poll and sends recipe_changed for those written
+by other processes (other workers, the CLI import and migration commands), so
+they invalidate exactly what the same write would have invalidated locally.
+
+Only the recent past is needed; prune_changes trims the table. A feed that
+finds changes it had not read yet pruned away resets its caches and indexes.
+"""
+import os
+import threading
+import time
+import uuid
+
+from sqlalchemy import event, func, insert, inspect, select
+from sqlalchemy.orm import Session
+
+from models import Recipe, RecipeChange, RecipeIngredient
+from signals import recipe_changed
+
+CHANGE_POLL_INTERVAL_MS = 1000
+CHANGE_BATCH_SIZE = 1000
+# Changes kept by prune_changes
+CHANGES_KEPT = 100000
+# Concurrent transactions may commit their ids out of order, so ids this far
+# below the newest one read are looked for again on the next poll
+CHANGE_LOOKBACK = 100
+
+_changes = RecipeChange.__table__
+_recipes = Recipe.__table__
+
+
+def _new_origin():
+    return uuid.uuid4().hex
+
+
+# Marks the changes written by this process; a forked worker gets its own
+ORIGIN = _new_origin()
+
+
+def _reset_origin():
+    global ORIGIN
+    ORIGIN = _new_origin()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_origin)
+
+
+def _loaded(obj, key):
+    # Read without a load: a deleted row can no longer be refreshed
+    return inspect(obj).dict.get(key)
+
+
+@event.listens_for(Session, 'after_flush')
+def _record_flushed_changes(session, flush_context):
+    changes = {}  # recipe id -> [action, user id, ingredients changed]
+    for recipes, action in ((session.new, 'created'), (session.deleted, 'deleted')):
+        for recipe in recipes:
+            if isinstance(recipe, Recipe):
+                changes[_loaded(recipe, 'id')] = [action, _loaded(recipe, 'created_by'), True]
+    for recipe in session.dirty:
+        if isinstance(recipe, Recipe) and _loaded(recipe, 'id') not in changes \
+                and session.is_modified(recipe, include_collections=False):
+            changes[recipe.id] = ['updated', _loaded(recipe, 'created_by'),
+                                  inspect(recipe).attrs.ingredients.history.has_changes()]
+    # Ingredient rows written without the recipe, by an in-place append or a backfill
+    for rows in (session.new, session.dirty, session.deleted):
+        for row in rows:
+            recipe_id = _loaded(row, 'recipe_id') if isinstance(row, RecipeIngredient) else None
+            if recipe_id is not None:
+                changes.setdefault(recipe_id, ['updated', None, True])[2] = True
+    if not changes:
+        return
+
+    connection = session.connection()
+    unowned = [recipe_id for recipe_id, (_, user_id, _) in changes.items() if user_id is None]
+    if unowned:
+        owners = dict(connection.execute(select(_recipes.c.id, _recipes.c.created_by)
+                                         .where(_recipes.c.id.in_(unowned))).all())
+        for recipe_id in unowned:
+            changes[recipe_id][1] = owners.get(recipe_id)
+    connection.execute(insert(_changes), [
+        {'recipe_id': recipe_id, 'user_id': user_id, 'action': action,
+         'ingredients_changed': ingredients_changed, 'origin': ORIGIN}
+        for recipe_id, (action, user_id, ingredients_changed) in changes.items()])
+
+
+class ChangeFeed:
+    """
+    Follows recipe_changes for one app. ``poll`` sends recipe_changed from
+    ``sender`` for each change another process committed since the last poll,
+    and calls ``on_reset`` instead when changes may have been missed.
+    """
+
+    def __init__(self, sender, interval_ms=CHANGE_POLL_INTERVAL_MS, on_reset=None):
+        self.sender = sender
+        self.interval = interval_ms / 1000
+        self.on_reset = on_reset
+        self.replayed = 0
+        self.resets = 0
+        self._newest = None  # the highest id read, None until the first poll
+        self._seen = set()   # the ids read within CHANGE_LOOKBACK of it
+        self._next_poll = 0.0
+        self._lock = threading.Lock()
+
+    def due(self):
+        """Whether ``poll`` would query the database now; cheap enough for every request."""
+        return time.monotonic() >= self._next_poll
+
+    def poll(self, session):
+        """Replay the changes of other processes since the last poll. Returns how many."""
+        # One thread polls at a time; the others carry on with what they have
+        if not self._lock.acquire(blocking=False):
+            return 0
+        try:
+            if not self.due():
+                return 0
+            self._next_poll = time.monotonic() + self.interval
+            began = not session.in_transaction()
+            try:
+                return self._poll(session)
+            finally:
+                if began:
+                    # Do not hold the read transaction open into the request
+                    session.rollback()
+        finally:
+            self._lock.release()
+
+    def stats(self):
+        return {'replayed': self.replayed, 'resets': self.resets,
+                'position': self._newest, 'interval_ms': int(self.interval * 1000)}
+
+    def _poll(self, session):
+        oldest, newest = session.execute(
+            select(func.min(_changes.c.id), func.max(_changes.c.id))).one()
+        if self._newest is None:
+            # Everything cached so far was read after these changes
+            self._start(session, newest or 0)
+            return 0
+        if (newest or 0) < self._newest or (oldest is not None and oldest > self._newest + 1):
+            # The table was recreated, or pruned past changes not read yet
+            self._start(session, newest or 0)
+            self.resets += 1
+            if self.on_reset is not None:
+                self.on_reset()
+            return 0
+
+        replayed = 0
+        after = self._newest - CHANGE_LOOKBACK
+        while True:
+            rows = session.query(RecipeChange).filter(RecipeChange.id > after) \
+                .order_by(RecipeChange.id).limit(CHANGE_BATCH_SIZE).all()
+            for change in rows:
+                if change.id in self._seen:
+                    continue
+                self._seen.add(change.id)
+                self._newest = max(self._newest, change.id)
+                if change.origin != ORIGIN:
+                    recipe_changed.send(self.sender, recipe_id=change.recipe_id,
+                                        user_id=change.user_id, action=change.action,
+                                        ingredients_changed=change.ingredients_changed)
+                    replayed += 1
+            if len(rows) < CHANGE_BATCH_SIZE:
+                break
+            after = rows[-1].id
+        self._seen = {change_id for change_id in self._seen
+                      if change_id > self._newest - CHANGE_LOOKBACK}
+        self.replayed += replayed
+        return replayed
+
+    def _start(self, session, newest):
+        self._newest = newest
+        self._seen = set(session.scalars(select(_changes.c.id).where(
+            _changes.c.id > newest - CHANGE_LOOKBACK)))
+
+
+def prune_changes(session, keep=CHANGES_KEPT):
+    """Delete all but the newest ``keep`` changes. Returns the number deleted."""
+    newest = session.scalar(select(func.max(_changes.c.id)))
+    if newest is None:
+        return 0
+    deleted = session.execute(_changes.delete().where(_changes.c.id <= newest - keep)).rowcount
+    session.commit()
+    return deleted
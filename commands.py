@@ -0,0 +1,112 @@
+import click
+
+from bulk import (EXPORT_BATCH_SIZE, EXPORT_FORMATS, IMPORT_BATCH_SIZE,
+                  export_chunks, gzip_chunks, import_ndjson)
+from changes import CHANGES_KEPT, prune_changes
+from counts import rebuild_recipe_counts
+from migrations import (backfill_ingredient_amounts, backfill_recipe_ingredients,
+                        normalize_legacy_recipes)
+from models import User
+from search import rebuild_index
+from signals import recipe_changed
+from similarity import SIGNATURE_BATCH_SIZE, rebuild_signatures
+
+
+def register_commands(app, session):
+    @app.cli.command('rebuild-search-index')
+    def rebuild_search_index():
+        """Rebuild the full-text search index from the recipes table."""
+        count = rebuild_index(session)
+        click.echo(f'Indexed {count} recipe(s)')
+
+    @app.cli.command('backfill-ingredients')
+    def backfill_ingredients():
+        """Populate recipe_ingredients from existing ingredient blobs."""
+        count = backfill_recipe_ingredients(session)
+        click.echo(f'Backfilled {count} recipe(s)')
+
+    @app.cli.command('backfill-amounts')
+    def backfill_amounts():
+        """Parse the quantities of ingredient rows stored without amounts."""
+        count = backfill_ingredient_amounts(session)
+        click.echo(f'Parsed {count} ingredient quantity(ies)')
+
+    @app.cli.command('normalize-recipes')
+    def normalize_recipes():
+        """Normalize legacy ingredient blobs and store serialized payloads."""
+        normalized, skipped = normalize_legacy_recipes(session)
+        click.echo(f'Normalized {normalized} recipe(s), skipped {skipped} invalid recipe(s)')
+
+    @app.cli.command('rebuild-counts')
+    def rebuild_counts():
+        """Recount the recipe counters behind listing totals."""
+        count = rebuild_recipe_counts(session)
+        click.echo(f'Counted {count} recipe(s)')
+
+    @app.cli.command('rebuild-similarity')
+    @click.option('--workers', type=int, default=None,
+                  help='Hashing processes (default: one per core, 0 for none).')
+    @click.option('--batch-size', default=SIGNATURE_BATCH_SIZE, show_default=True,
+                  help='Recipes hashed per task.')
+    def rebuild_similarity(workers, batch_size):
+        """Recompute the MinHash signatures used by /api/recipes/<id>/similar."""
+        count = rebuild_signatures(session, workers=workers, batch_size=max(batch_size, 1))
+        click.echo(f'Computed {count} signature(s)')
+
+    @app.cli.command('prune-recipe-changes')
+    @click.option('--keep', default=CHANGES_KEPT, show_default=True,
+                  help='Newest recipe changes to keep.')
+    def prune_recipe_changes(keep):
+        """Delete old entries of the recipe change log the app processes follow."""
+        count = prune_changes(session, keep=max(keep, 0))
+        click.echo(f'Deleted {count} recipe change(s)')
+
+    @app.cli.command('import-recipes')
+    @click.argument('source', type=click.File('rb'))
+    @click.option('--user', 'username', required=True,
+                  help='Username that will own the imported recipes.')
+    @click.option('--batch-size', default=IMPORT_BATCH_SIZE, show_default=True,
+                  help='Recipes inserted per transaction.')
+    def import_recipes(source, username, batch_size):
+        """Import recipes from an NDJSON file (use - for stdin)."""
+        user = session.query(User).filter_by(username=username.lower()).first()
+        if user is None:
+            raise click.ClickException(f'Unknown user "{username}"')
+        user_id = user.id
+
+        def notify(recipe_ids):
+            for recipe_id in recipe_ids:
+                recipe_changed.send(app, recipe_id=recipe_id,
+                                    user_id=user_id, action='created')
+
+        report = import_ndjson(session, source, user_id,
+                               batch_size=max(batch_size, 1), on_commit=notify)
+        for error in report.errors:
+            click.echo(f'line {error["line"]}: {error["error"]}', err=True)
+        click.echo(f'Imported {report.imported} recipe(s), {report.failed} failed')
+
+    @app.cli.command('export-recipes')
+    @click.argument('output', type=click.File('wb'), default='-')
+    @click.option('--format', 'fmt', type=click.Choice(EXPORT_FORMATS),
+                  default='ndjson', show_default=True)
+    @click.option('--user', 'username', help='Only export recipes of this user.')
+    @click.option('--gzip', 'compress', is_flag=True, help='Gzip the output.')
+    @click.option('--batch-size', default=EXPORT_BATCH_SIZE, show_default=True,
+                  help='Recipes fetched per round trip.')
+    def export_recipes(output, fmt, username, compress, batch_size):
+        """Stream all recipes to OUTPUT (default stdout) as NDJSON or CSV."""
+        user_id = None
+        if username is not None:
+            user = session.query(User).filter_by(username=username.lower()).first()
+            if user is None:
+                raise click.ClickException(f'Unknown user "{username}"')
+            user_id = user.id
+
+        chunks = export_chunks(session, fmt=fmt, user_id=user_id,
+                               batch_size=max(batch_size, 1))
+        if compress:
+            for data in gzip_chunks(chunks):
+                output.write(data)
+        else:
+            for chunk in chunks:
+                output.write(chunk.encode())
@@ -0,0 +1,123 @@
+"""
+Recipe counts for listing metadata, without COUNT(*) scans.
+
+recipe_counts holds the number of recipes in the whole catalog (under
+ALL_RECIPES) and per user. A flush hook adjusts the counters for the recipes
+inserted or deleted by that flush, in the same transaction, so the counts
+commit or roll back with the recipes themselves. Each user's counter is created
+with the user, and initialize_recipe_counts creates those missing from an older
+database at startup. Reads never write: a scope without a counter, such as
+?user= with an id that is not a user, is counted live with COUNT(*). A counter
+still missing when it is written is initialized from one COUNT(*) there.
+"""
+from collections import Counter
+
+from sqlalchemy import event, exists, func, insert, inspect, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from models import Recipe, RecipeCount, User
+
+ALL_RECIPES = 0
+
+_counts = RecipeCount.__table__
+_recipes = Recipe.__table__
+# Inserts supporting ON CONFLICT DO NOTHING
+_DIALECT_INSERTS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+
+def _actual_count(scope):
+    query = select(func.count()).select_from(_recipes)
+    if scope != ALL_RECIPES:
+        query = query.where(_recipes.c.created_by == scope)
+    return query.scalar_subquery()
+
+
+def _insert_missing(connection):
+    dialect_insert = _DIALECT_INSERTS.get(connection.dialect.name)
+    if dialect_insert is None:
+        return insert(_counts)
+    # A concurrent request or process may have initialized the counter first
+    return dialect_insert(_counts).on_conflict_do_nothing()
+
+
+def _initialize(connection, scope):
+    """Create the counter from one COUNT(*). False when it already existed."""
+    values = {'user_id': scope, 'count': _actual_count(scope)}
+    return connection.execute(_insert_missing(connection).values(values)).rowcount == 1
+
+
+def _update(connection, scope, delta):
+    return connection.execute(update(_counts).where(_counts.c.user_id == scope)
+                              .values(count=_counts.c.count + delta)).rowcount
+
+
+def _adjust(connection, scope, delta):
+    # Counted after the flush, so a counter initialized here includes the change;
+    # one initialized concurrently by another transaction does not
+    if not _update(connection, scope, delta) and not _initialize(connection, scope):
+        _update(connection, scope, delta)
+
+
+def _owner(recipe):
+    # Read without a load: a deleted recipe can no longer be refreshed
+    return inspect(recipe).dict.get('created_by')
+
+
+@event.listens_for(Session, 'after_flush')
+def _count_flushed_recipes(session, flush_context):
+    deltas = Counter()
+    for recipes, delta in ((session.new, 1), (session.deleted, -1)):
+        for recipe in recipes:
+            if isinstance(recipe, Recipe):
+                deltas[ALL_RECIPES] += delta
+                owner = _owner(recipe)
+                if owner is not None:
+                    deltas[owner] += delta
+    # New users start with a counter, unless their recipes just created it
+    users = [user.id for user in session.new
+             if isinstance(user, User) and user.id not in deltas]
+    if not deltas and not users:
+        return
+    connection = session.connection()
+    for scope, delta in deltas.items():
+        if delta:
+            _adjust(connection, scope, delta)
+    for user_id in users:
+        _initialize(connection, user_id)
+
+
+def recipe_count(session, user_id=None):
+    """Number of recipes, of ``user_id`` only when given, from the maintained counters."""
+    scope = ALL_RECIPES if user_id is None else user_id
+    count = session.query(RecipeCount.count).filter(RecipeCount.user_id == scope).scalar()
+    if count is None:
+        # Anyone may list ?user=<any id>, so no counter is created from here
+        count = session.scalar(select(_actual_count(scope)))
+    return count
+
+
+def initialize_recipe_counts(connection):
+    """
+    Create the missing counters, of the whole catalog and of every user, each
+    from one COUNT(*). Returns the number created.
+    """
+    users = User.__table__
+    created = 0
+    if connection.scalar(select(_counts.c.user_id).where(_counts.c.user_id == ALL_RECIPES)) is None:
+        created += _initialize(connection, ALL_RECIPES)
+    owned = select(func.count()).select_from(_recipes) \
+        .where(_recipes.c.created_by == users.c.id).scalar_subquery()
+    missing = select(users.c.id, owned).where(~exists().where(_counts.c.user_id == users.c.id))
+    result = connection.execute(
+        _insert_missing(connection).from_select(['user_id', 'count'], missing))
+    return created + max(result.rowcount, 0)
+
+
+def rebuild_recipe_counts(session):
+    """Recount every counter from the recipes table. Returns the number of recipes."""
+    connection = session.connection()
+    connection.execute(_counts.delete())
+    initialize_recipe_counts(connection)
+    session.commit()
+    return recipe_count(session)
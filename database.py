@@ -0,0 +1,74 @@
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+
+# Async drivers used in place of the configured sync ones by the ASGI app
+ASYNC_DRIVERS = {'sqlite': 'aiosqlite', 'postgresql': 'asyncpg'}
+
+
+def is_memory_sqlite(url):
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+
+def build_engine(config):
+    """Create the SQLAlchemy engine described by ``config`` (see config.Config)."""
+    url = make_url(config.DATABASE_URL)
+    engine = create_engine(url, **_engine_options(url, config))
+    _apply_sqlite_pragmas(engine, url, config)
+    return engine
+
+
+def async_database_url(url):
+    """``url`` with its driver swapped for the asyncio one, e.g. sqlite:// -> sqlite+aiosqlite://."""
+    url = make_url(url)
+    driver = ASYNC_DRIVERS.get(url.get_backend_name())
+    if driver is None:
+        raise ValueError(f'No asyncio driver known for {url.get_backend_name()}')
+    return url.set(drivername=f'{url.get_backend_name()}+{driver}')
+
+
+def build_async_engine(config):
+    """
+    The asyncio counterpart of build_engine used by the ASGI app: the same database,
+    pool and pragmas, through the driver in ASYNC_DRIVERS.
+    """
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+    url = async_database_url(config.DATABASE_URL)
+    options = _engine_options(url, config)
+    if 'pool_size' in options:
+        # aiosqlite defaults to opening a connection (and its thread) per checkout
+        options['poolclass'] = AsyncAdaptedQueuePool
+    engine = create_async_engine(url, **options)
+    _apply_sqlite_pragmas(engine.sync_engine, url, config)
+    return engine
+
+
+def _engine_options(url, config):
+    options = {'echo': config.SQLALCHEMY_ECHO}
+
+    # In-memory SQLite uses a single shared connection, not a pool
+    if not is_memory_sqlite(url):
+        options.update(
+            pool_size=config.DB_POOL_SIZE,
+            max_overflow=config.DB_MAX_OVERFLOW,
+            pool_recycle=config.DB_POOL_RECYCLE,
+            pool_timeout=config.DB_POOL_TIMEOUT,
+            pool_pre_ping=config.DB_POOL_PRE_PING,
+        )
+    return options
+
+
+def _apply_sqlite_pragmas(engine, url, config):
+    if url.get_backend_name() != 'sqlite':
+        return
+    pragmas = dict(config.SQLITE_PRAGMAS)
+    if is_memory_sqlite(url):
+        pragmas.pop('journal_mode', None)
+
+    @event.listens_for(engine, 'connect')
+    def apply_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
@@ -1,3 +1,11 @@
+import search  # registers the full-text index DDL on the metadata
+from counts import initialize_recipe_counts
+from migrations import add_missing_columns, add_missing_indexes, enable_recipe_autoincrement
 from models import Base, engine
 
-Base.metadata.create_all(bind=engine)
\ No newline at end of file
+Base.metadata.create_all(bind=engine)
+add_missing_columns(engine)
+enable_recipe_autoincrement(engine)
+add_missing_indexes(engine)
+with engine.begin() as connection:
+    initialize_recipe_counts(connection)
@@ -0,0 +1,130 @@
+import json
+from itertools import chain
+
+from sqlalchemy import func, update
+
+from models import (Recipe, RecipeIngredient, ingredient_key, is_named_ingredient,
+                    normalize_ingredients)
+from search import fts_enabled, index_recipe
+from similarity import ingredient_keys, store_signature
+from validation import ingredient_errors
+
+# Operations accepted by apply_ingredient_operations
+INGREDIENT_OPERATIONS = ('add', 'remove', 'replace')
+
+
+def recipe_ids_for_ingredient(session, name):
+    """Ids of the recipes using ``name``, answered from the name_key index."""
+    rows = session.query(RecipeIngredient.recipe_id).filter(
+        RecipeIngredient.name_key == ingredient_key(name)
+    )
+    return {recipe_id for (recipe_id,) in rows}
+
+
+def find_recipe_ids_by_ingredients(session, names, match_all=True):
+    """
+    Return the sorted ids of recipes containing all (or, with
+    ``match_all=False``, any) of the given ingredient names.
+    """
+    keys = {ingredient_key(name) for name in names if name.strip()}
+    if not keys:
+        return []
+
+    result = None
+    for key in keys:
+        ids = recipe_ids_for_ingredient(session, key)
+        if result is None:
+            result = ids
+        elif match_all:
+            result &= ids
+        else:
+            result |= ids
+        # An intersection can only shrink, so stop as soon as it is empty
+        if match_all and not result:
+            return []
+
+    return sorted(result)
+
+
+def supports_json_append(bind):
+    """Whether ``bind`` can append in place: SQLite 3.35+ has json_insert('$[#]') and RETURNING."""
+    dialect = bind.dialect
+    return dialect.name == 'sqlite' and (dialect.server_version_info or ()) >= (3, 35)
+
+
+def append_ingredients(session, recipe_id, user_id, new_ingredients, versions=None):
+    """
+    Append ``new_ingredients`` to a recipe of ``user_id`` with a single UPDATE,
+    without reading or re-serializing the existing ingredients. The stored payload
+    is patched in the same statement and the version bumped. With ``versions``,
+    the recipe is only changed while its version is one of them.
+
+    Returns the new version, or None when no recipe matched. Requires
+    supports_json_append(); the caller commits.
+    """
+    new_ingredients = normalize_ingredients(new_ingredients)
+    recipes = Recipe.__table__
+    appended = func.json_insert(func.coalesce(recipes.c.ingredients, '[]'), *chain.from_iterable(
+        ('$[#]', func.json(json.dumps(ingredient))) for ingredient in new_ingredients))
+
+    statement = update(recipes).where(recipes.c.id == recipe_id, recipes.c.created_by == user_id)
+    if versions is not None:
+        statement = statement.where(recipes.c.version.in_(versions))
+    statement = statement.values(
+        ingredients=appended,
+        # Legacy rows without a payload keep none; json_set(NULL, ...) is NULL
+        payload=func.json_set(recipes.c.payload, '$.ingredients', func.json(appended),
+                              '$.version', recipes.c.version + 1),
+        version=recipes.c.version + 1,
+    ).returning(recipes.c.title, recipes.c.ingredients, recipes.c.version,
+                func.json_array_length(recipes.c.ingredients))
+
+    row = session.execute(statement).first()
+    if row is None:
+        return None
+    title, ingredients, version, length = row
+
+    start = length - len(new_ingredients)
+    rows = [RecipeIngredient.from_dict(start + offset, ingredient)
+            for offset, ingredient in enumerate(new_ingredients)
+            if is_named_ingredient(ingredient)]
+    for ingredient_row in rows:
+        ingredient_row.recipe_id = recipe_id
+    session.add_all(rows)
+
+    # Core statements bypass the mapper events that keep the search index
+    # and the similarity signatures current
+    connection = session.connection()
+    if fts_enabled(connection):
+        index_recipe(connection, recipe_id, title, ingredients)
+    store_signature(connection, recipe_id, ingredient_keys(ingredients))
+    return version
+
+
+def apply_ingredient_operations(ingredients, operations):
+    """
+    Copy of ``ingredients`` with ``operations`` applied in order. Each operation is
+    {"op": "add", "ingredient": {...}} (with an optional "index" to insert at),
+    {"op": "remove", "index": i} or {"op": "replace", "index": i, "ingredient": {...}}.
+    Indexes refer to the list as left by the previous operations. Raises ValueError.
+    """
+    result = list(ingredients)
+    for number, operation in enumerate(operations):
+        if not isinstance(operation, dict) or operation.get('op') not in INGREDIENT_OPERATIONS:
+            raise ValueError(f'Operation {number}: op must be one of add, remove, replace')
+        op = operation['op']
+        index = operation.get('index')
+        if op != 'add' or index is not None:
+            end = len(result) + 1 if op == 'add' else len(result)
+            if not isinstance(index, int) or isinstance(index, bool) or not 0 <= index < end:
+                raise ValueError(f'Operation {number}: index out of range')
+        if op != 'remove' and ingredient_errors(operation.get('ingredient')):
+            raise ValueError(f'Operation {number}: ingredient must be an object with a "name"')
+
+        if op == 'add':
+            result.insert(len(result) if index is None else index, operation['ingredient'])
+        elif op == 'remove':
+            del result[index]
+        else:
+            result[index] = operation['ingredient']
+    return result
@@ -1,29 +1,37 @@
 from flask import Flask
-from flask_login import LoginManager
 
-from models import Base, User, engine, session
+from admission import init_admission
+from auth import init_login
+from commands import register_commands
+from config import Config
+from metrics import init_metrics
+from models import Base, engine, session
 from routes import register_routes
 
-app = Flask(__name__)
-app.config['SECRET_KEY'] = 'hgfert654jhbhy6t5rt54re4edsfrvgbhyh'
+import db
 
-login_manager = LoginManager()
-login_manager.init_app(app)
 
-@login_manager.user_loader
-def load_user(user_id):
-    user = User.query.get(user_id)
-    
-    if user:
-        return user
-    else:
-        return None
+def create_app(config_object=Config):
+    app = Flask(__name__)
+    app.config.from_object(config_object)
 
-import db
+    init_metrics(app, engine)
+    init_login(app, session)
+    init_admission(app)
+
+    register_routes(app, app.config['RECIPES_PER_PAGE'], session)
+    register_commands(app, session)
+
+    @app.teardown_appcontext
+    def remove_session(exception=None):
+        # Discard the request's session so identity maps and transactions
+        # never outlive the request
+        session.remove()
+
+    return app
 
-RECIPES_PER_PAGE = 10
 
-register_routes(app, RECIPES_PER_PAGE, session)
+app = create_app()
 
 if __name__ == "__main__":
     # Create database tables
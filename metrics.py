@@ -0,0 +1,326 @@
+"""
+Per-request performance instrumentation exposed in the Prometheus text format.
+
+For every request the hooks record, per endpoint, the latency, the number of
+SQL statements and the time spent in them (through SQLAlchemy cursor events),
+the response size and the time spent encoding and decoding JSON. Recording is
+a few dictionary updates under a lock, cheap enough to leave on in production.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SLOW_REQUEST_THRESHOLD_MS = 500
+
+# Statistics of the request being handled in the current thread or task
+_request_stats = ContextVar('request_stats', default=None)
+
+
+class RequestStats:
+    __slots__ = ('started', 'sql_count', 'sql_time', 'json_encode_time', 'json_decode_time')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.json_encode_time = 0.0
+        self.json_decode_time = 0.0
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def cumulative(self):
+        running = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            running += count
+            yield bound, running
+
+
+class MetricsRegistry:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._latency = {}
+        self._requests = {}
+        self._sql_count = {}
+        self._sql_time = {}
+        self._response_bytes = {}
+        self._json_time = {}
+        self._collectors = []
+
+    def observe_request(self, endpoint, method, status, elapsed, stats, response_bytes):
+        key = (endpoint, method)
+        with self._lock:
+            histogram = self._latency.get(key)
+            if histogram is None:
+                histogram = self._latency[key] = Histogram(self.buckets)
+            histogram.observe(elapsed)
+            status_key = key + (str(status),)
+            self._requests[status_key] = self._requests.get(status_key, 0) + 1
+            self._sql_count[key] = self._sql_count.get(key, 0) + stats.sql_count
+            self._sql_time[key] = self._sql_time.get(key, 0.0) + stats.sql_time
+            if response_bytes is not None:
+                self._response_bytes[key] = self._response_bytes.get(key, 0) + response_bytes
+            for op, spent in (('encode', stats.json_encode_time),
+                              ('decode', stats.json_decode_time)):
+                op_key = key + (op,)
+                self._json_time[op_key] = self._json_time.get(op_key, 0.0) + spent
+
+    def add_collector(self, collect):
+        """
+        Register ``collect``, a callable returning ``(name, type, help, labels, value)``
+        tuples, to be sampled each time the metrics are rendered.
+        """
+        self._collectors.append(collect)
+
+    def render(self):
+        """The collected metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            lines += _header('recipe_http_request_duration_seconds', 'histogram',
+                             'Request latency by endpoint.')
+            for (endpoint, method), histogram in sorted(self._latency.items()):
+                labels = {'endpoint': endpoint, 'method': method}
+                for bound, count in histogram.cumulative():
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(_sample('recipe_http_request_duration_seconds_bucket',
+                                         dict(labels, le=le), count))
+                lines.append(_sample('recipe_http_request_duration_seconds_sum',
+                                     labels, histogram.total))
+                lines.append(_sample('recipe_http_request_duration_seconds_count',
+                                     labels, histogram.count))
+
+            lines += _header('recipe_http_requests_total', 'counter',
+                             'Requests by endpoint and status.')
+            for (endpoint, method, status), count in sorted(self._requests.items()):
+                lines.append(_sample('recipe_http_requests_total', {
+                    'endpoint': endpoint, 'method': method, 'status': status}, count))
+
+            for name, kind, help_text, values in (
+                ('recipe_http_sql_statements_total', 'counter',
+                 'SQL statements executed while handling requests.', self._sql_count),
+                ('recipe_http_sql_duration_seconds_total', 'counter',
+                 'Time spent executing SQL while handling requests.', self._sql_time),
+                ('recipe_http_response_bytes_total', 'counter',
+                 'Response body bytes, excluding streamed responses.', self._response_bytes),
+            ):
+                lines += _header(name, kind, help_text)
+                for (endpoint, method), value in sorted(values.items()):
+                    lines.append(_sample(name, {'endpoint': endpoint, 'method': method}, value))
+
+            lines += _header('recipe_http_json_duration_seconds_total', 'counter',
+                             'Time spent encoding and decoding JSON.')
+            for (endpoint, method, op), value in sorted(self._json_time.items()):
+                lines.append(_sample('recipe_http_json_duration_seconds_total', {
+                    'endpoint': endpoint, 'method': method, 'op': op}, value))
+
+        samples = {}
+        for collect in self._collectors:
+            for name, kind, help_text, labels, value in collect():
+                samples.setdefault((name, kind, help_text), []).append((labels, value))
+        for (name, kind, help_text), values in samples.items():
+            lines += _header(name, kind, help_text)
+            lines += [_sample(name, labels, value) for labels, value in values]
+
+        return '\n'.join(lines) + '\n'
+
+
+def _header(name, kind, help_text):
+    return [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _sample(name, labels, value):
+    label_text = ','.join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+    return f'{name}{{{label_text}}} {value}' if label_text else f'{name} {value}'
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """JSON provider that charges encode and decode time to the current request."""
+
+    def dumps(self, obj, **kwargs):
+        stats = _request_stats.get()
+        if stats is None:
+            return super().dumps(obj, **kwargs)
+        started = time.perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            stats.json_encode_time += time.perf_counter() - started
+
+    def loads(self, s, **kwargs):
+        stats = _request_stats.get()
+        if stats is None:
+            return super().loads(s, **kwargs)
+        started = time.perf_counter()
+        try:
+            return super().loads(s, **kwargs)
+        finally:
+            stats.json_decode_time += time.perf_counter() - started
+
+
+def current_request_stats():
+    """The RequestStats of the request being handled, or None outside of one."""
+    return _request_stats.get()
+
+
+@contextmanager
+def request_stats():
+    """
+    Charge the SQL and JSON work done in this context to a new RequestStats, for
+    servers without the Flask hooks below (the ASGI app).
+    """
+    stats = RequestStats()
+    token = _request_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _request_stats.reset(token)
+
+
+_instrumented_engines = set()
+
+
+def instrument_engine(engine):
+    """Count SQL statements and their duration against the current request."""
+    if id(engine) in _instrumented_engines:
+        return
+    _instrumented_engines.add(id(engine))
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if _request_stats.get() is not None:
+            conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        stats = _request_stats.get()
+        if stats is None:
+            return
+        started = conn.info.get('query_started')
+        if started:
+            stats.sql_time += time.perf_counter() - started.pop()
+        stats.sql_count += 1
+
+
+def extension_samples(extensions):
+    """Samples for the caches, change feed, admission control and password hasher in ``extensions``."""
+    for cache_name, extension in (('recipes', 'recipe_cache'), ('search', 'search_cache'),
+                                  ('users', 'user_cache')):
+        cache = extensions.get(extension)
+        if cache is None:
+            continue
+        stats = cache.stats()
+        labels = {'cache': cache_name}
+        for key in ('hits', 'misses', 'evictions'):
+            yield (f'recipe_cache_{key}_total', 'counter',
+                   f'Cache {key}.', labels, stats[key])
+        yield 'recipe_cache_size', 'gauge', 'Entries in the cache.', labels, stats['size']
+
+    changes = extensions.get('recipe_changes')
+    if changes is not None:
+        stats = changes.stats()
+        yield ('recipe_changes_replayed_total', 'counter',
+               'Recipe writes of other processes replayed into the caches.', {}, stats['replayed'])
+        yield ('recipe_changes_resets_total', 'counter',
+               'Cache resets after recipe writes were missed.', {}, stats['resets'])
+
+    admission = extensions.get('admission')
+    if admission is not None:
+        for route_class, stats in admission.stats().items():
+            labels = {'route_class': route_class}
+            yield ('recipe_admission_active', 'gauge',
+                   'Requests holding an admission slot.', labels, stats['active'])
+            yield ('recipe_admission_queue_depth', 'gauge',
+                   'Requests waiting for an admission slot.', labels, stats['queued'])
+            yield ('recipe_admission_admitted_total', 'counter',
+                   'Requests admitted.', labels, stats['admitted'])
+            for reason in ('queue_full', 'queue_timeout', 'rate_limited'):
+                yield ('recipe_admission_rejected_total', 'counter',
+                       'Requests rejected by admission control.',
+                       dict(labels, reason=reason), stats['rejected'].get(reason, 0))
+
+    hasher = extensions.get('password_hasher')
+    if hasher is not None:
+        stats = hasher.stats()
+        yield ('recipe_password_hash_pending', 'gauge',
+               'Password hashes queued or running.', {}, stats['pending'])
+        yield ('recipe_password_hash_rejected_total', 'counter',
+               'Password hash requests rejected because the queue was full.', {},
+               stats['rejected'])
+
+
+def init_metrics(app, engine):
+    """
+    Install the instrumentation hooks on ``app`` and ``engine`` and expose
+    the results at GET /metrics. Returns the MetricsRegistry.
+    """
+    registry = MetricsRegistry()
+    app.extensions['metrics'] = registry
+    app.json = TimedJSONProvider(app)
+    instrument_engine(engine)
+
+    threshold = app.config.get('SLOW_REQUEST_THRESHOLD_MS', SLOW_REQUEST_THRESHOLD_MS)
+
+    @app.before_request
+    def start_request_stats():
+        request.environ['metrics.token'] = _request_stats.set(RequestStats())
+
+    @app.after_request
+    def record_request_stats(response):
+        stats = _request_stats.get()
+        if stats is None:
+            return response
+        elapsed = time.perf_counter() - stats.started
+        endpoint = request.endpoint or 'unmatched'
+        response_bytes = None if response.is_streamed else response.calculate_content_length()
+        registry.observe_request(endpoint, request.method, response.status_code,
+                                 elapsed, stats, response_bytes)
+
+        if threshold is not None and elapsed * 1000 >= threshold:
+            app.logger.warning(
+                'Slow request: %s %s -> %s in %.1f ms, %d SQL statement(s) in %.1f ms, '
+                'JSON %.1f ms', request.method, request.full_path.rstrip('?'),
+                response.status_code, elapsed * 1000, stats.sql_count,
+                stats.sql_time * 1000,
+                (stats.json_encode_time + stats.json_decode_time) * 1000)
+        return response
+
+    @app.teardown_request
+    def clear_request_stats(exception=None):
+        token = request.environ.pop('metrics.token', None)
+        if token is not None:
+            try:
+                _request_stats.reset(token)
+            except ValueError:
+                # Torn down in another context than the one that started it
+                _request_stats.set(None)
+
+    registry.add_collector(lambda: extension_samples(app.extensions))
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return app.response_class(registry.render(),
+                                  mimetype='text/plain; version=0.0.4')
+
+    return registry
@@ -0,0 +1,188 @@
+"""
+One-off data migrations for databases created by older versions of the app.
+Each migration is idempotent and commits in batches.
+"""
+import json
+import logging
+
+from sqlalchemy import inspect, text, update
+from sqlalchemy.schema import CreateTable
+
+from models import (Base, Recipe, RecipeIngredient, is_named_ingredient,
+                    normalize_ingredients)
+from units import parse_quantity
+
+logger = logging.getLogger(__name__)
+
+MIGRATION_BATCH_SIZE = 500
+
+
+def add_missing_columns(engine):
+    """
+    Add columns that exist on the models but not yet in the database.
+    create_all only creates missing tables, so columns introduced after a
+    database was created are added here. Returns the added "table.column" names.
+    """
+    inspector = inspect(engine)
+    added = []
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = 'ALTER TABLE {} ADD COLUMN {} {}'.format(
+                    table.name, column.name, column.type.compile(dialect=engine.dialect))
+                if column.server_default is not None:
+                    ddl += ' DEFAULT {}'.format(column.server_default.arg)
+                connection.execute(text(ddl))
+                added.append(f'{table.name}.{column.name}')
+    return added
+
+
+def add_missing_indexes(engine):
+    """
+    Create indexes that exist on the models but not yet in the database, for
+    the same reason as add_missing_columns. Returns the created index names.
+    """
+    inspector = inspect(engine)
+    added = []
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing:
+                    index.create(connection)
+                    added.append(index.name)
+    return added
+
+
+def enable_recipe_autoincrement(engine):
+    """
+    Rebuild a SQLite recipes table created without AUTOINCREMENT, which reuses
+    the id of the newest recipe once it is deleted. Run after add_missing_columns;
+    add_missing_indexes then recreates the table's indexes. Returns True when
+    the table was rebuilt.
+    """
+    table = Recipe.__table__
+    if engine.dialect.name != 'sqlite':
+        return False
+    with engine.begin() as connection:
+        ddl = connection.execute(text(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            {'name': table.name}).scalar()
+        if ddl is None or 'AUTOINCREMENT' in ddl.upper():
+            return False
+        rebuilt = f'{table.name}_rebuilt'
+        create = str(CreateTable(table).compile(connection))
+        connection.execute(text(create.replace(
+            f'CREATE TABLE {table.name} ', f'CREATE TABLE {rebuilt} ', 1)))
+        columns = ', '.join(column.name for column in table.columns)
+        # Copying the ids explicitly also starts the sequence at the highest one
+        connection.execute(text(
+            f'INSERT INTO {rebuilt} ({columns}) SELECT {columns} FROM {table.name}'))
+        connection.execute(text(f'DROP TABLE {table.name}'))
+        connection.execute(text(f'ALTER TABLE {rebuilt} RENAME TO {table.name}'))
+    return True
+
+
+def backfill_recipe_ingredients(session, batch_size=MIGRATION_BATCH_SIZE):
+    """
+    Populate recipe_ingredients from the JSON blobs of recipes that have no
+    normalized rows yet. Returns the number of recipes backfilled.
+    """
+    backfilled = 0
+    last_id = 0
+    while True:
+        recipes = session.query(Recipe).filter(
+            Recipe.id > last_id,
+            ~Recipe.ingredient_rows.any()
+        ).order_by(Recipe.id).limit(batch_size).all()
+        if not recipes:
+            break
+
+        for recipe in recipes:
+            try:
+                ingredients = json.loads(recipe.ingredients or '[]')
+            except ValueError:
+                ingredients = []
+            if isinstance(ingredients, list):
+                recipe.ingredient_rows = [
+                    RecipeIngredient.from_dict(position, ingredient)
+                    for position, ingredient in enumerate(ingredients)
+                    if is_named_ingredient(ingredient)
+                ]
+                backfilled += 1
+        last_id = recipes[-1].id
+        session.commit()
+
+    return backfilled
+
+
+def normalize_legacy_recipes(session, batch_size=MIGRATION_BATCH_SIZE):
+    """
+    Normalize the ingredients of recipes written before normalization moved
+    to write time, and store their serialized payload. Recipes whose
+    ingredients are not a valid JSON list are logged and left untouched.
+    Returns ``(normalized, skipped)``.
+    """
+    normalized = skipped = 0
+    last_id = 0
+    while True:
+        recipes = session.query(Recipe).filter(
+            Recipe.id > last_id,
+            Recipe.payload.is_(None)
+        ).order_by(Recipe.id).limit(batch_size).all()
+        if not recipes:
+            break
+
+        for recipe in recipes:
+            try:
+                ingredients = json.loads(recipe.ingredients or '[]')
+                if not isinstance(ingredients, list):
+                    raise ValueError('Ingredients must be a list')
+            except ValueError as e:
+                logger.error(f'Skipping recipe with ID {recipe.id}: {str(e)}')
+                skipped += 1
+                continue
+            recipe.ingredients = json.dumps(normalize_ingredients(ingredients))
+            recipe.refresh_payload()
+            normalized += 1
+        last_id = recipes[-1].id
+        session.commit()
+
+    return normalized, skipped
+
+
+def backfill_ingredient_amounts(session, batch_size=MIGRATION_BATCH_SIZE):
+    """
+    Parse the quantities of recipe_ingredients rows written before amounts and
+    units were stored. Quantities that cannot be parsed stay NULL.
+    Returns the number of rows given an amount.
+    """
+    rows_table = RecipeIngredient.__table__
+    parsed_count = 0
+    last_id = 0
+    while True:
+        rows = session.query(RecipeIngredient.id, RecipeIngredient.quantity).filter(
+            RecipeIngredient.id > last_id,
+            RecipeIngredient.amount.is_(None),
+            RecipeIngredient.quantity.isnot(None)
+        ).order_by(RecipeIngredient.id).limit(batch_size).all()
+        if not rows:
+            break
+
+        for row_id, quantity in rows:
+            parsed = parse_quantity(quantity)
+            if parsed is not None:
+                session.execute(update(rows_table).where(rows_table.c.id == row_id)
+                                .values(amount=parsed.amount, unit=parsed.unit))
+                parsed_count += 1
+        last_id = rows[-1].id
+        session.commit()
+
+    return parsed_count
@@ -3,19 +3,22 @@ import json
 import os
 
 from flask_login import UserMixin
-from sqlalchemy import Column, ForeignKey, Integer, String, Text, create_engine
+from sqlalchemy import (Boolean, Column, Float, ForeignKey, Index, Integer, LargeBinary,
+                        String, Text, bindparam, event, update)
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship, scoped_session, sessionmaker
+from sqlalchemy.orm import (Session, attributes, object_session, relationship,
+                            scoped_session, sessionmaker)
 from werkzeug.security import check_password_hash, generate_password_hash
 
-BASE_DIR = os.path.dirname(os.path.realpath(__file__))
-
-connection_str = "sqlite:///"+ os.path.join(BASE_DIR, 'RecipeManagement.db')
+from config import Config
+from database import build_engine
+from units import parse_quantity
 
 Base = declarative_base()
 
-engine = create_engine(connection_str, echo=True)
+engine = build_engine(Config)
 
+# One session per request: the app removes it in teardown_appcontext
 session = scoped_session(
     sessionmaker(bind=engine)
 )
@@ -23,6 +26,46 @@ session = scoped_session(
 Base.query = session.query_property()
 
 
+def _reset_after_fork():
+    # A pre-forked worker must not reuse the parent's connections or session.
+    # Drop them without closing, which would also close the parent's sockets.
+    engine.dispose(close=False)
+    session.registry.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+_FLUSH_WRITES = 'flush_writes'
+
+
+def write_after_flush(target, statement, params):
+    """
+    Execute ``statement`` with ``params`` at the end of the flush writing
+    ``target``, in one executemany with the params queued by the other rows of
+    that flush, so a batch insert does not pay a round trip per row for each of
+    its follow-up writes. Statements run in the order they were first queued.
+    """
+    writes = object_session(target).info.setdefault(_FLUSH_WRITES, {})
+    writes.setdefault(statement, []).append(params)
+
+
+@event.listens_for(Session, 'before_flush')
+def _discard_flush_writes(session, flush_context, instances):
+    # Left behind by a flush that failed before it finished
+    session.info.pop(_FLUSH_WRITES, None)
+
+
+@event.listens_for(Session, 'after_flush')
+def _execute_flush_writes(session, flush_context):
+    writes = session.info.pop(_FLUSH_WRITES, None)
+    if writes:
+        connection = session.connection()
+        for statement, rows in writes.items():
+            connection.execute(statement, rows)
+
+
 class User(Base, UserMixin):
     __tablename__ = 'users'
     id = Column(Integer, primary_key=True)
@@ -51,6 +94,52 @@ class Recipe(Base):
     ingredients = Column(Text)
     instructions = Column(Text)
     created_by = Column(Integer, ForeignKey('users.id'))
+    # Ready-to-send JSON of serialize(), rebuilt on every write so reads never parse
+    payload = Column(Text)
+    # Bumped on every write; updates only apply to the version they were read at
+    version = Column(Integer, nullable=False, default=1, server_default='1')
+
+    # The version is set in before_update so the payload can include it, and the
+    # ORM adds "WHERE version = <version read>" to every UPDATE (StaleDataError on conflict)
+    __mapper_args__ = {'version_id_col': version, 'version_id_generator': False}
+
+    __table_args__ = (
+        # Listings filtered by owner, in id order
+        Index('ix_recipes_created_by', 'created_by', 'id'),
+        # The ETag is the version, so SQLite must never hand a deleted recipe's
+        # id to a new one: it would restart at version 1 and match the old ETag
+        {'sqlite_autoincrement': True},
+    )
+
+    ingredient_rows = relationship(
+        'RecipeIngredient', order_by='RecipeIngredient.position',
+        cascade='all, delete-orphan'
+    )
+
+    def set_ingredients(self, ingredients):
+        """
+        Replace the ingredients, keeping the JSON blob and the normalized
+        recipe_ingredients rows in step.
+        """
+        ingredients = normalize_ingredients(ingredients)
+        self.ingredients = json.dumps(ingredients)
+        self.ingredient_rows = [
+            RecipeIngredient.from_dict(position, ingredient)
+            for position, ingredient in enumerate(ingredients)
+            if is_named_ingredient(ingredient)
+        ]
+
+    def extend_ingredients(self, new_ingredients):
+        new_ingredients = normalize_ingredients(new_ingredients)
+        existing_ingredients = json.loads(self.ingredients)
+        start = len(existing_ingredients)
+        existing_ingredients.extend(new_ingredients)
+        self.ingredients = json.dumps(existing_ingredients)
+        self.ingredient_rows.extend(
+            RecipeIngredient.from_dict(start + offset, ingredient)
+            for offset, ingredient in enumerate(new_ingredients)
+            if is_named_ingredient(ingredient)
+        )
 
     def serialize(self):
         return {
@@ -59,5 +148,136 @@ class Recipe(Base):
             'description': self.description,
             'ingredients': json.loads(self.ingredients),
             'instructions': self.instructions,
-            'created_by': self.created_by
-        }
\ No newline at end of file
+            'created_by': self.created_by,
+            'version': self.version
+        }
+
+    def build_payload(self):
+        try:
+            return json.dumps(self.serialize())
+        except (TypeError, ValueError):
+            # Legacy rows with a broken ingredients blob get no payload
+            return None
+
+    def refresh_payload(self):
+        self.payload = self.build_payload()
+
+    def to_json(self):
+        """The serialized recipe as a JSON string, without parsing when a payload is stored."""
+        if self.payload is not None:
+            return self.payload
+        # Rows written before payloads existed are normalized on the fly until migrated
+        data = self.serialize()
+        if not isinstance(data['ingredients'], list):
+            raise ValueError('Ingredients must be a list')
+        data['ingredients'] = normalize_ingredients(data['ingredients'])
+        return json.dumps(data)
+
+
+@event.listens_for(Recipe, 'before_update')
+def _refresh_payload_on_update(mapper, connection, target):
+    # Also called when only ingredient_rows changed, which must not bump the version
+    if not object_session(target).is_modified(target, include_collections=False):
+        return
+    target.version = (target.version or 0) + 1
+    target.refresh_payload()
+
+
+_STORE_PAYLOAD = update(Recipe.__table__) \
+    .where(Recipe.__table__.c.id == bindparam('recipe_id')) \
+    .values(payload=bindparam('stored_payload'))
+
+
+@event.listens_for(Recipe, 'after_insert')
+def _store_payload_on_insert(mapper, connection, target):
+    # The payload includes the id, which only exists once the row is inserted
+    payload = target.build_payload()
+    write_after_flush(target, _STORE_PAYLOAD, {'recipe_id': target.id, 'stored_payload': payload})
+    attributes.set_committed_value(target, 'payload', payload)
+
+
+def normalize_ingredients(ingredients):
+    """Copy of ``ingredients`` where every ingredient has a 'quantity' key."""
+    return [
+        {**ingredient, 'quantity': ingredient.get('quantity', '')}
+        if isinstance(ingredient, dict) else ingredient
+        for ingredient in ingredients
+    ]
+
+
+def is_named_ingredient(ingredient):
+    return isinstance(ingredient, dict) and 'name' in ingredient
+
+
+def ingredient_key(name):
+    """Case-folded, whitespace-collapsed form of an ingredient name used for lookups."""
+    return ' '.join(str(name).casefold().split())
+
+
+class RecipeIngredient(Base):
+    __tablename__ = 'recipe_ingredients'
+    id = Column(Integer, primary_key=True)
+    recipe_id = Column(Integer, ForeignKey('recipes.id'), nullable=False)
+    position = Column(Integer, nullable=False)
+    name = Column(String(255), nullable=False)
+    name_key = Column(String(255), nullable=False)
+    quantity = Column(String(255))
+    # The quantity parsed by units.parse_quantity, both NULL when it could not be read
+    amount = Column(Float)
+    unit = Column(String(32))
+
+    __table_args__ = (
+        # Covering index: ingredient lookups never touch the table itself
+        Index('ix_recipe_ingredients_name_key', 'name_key', 'recipe_id'),
+        Index('ix_recipe_ingredients_recipe_id', 'recipe_id', 'position'),
+    )
+
+    @classmethod
+    def from_dict(cls, position, ingredient):
+        return cls(**cls.column_values(position, ingredient))
+
+    @staticmethod
+    def column_values(position, ingredient):
+        """The row of ``ingredient`` as column values, without its recipe_id."""
+        quantity = ingredient.get('quantity')
+        parsed = parse_quantity(quantity)
+        return {
+            'position': position,
+            'name': str(ingredient['name']),
+            'name_key': ingredient_key(ingredient['name']),
+            'quantity': None if quantity is None else str(quantity),
+            'amount': parsed and parsed.amount,
+            'unit': parsed and parsed.unit,
+        }
+
+
+class RecipeSignature(Base):
+    """MinHash signature of a recipe's ingredient names, see similarity.py."""
+    __tablename__ = 'recipe_signatures'
+    recipe_id = Column(Integer, ForeignKey('recipes.id'), primary_key=True)
+    # array('I') of the per-permutation minimum hashes, as raw bytes
+    signature = Column(LargeBinary, nullable=False)
+
+
+class RecipeCount(Base):
+    """Number of recipes overall and per user, maintained on every write, see counts.py."""
+    __tablename__ = 'recipe_counts'
+    # A user id, or ALL_RECIPES (0) for the whole catalog
+    user_id = Column(Integer, primary_key=True, autoincrement=False)
+    count = Column(Integer, nullable=False)
+
+
+class RecipeChange(Base):
+    """One committed recipe write, replayed by the other processes, see changes.py."""
+    __tablename__ = 'recipe_changes'
+    id = Column(Integer, primary_key=True)
+    # Not a foreign key: deletions are recorded too
+    recipe_id = Column(Integer, nullable=False)
+    user_id = Column(Integer)
+    action = Column(String(16), nullable=False)
+    ingredients_changed = Column(Boolean, nullable=False)
+    # The process that made the write, which already applied it
+    origin = Column(String(32), nullable=False)
+
+    # Followers remember the last id they read, so ids must never go back
+    __table_args__ = ({'sqlite_autoincrement': True},)
@@ -0,0 +1,96 @@
+import base64
+import binascii
+import json
+from bisect import bisect_right
+from urllib.parse import urlencode
+
+from sqlalchemy import tuple_
+
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(values):
+    """Encode the sort key values of the last row of a page as an opaque token."""
+    raw = json.dumps(list(values), separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+
+
+def decode_cursor(cursor, size):
+    """
+    Decode a token produced by encode_cursor into a list of ``size`` sort key
+    values. An empty token means "start from the beginning" and returns None.
+    Raises ValueError for malformed tokens.
+    """
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError('Invalid cursor')
+    return values
+
+
+def clamp_limit(limit, default, maximum=MAX_PAGE_SIZE):
+    if limit is None:
+        return default
+    return max(1, min(limit, maximum))
+
+
+def page_count(total, limit):
+    return -(-total // limit)
+
+
+def link_header(path, args, **links):
+    """
+    RFC 8288 Link header value with one link per keyword, e.g. next={'page': 3},
+    each pointing at ``path`` with the query ``args`` updated. None links are left out.
+    """
+    values = []
+    for rel, changes in links.items():
+        if changes is None:
+            continue
+        query = args.copy()
+        for name, value in changes.items():
+            query[name] = value
+        values.append(f'<{path}?{urlencode(list(query.items(multi=True)))}>; rel="{rel}"')
+    return ', '.join(values)
+
+
+def keyset_page(query, sort_columns, cursor, limit):
+    """
+    Fetch the page of ``query`` that follows ``cursor`` when ordered by
+    ``sort_columns`` (which must end with a unique column such as the
+    primary key). The seek is an index range scan, so its cost does not
+    depend on how deep the page is.
+
+    Returns ``(rows, next_cursor)``; next_cursor is None on the last page.
+    """
+    after = decode_cursor(cursor, len(sort_columns))
+    if after is not None:
+        if len(sort_columns) == 1:
+            query = query.filter(sort_columns[0] > after[0])
+        else:
+            query = query.filter(tuple_(*sort_columns) > tuple_(*after))
+
+    # One extra row tells us whether another page exists
+    rows = query.order_by(*sort_columns).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(getattr(last, column.key) for column in sort_columns)
+
+
+def keyset_slice(sorted_ids, cursor, limit):
+    """keyset_page for an already materialized, ascending list of ids."""
+    after = decode_cursor(cursor, 1)
+    if after is not None and not isinstance(after[0], int):
+        raise ValueError('Invalid cursor')
+    start = bisect_right(sorted_ids, after[0]) if after is not None else 0
+    page_ids = sorted_ids[start:start + limit]
+    has_more = start + limit < len(sorted_ids)
+    return page_ids, encode_cursor([page_ids[-1]]) if has_more else None
@@ -0,0 +1,211 @@
+"""
+In-memory index answering "what can I cook with this pantry" queries.
+
+Ingredient names form a vocabulary of small integer ids and every recipe is
+stored as a compact array of its ingredient ids, so checking one recipe
+against a pantry never touches the database or parses JSON. To avoid checking
+every recipe, each one is also listed in the postings of ``max_missing + 1`` of
+its rarest ingredients, the k-th rarest in slot k: a recipe missing at most m
+ingredients must contain at least one of any m + 1 of them, so slots 0..m of
+the pantry's ingredients yield every possible match, while staples such as
+salt rarely need to be scanned.
+
+The index is built on first use and kept current through the recipe_changed
+signal, which the change feed (changes.py) also sends for the writes of other
+processes: changed recipes are queued and reloaded in one query before the
+next match.
+"""
+import heapq
+import threading
+from array import array
+from collections import namedtuple
+
+from models import RecipeIngredient, ingredient_key
+
+PANTRY_MAX_MISSING = 3
+PANTRY_BUILD_BATCH_SIZE = 10000
+# Changed recipes reloaded per IN query
+PANTRY_REFRESH_BATCH_SIZE = 500
+
+PantryMatch = namedtuple('PantryMatch', ['recipe_id', 'matched', 'total', 'missing'])
+
+
+class PantryIndex:
+    # The attributes set by _reset, swapped in as a whole by build
+    _STATE = ('_ids', '_names', '_frequency', '_postings', '_recipes', '_stale')
+
+    def __init__(self, max_missing=PANTRY_MAX_MISSING):
+        self.max_missing = max_missing
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._pending = set()
+        self._building = False
+        self.ready = False
+        self._reset()
+
+    def _reset(self):
+        self._ids = {}                  # name_key -> ingredient id
+        self._names = []                # ingredient id -> name_key
+        self._frequency = array('l')    # ingredient id -> number of recipes using it
+        # slot -> ingredient id -> ids of the recipes with it as their slot-th rarest
+        self._postings = [[] for _ in range(self.max_missing + 1)]
+        self._recipes = {}              # recipe id -> array of its ingredient ids
+        self._stale = 0                 # postings left behind by removed recipes
+
+    def __len__(self):
+        return len(self._recipes)
+
+    def clear(self):
+        """Drop everything; the index is rebuilt on the next refresh."""
+        with self._lock:
+            self.ready = False
+            self._pending.clear()
+            self._reset()
+
+    def invalidate(self, recipe_id):
+        """Queue ``recipe_id`` to be reloaded before the next match."""
+        with self._lock:
+            if self.ready or self._building:
+                self._pending.add(recipe_id)
+
+    def build(self, session, batch_size=PANTRY_BUILD_BATCH_SIZE):
+        """
+        (Re)build the whole index from the recipe_ingredients table. The scan fills a
+        separate index without holding the lock, so writes (invalidate) and matches
+        carry on meanwhile; recipes invalidated during the scan stay queued for the
+        next refresh.
+        """
+        with self._lock:
+            self._building = True
+            self._pending.clear()
+        try:
+            fresh = PantryIndex(self.max_missing)
+            rows = session.query(RecipeIngredient.recipe_id, RecipeIngredient.name_key) \
+                .order_by(RecipeIngredient.recipe_id).yield_per(batch_size)
+            current_id, keys = None, set()
+            for recipe_id, key in rows:
+                if recipe_id != current_id:
+                    if keys:
+                        fresh._store(current_id, keys)
+                    current_id, keys = recipe_id, set()
+                keys.add(key)
+            if keys:
+                fresh._store(current_id, keys)
+            # Postings are chosen once every frequency is known
+            fresh._rebuild_postings()
+        except BaseException:
+            with self._lock:
+                self._building = False
+            raise
+        with self._lock:
+            for name in self._STATE:
+                setattr(self, name, getattr(fresh, name))
+            self._building = False
+            self.ready = True
+
+    def refresh(self, session):
+        """Build the index if needed and reload the recipes changed since the last match."""
+        if not self.ready:
+            with self._build_lock:
+                if not self.ready:
+                    self.build(session)
+        with self._lock:
+            pending, self._pending = list(self._pending), set()
+        if not pending:
+            return
+
+        keys = {recipe_id: set() for recipe_id in pending}
+        for start in range(0, len(pending), PANTRY_REFRESH_BATCH_SIZE):
+            chunk = pending[start:start + PANTRY_REFRESH_BATCH_SIZE]
+            rows = session.query(RecipeIngredient.recipe_id, RecipeIngredient.name_key) \
+                .filter(RecipeIngredient.recipe_id.in_(chunk))
+            for recipe_id, key in rows:
+                keys[recipe_id].add(key)
+
+        with self._lock:
+            for recipe_id, recipe_keys in keys.items():
+                self._remove(recipe_id)
+                if recipe_keys:
+                    self._add_postings(recipe_id, self._store(recipe_id, recipe_keys))
+            # Compact once removed recipes make up most of the postings
+            if self._stale > max(PANTRY_REFRESH_BATCH_SIZE, len(self._recipes)):
+                self._rebuild_postings()
+
+    def match(self, names, max_missing=0, limit=20):
+        """
+        The recipes that can be cooked from the ingredient ``names`` while missing at
+        most ``max_missing`` ingredients, as PantryMatch tuples: fewest missing first,
+        then highest coverage. Recipes using none of the pantry are never returned.
+        """
+        if not 0 <= max_missing <= self.max_missing:
+            raise ValueError(f'max_missing must be between 0 and {self.max_missing}')
+
+        with self._lock:
+            pantry = {self._ids[key] for key in map(ingredient_key, names) if key in self._ids}
+            candidates = set()
+            for slot in self._postings[:max_missing + 1]:
+                for ingredient_id in pantry:
+                    candidates.update(slot[ingredient_id])
+
+            ranked = []
+            for recipe_id in candidates:
+                ingredient_ids = self._recipes.get(recipe_id)
+                if ingredient_ids is None:
+                    continue
+                total = len(ingredient_ids)
+                matched = len(pantry.intersection(ingredient_ids))
+                if matched and total - matched <= max_missing:
+                    ranked.append((total - matched, -matched / total, recipe_id))
+
+            matches = []
+            for missing, _, recipe_id in heapq.nsmallest(limit, ranked):
+                ingredient_ids = self._recipes[recipe_id]
+                matches.append(PantryMatch(
+                    recipe_id, len(ingredient_ids) - missing, len(ingredient_ids),
+                    [self._names[i] for i in ingredient_ids if i not in pantry]))
+            return matches
+
+    def stats(self):
+        with self._lock:
+            return {'recipes': len(self._recipes), 'ingredients': len(self._names),
+                    'postings': sum(len(p) for slot in self._postings for p in slot),
+                    'stale': self._stale,
+                    'pending': len(self._pending)}
+
+    def _ingredient_id(self, key):
+        ingredient_id = self._ids.get(key)
+        if ingredient_id is None:
+            ingredient_id = self._ids[key] = len(self._names)
+            self._names.append(key)
+            self._frequency.append(0)
+            for slot in self._postings:
+                slot.append(array('q'))
+        return ingredient_id
+
+    def _store(self, recipe_id, keys):
+        ingredient_ids = array('l', sorted(self._ingredient_id(key) for key in keys))
+        for ingredient_id in ingredient_ids:
+            self._frequency[ingredient_id] += 1
+        self._recipes[recipe_id] = ingredient_ids
+        return ingredient_ids
+
+    def _remove(self, recipe_id):
+        ingredient_ids = self._recipes.pop(recipe_id, None)
+        if ingredient_ids is None:
+            return
+        for ingredient_id in ingredient_ids:
+            self._frequency[ingredient_id] -= 1
+        # Its postings stay until the next compaction; match() skips them
+        self._stale += min(len(ingredient_ids), len(self._postings))
+
+    def _add_postings(self, recipe_id, ingredient_ids):
+        rarest = sorted(ingredient_ids, key=self._frequency.__getitem__)
+        for slot, ingredient_id in zip(self._postings, rarest):
+            slot[ingredient_id].append(recipe_id)
+
+    def _rebuild_postings(self):
+        self._postings = [[array('q') for _ in self._names]
+                          for _ in range(self.max_missing + 1)]
+        self._stale = 0
+        for recipe_id, ingredient_ids in self._recipes.items():
+            self._add_postings(recipe_id, ingredient_ids)
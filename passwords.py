@@ -0,0 +1,110 @@
+"""
+Password hashing off the request threads.
+
+KDF calls are CPU-bound and hold the GIL, so they run in a small process
+pool. At most ``max_pending`` calls may be queued or running at once;
+beyond that HashingBusy is raised immediately, so a login burst is
+rejected early instead of occupying every request worker.
+"""
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# Werkzeug method string, written out in full (it is compared against the
+# prefix of stored hashes to decide whether they need rehashing)
+PASSWORD_HASH_METHOD = 'scrypt:32768:8:1'
+# Per app process: a pre-forking server runs one pool in each of its workers
+PASSWORD_HASH_WORKERS = 2
+PASSWORD_HASH_TIMEOUT = 10
+
+
+class HashingBusy(Exception):
+    """Raised when the hashing queue is full or a hash did not finish in time."""
+
+
+class PasswordHasher:
+    def __init__(self, method=PASSWORD_HASH_METHOD, workers=0, max_pending=None,
+                 timeout=PASSWORD_HASH_TIMEOUT):
+        """
+        ``workers=0`` hashes inline on the calling thread (still bounded by
+        ``max_pending``), which suits tests and single-threaded tools.
+        """
+        self.method = method
+        self.workers = workers
+        self.max_pending = max_pending or max(workers, 1) * 4
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._pending = 0
+        self._rejected = 0
+        self._lock = threading.Lock()
+        self._executor = None
+        self._executor_pid = None
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            method=config.get('PASSWORD_HASH_METHOD', PASSWORD_HASH_METHOD),
+            workers=config.get('PASSWORD_HASH_WORKERS', PASSWORD_HASH_WORKERS),
+            max_pending=config.get('PASSWORD_HASH_MAX_PENDING'),
+            timeout=config.get('PASSWORD_HASH_TIMEOUT', PASSWORD_HASH_TIMEOUT),
+        )
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """True when ``pwhash`` was made with a different method or cost than configured."""
+        return pwhash.split('$', 1)[0] != self.method
+
+    def stats(self):
+        with self._lock:
+            return {'pending': self._pending, 'rejected': self._rejected,
+                    'max_pending': self.max_pending, 'workers': self.workers}
+
+    def _run(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise HashingBusy('Too many password hashing requests in progress')
+        with self._lock:
+            self._pending += 1
+        if not self.workers:
+            try:
+                return func(*args)
+            finally:
+                self._release()
+
+        try:
+            future = self._get_executor().submit(func, *args)
+        except BaseException:
+            self._release()
+            raise
+        # The slot is held until the pool is done with the call, not until we
+        # stop waiting: a hash that timed out may still be running and cannot
+        # be cancelled
+        future.add_done_callback(lambda _: self._release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise HashingBusy('Password hashing timed out')
+
+    def _release(self):
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+
+    def _get_executor(self):
+        # A pool inherited from a parent process across fork() is unusable,
+        # so every worker process starts its own on first use
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                self._executor_pid = os.getpid()
+            return self._executor
@@ -0,0 +1,73 @@
+"""
+Sparse fieldsets for recipe responses.
+
+A ``fields=`` parameter such as ``summary`` or ``id,title,ingredients`` picks the
+recipe fields a response includes. Only the matching columns are selected, so
+large Text columns that were not asked for are never read, decoded or sent.
+"""
+import json
+
+from sqlalchemy.orm import load_only
+
+from models import Recipe, normalize_ingredients
+
+# Serialization order of a full recipe, as in Recipe.serialize
+RECIPE_FIELDS = ('id', 'title', 'description', 'ingredients', 'instructions', 'created_by',
+                 'version')
+
+# Named projections usable in fields=, alone or mixed with field names
+FIELD_SETS = {
+    'summary': ('id', 'title', 'created_by'),
+    'full': RECIPE_FIELDS,
+}
+
+
+def parse_fields(value, default='full'):
+    """
+    The recipe fields named by a fields= parameter, in serialization order.
+    The id is always included. Raises ValueError for unknown names.
+    """
+    if not value:
+        value = default
+    requested = {'id'}
+    for name in value.split(','):
+        name = name.strip()
+        if name in FIELD_SETS:
+            requested.update(FIELD_SETS[name])
+        elif name in RECIPE_FIELDS:
+            requested.add(name)
+        elif name:
+            raise ValueError(f'Unknown field: {name}')
+    return tuple(name for name in RECIPE_FIELDS if name in requested)
+
+
+def is_full(fields):
+    """Whether ``fields`` is the whole recipe, which is served from the stored payload."""
+    return fields == RECIPE_FIELDS
+
+
+def field_columns(fields):
+    return [getattr(Recipe, name) for name in fields]
+
+
+def load_only_fields(fields):
+    """
+    Loader option deferring every Recipe column not needed for ``fields``. Full
+    recipes only need the stored payload; legacy rows without one load the
+    deferred columns on access.
+    """
+    if is_full(fields):
+        return load_only(Recipe.id, Recipe.payload)
+    return load_only(*field_columns(fields))
+
+
+def project(row, fields):
+    """JSON string of ``fields`` of ``row``, a Recipe or a row of the selected columns."""
+    data = {name: getattr(row, name) for name in fields}
+    if 'ingredients' in data:
+        ingredients = json.loads(data['ingredients'])
+        if not isinstance(ingredients, list):
+            raise ValueError('Ingredients must be a list')
+        # Legacy rows may predate write-time normalization
+        data['ingredients'] = normalize_ingredients(ingredients)
+    return json.dumps(data)
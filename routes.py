@@ -2,68 +2,622 @@ import json
 import logging
 from json import JSONDecodeError
 
-from flask import Flask, jsonify, request
+from flask import Flask, jsonify, request, stream_with_context
 from flask_login import current_user, login_user
-from werkzeug.security import check_password_hash, generate_password_hash
-
+from sqlalchemy.orm.exc import StaleDataError
+from werkzeug.http import quote_etag
+
+from bulk import (EXPORT_FORMATS, IMPORT_BATCH_SIZE, MAX_IMPORT_BATCH_SIZE,
+                  export_chunks, gzip_chunks, import_ndjson)
+from cache import LRUCache, WriteGenerations, make_cached_response
+from changes import CHANGE_POLL_INTERVAL_MS, ChangeFeed
+from counts import recipe_count
+from ingredients import (append_ingredients, apply_ingredient_operations,
+                         find_recipe_ids_by_ingredients, supports_json_append)
 from models import Recipe, User, session
-from schema import RecipeSchema, UserSchema
+from pantry import PANTRY_MAX_MISSING, PantryIndex
+from pagination import (MAX_PAGE_SIZE, clamp_limit, keyset_page, keyset_slice, link_header,
+                        page_count)
+from passwords import HashingBusy, PasswordHasher
+from projection import field_columns, is_full, load_only_fields, parse_fields, project
+from search import find_recipes, normalize_query
+from shopping import parse_plan, shopping_list
+from signals import recipe_changed
+from similarity import SimilarityIndex, similar_recipes
+from validation import load_ingredients, load_new_recipe, load_recipe_update, load_registration
+
+logger = logging.getLogger(__name__)
+
+RECIPE_CACHE_SIZE = 1024
+SEARCH_CACHE_SIZE = 4096
+MAX_RECIPE_BATCH_SIZE = 100
+
+# Cache tag carried by every cached recipe listing
+LISTS_TAG = 'lists'
+# ... and by listings filtered by ingredient, which an ingredient change can
+# add a recipe to that they do not list yet
+INGREDIENT_LISTS_TAG = 'ingredient-lists'
+
+
+def recipe_tag(recipe_id):
+    """Cache tag carried by every cached response that contains the recipe."""
+    return f'recipe:{recipe_id}'
+
+
+def parse_recipe_ids(values):
+    """
+    Recipe ids from a JSON list or from query values such as ['1,2', '3'].
+    Raises ValueError for anything that is not an integer.
+    """
+    recipe_ids = []
+    for value in values:
+        if isinstance(value, str):
+            recipe_ids.extend(int(part) for part in value.split(',') if part.strip())
+        elif isinstance(value, int) and not isinstance(value, bool):
+            recipe_ids.append(value)
+        else:
+            raise ValueError('Recipe ids must be integers')
+    return recipe_ids
+
+
+def json_array(items):
+    """Join already serialized JSON documents into a JSON array."""
+    return '[' + ','.join(items) + ']'
+
+
+def init_recipe_state(config, extensions, sender):
+    """
+    Create the response caches and in-memory indexes in ``extensions`` and keep them
+    current through the recipe_changed signals sent by ``sender``, including those
+    replayed from other processes by the ChangeFeed in ``extensions['recipe_changes']``.
+    Shared by the Flask routes and the ASGI app (asgi_routes.py).
+    """
+    recipe_cache = LRUCache(config.get('RECIPE_CACHE_SIZE', RECIPE_CACHE_SIZE))
+    extensions['recipe_cache'] = recipe_cache
+
+    def invalidate_recipe_cache(sender, recipe_id, action, ingredients_changed=True, **kwargs):
+        if action == 'updated':
+            # Only responses containing the recipe change, and the ingredient
+            # filtered listings it may have entered
+            if ingredients_changed:
+                recipe_cache.invalidate(recipe_tag(recipe_id), INGREDIENT_LISTS_TAG)
+            else:
+                recipe_cache.invalidate(recipe_tag(recipe_id))
+        else:
+            # New or removed recipes shift every listing page
+            recipe_cache.invalidate(recipe_tag(recipe_id), LISTS_TAG)
+
+    recipe_changed.connect(invalidate_recipe_cache, sender=sender, weak=False)
+
+    # Searches only see the searching user's own recipes, so only that user's
+    # writes can change them
+    search_generations = WriteGenerations()
+    search_cache = LRUCache(config.get('SEARCH_CACHE_SIZE', SEARCH_CACHE_SIZE))
+    extensions['search_cache'] = search_cache
+    extensions['search_generations'] = search_generations
+
+    def invalidate_user_searches(sender, user_id, **kwargs):
+        search_generations.bump(user_id)
+
+    recipe_changed.connect(invalidate_user_searches, sender=sender, weak=False)
+
+    pantry_index = PantryIndex(config.get('PANTRY_MAX_MISSING', PANTRY_MAX_MISSING))
+    extensions['pantry_index'] = pantry_index
+
+    def invalidate_pantry_index(sender, recipe_id, **kwargs):
+        pantry_index.invalidate(recipe_id)
+
+    recipe_changed.connect(invalidate_pantry_index, sender=sender, weak=False)
+
+    similarity_index = SimilarityIndex()
+    extensions['similarity_index'] = similarity_index
+
+    def invalidate_similarity_index(sender, recipe_id, **kwargs):
+        similarity_index.invalidate(recipe_id)
+
+    recipe_changed.connect(invalidate_similarity_index, sender=sender, weak=False)
+
+    def reset_recipe_state():
+        # Changes made elsewhere were missed: nothing cached can be trusted
+        recipe_cache.clear()
+        search_cache.clear()
+        pantry_index.clear()
+        similarity_index.clear()
+
+    extensions['recipe_changes'] = ChangeFeed(
+        sender, config.get('CHANGE_POLL_INTERVAL_MS', CHANGE_POLL_INTERVAL_MS), reset_recipe_state)
+
+
+def recipe_payload(session, row):
+    """The stored JSON of an (id, payload) row, serializing legacy rows on the fly."""
+    if row.payload is not None:
+        return row.payload
+    return session.get(Recipe, row.id).to_json()
+
+
+def projected_query(session, fields):
+    """Query selecting only the columns needed to serialize ``fields``."""
+    if is_full(fields):
+        # Only the stored payloads are read, never the individual columns
+        return session.query(Recipe.id, Recipe.payload)
+    return session.query(*field_columns(fields))
+
+
+def projected_json(session, row, fields):
+    return recipe_payload(session, row) if is_full(fields) else project(row, fields)
+
+
+def recipe_body(session, recipe_id, fields):
+    """
+    ``(body, version)`` of one recipe, or None when it does not exist. The version
+    is the response's ETag, so a client can send it straight back in If-Match.
+    """
+    row = projected_query(session, fields).add_columns(Recipe.version.label('etag_version')) \
+        .filter(Recipe.id == recipe_id).first()
+    if row is None:
+        return None
+    return projected_json(session, row, fields), row.etag_version
+
 
-user_schema = UserSchema()
-recipe_schema = RecipeSchema()
+def recipe_batch_body(session, recipe_ids, fields, logger=logger):
+    """
+    JSON array of the requested recipes in request order, loaded with a single
+    IN query. Unknown ids get an {"id": ..., "error": "Recipe not found"} marker.
+    """
+    unique_ids = set(recipe_ids)
+    rows = projected_query(session, fields) \
+        .filter(Recipe.id.in_(unique_ids)).all() if unique_ids else []
+    payloads = {}
+    for row in rows:
+        try:
+            payloads[row.id] = projected_json(session, row, fields)
+        except ValueError as e:
+            logger.error(f'Error processing recipe with ID {row.id}: {str(e)}')
+    return json_array(
+        payloads.get(recipe_id) or json.dumps({'id': recipe_id, 'error': 'Recipe not found'})
+        for recipe_id in recipe_ids
+    )
+
+
+def recipe_listing(session, path, args, fields, per_page, max_per_page, logger=logger):
+    """
+    One page of the recipe listing described by the query ``args`` (a MultiDict):
+    page or cursor, limit, ingredient filters and user. Returns ``(body, headers,
+    tags)`` with the cache tags of the page, or None when an offset page is empty.
+    Raises ValueError with the message for a 400 response.
+    """
+    page = args.get('page', 1, type=int)
+    limit = clamp_limit(args.get('limit', type=int), per_page, max_per_page)
+    offset = (page - 1) * limit
+    cursor = args.get('cursor')
+    next_cursor = None
+    ingredient_names = args.getlist('ingredient')
+    user_id = args.get('user', type=int)
+    payload_query = projected_query(session, fields)
+    if user_id is not None:
+        payload_query = payload_query.filter(Recipe.created_by == user_id)
+
+    match = args.get('match', 'all')
+    if ingredient_names and match not in ('all', 'any'):
+        raise ValueError('match must be "all" or "any"')
+
+    try:
+        if ingredient_names:
+            recipe_ids = find_recipe_ids_by_ingredients(
+                session, ingredient_names, match_all=(match == 'all'))
+            if user_id is not None:
+                owned = {recipe_id for (recipe_id,) in session.query(Recipe.id)
+                         .filter(Recipe.created_by == user_id)}
+                recipe_ids = [i for i in recipe_ids if i in owned]
+            total = len(recipe_ids)
+            if cursor is not None:
+                page_ids, next_cursor = keyset_slice(recipe_ids, cursor, limit)
+            else:
+                page_ids = recipe_ids[offset:offset + limit]
+            recipes = payload_query.filter(Recipe.id.in_(page_ids)) \
+                .order_by(Recipe.id).all() if page_ids else []
+        elif cursor is not None:
+            total = recipe_count(session, user_id)
+            recipes, next_cursor = keyset_page(
+                payload_query, [Recipe.id], cursor, limit)
+        else:
+            total = recipe_count(session, user_id)
+            recipes = payload_query.order_by(Recipe.id) \
+                .offset(offset).limit(limit).all()
+    except ValueError:
+        raise ValueError('Invalid cursor')
+
+    if not recipes and cursor is None:
+        return None
+
+    payloads = []
+    for recipe in recipes:
+        try:
+            payloads.append(projected_json(session, recipe, fields))
+        except ValueError as e:
+            # Skip the recipe if its legacy ingredients are empty or invalid
+            logger.error(f'Error processing recipe with ID {recipe.id}: {str(e)}')
+
+    headers = [('X-Total-Count', str(total))]
+    if cursor is not None:
+        body = '{{"recipes": {}, "next_cursor": {}}}'.format(
+            json_array(payloads), json.dumps(next_cursor))
+        links = link_header(path, args, next=next_cursor and {'cursor': next_cursor})
+    else:
+        body = json_array(payloads)
+        pages = page_count(total, limit)
+        headers.append(('X-Total-Pages', str(pages)))
+        links = link_header(path, args,
+                            prev={'page': page - 1} if page > 1 else None,
+                            next={'page': page + 1} if page < pages else None)
+    if links:
+        headers.append(('Link', links))
+    tags = [LISTS_TAG] + [recipe_tag(recipe.id) for recipe in recipes]
+    if ingredient_names:
+        tags.append(INGREDIENT_LISTS_TAG)
+    return body, headers, tags
+
+
+def search_body(session, user_id, keyword, page, fields, per_page):
+    """JSON array of one page of ``user_id``'s recipes matching ``keyword``, best first."""
+    recipes = find_recipes(session, user_id, keyword,
+                           limit=per_page, offset=(page - 1) * per_page,
+                           options=[load_only_fields(fields)])
+    return json_array(recipe.to_json() if is_full(fields) else project(recipe, fields)
+                      for recipe in recipes)
+
+
+def pantry_matches(session, pantry_index, pantry, max_missing, limit):
+    """
+    Pantry matches as response items. Raises ValueError for an out-of-range
+    max_missing.
+    """
+    pantry_index.refresh(session)
+    matches = pantry_index.match(pantry, max_missing=max_missing, limit=limit)
+    titles = dict(session.query(Recipe.id, Recipe.title)
+                  .filter(Recipe.id.in_([m.recipe_id for m in matches]))) if matches else {}
+    return [
+        {'id': match.recipe_id, 'title': titles.get(match.recipe_id),
+         'coverage': round(match.matched / match.total, 3), 'missing': match.missing}
+        for match in matches
+        # Skip recipes deleted since the index last saw them
+        if match.recipe_id in titles
+    ]
+
+
+def similar_recipe_items(session, similarity_index, recipe_id, k):
+    """Similar recipes as response items, or None when the recipe does not exist."""
+    if session.query(Recipe.id).filter(Recipe.id == recipe_id).first() is None:
+        return None
+    similar = similar_recipes(session, similarity_index, recipe_id, k)
+    titles = dict(session.query(Recipe.id, Recipe.title)
+                  .filter(Recipe.id.in_([other for other, _ in similar]))) if similar else {}
+    return [
+        {'id': other, 'title': titles[other], 'similarity': round(similarity, 3)}
+        for other, similarity in similar if other in titles
+    ]
+
+
+# The write endpoints, shared by the Flask routes and the ASGI app. Each returns
+# (body, status) or (body, status, headers), where body is a dict to serialize or
+# an already serialized JSON string. Signals are sent with ``sender``.
+
+def busy_error():
+    return {'error': 'Server busy, please retry shortly'}, 503, [('Retry-After', '1')]
+
+
+def invalid_error(errors, message):
+    """400 with a one-line summary in 'error' and every problem by field in 'errors'."""
+    return {'error': message, 'errors': errors}, 400
+
+
+def conflict_error(version):
+    return {'error': 'Recipe was modified by another request', 'version': version}, 409
+
+
+def version_headers(version):
+    """The ETag of a recipe at ``version``, sent with every write of one recipe."""
+    return [('ETag', quote_etag(str(version)))]
+
+
+def current_version(session, recipe_id):
+    return session.query(Recipe.version).filter_by(id=recipe_id).scalar()
+
+
+def if_match_versions(if_match):
+    """
+    Recipe versions listed in the parsed If-Match header (werkzeug ETags), e.g.
+    If-Match: "3", the ETag of the recipe as read. None when the header is absent
+    or "*", i.e. whatever version is current may be overwritten.
+    """
+    if not if_match or if_match.star_tag:
+        return None
+    return [int(tag) for tag in if_match.as_set() if tag.isdigit()]
+
+
+def register_user_body(session, password_hasher, data):
+    data, errors, message = load_registration(data)
+    if errors:
+        return invalid_error(errors, message)
+
+    username = data['username']
+    email = data['email']
+    password = data['password']
+
+    existing_user = session.query(User.id).filter(
+        (User.username.ilike(username)) | (User.email.ilike(email))
+    ).first()
+
+    if existing_user:
+        return {'error': 'Username or email already exists'}, 400
+
+    try:
+        password_hash = password_hasher.hash(password)
+    except HashingBusy:
+        return busy_error()
+
+    session.add(User(username=username, email=email, password=password_hash))
+    session.commit()
+    return {'message': 'User registered successfully'}, 201
+
+
+def login_body(session, password_hasher, data):
+    """
+    Check the credentials in ``data``. Returns the response and the id of the user
+    to log in, or None when the login failed.
+    """
+    try:
+        username = data.get('username')
+        password = data.get('password')
+
+        if not username or not password:
+            return ({'error': 'Missing username or password'}, 400), None
 
+        user = session.query(User).filter_by(username=username).first()
 
-def register_routes(app, RECIPES_PER_PAGE, session):
-    @app.route('/api/register', methods=['POST'])
-    def register_user():
-        data = request.get_json()
+        if user is None or not password_hasher.verify(user.password, password):
+            return ({'error': 'Invalid username or password'}, 401), None
+        user_id = user.id
 
-        required_fields = {'username', 'email', 'password'}
-        if not required_fields.issubset(data.keys()):
-            return jsonify({'error': 'Missing field(s)'}), 400
+        # Upgrade hashes made with an outdated method or cost while the
+        # plain password is at hand
+        if password_hasher.needs_rehash(user.password):
+            try:
+                user.password = password_hasher.hash(password)
+                session.commit()
+            except HashingBusy:
+                pass
 
-        username = data['username'].lower()
-        email = data['email'].lower()
-        password = data['password']
+        return ({'message': 'Login successful'}, 200), user_id
 
-        if len(password) < 8:
-          return jsonify({'error': 'Weak password'}), 400
+    except HashingBusy:
+        return busy_error(), None
+    except Exception as e:
+        return ({'error': 'An error occurred during login: {}'.format(str(e))}, 500), None
 
-        existing_user = session.query(User).filter(
-            (User.username.ilike(username)) | (User.email.ilike(email))
-        ).first()
 
-        if existing_user:
-            return jsonify({'error': 'Username or email already exists'}), 400
+def create_recipe_body(session, sender, user_id, data):
+    if user_id is None:
+        return {'error': 'User not authenticated'}, 401
 
-        new_user = User(username=username, email=email)
-        new_user.set_password(password)
+    try:
+        data, errors, message = load_new_recipe(data)
+        if errors:
+            return invalid_error(errors, message)
 
-        session.add(new_user)
+        new_recipe = Recipe(
+            title=data['title'],
+            description=data['description'],
+            instructions=data['instructions'],
+            created_by=user_id
+        )
+        # Store the JSON string along with the normalized ingredient rows
+        new_recipe.set_ingredients(data['ingredients'])
+
+        session.add(new_recipe)
         session.commit()
-        return jsonify({'message': 'User registered successfully'}), 201
+        recipe_changed.send(sender, recipe_id=new_recipe.id, user_id=user_id, action='created')
+        return new_recipe.to_json(), 201, version_headers(new_recipe.version)
 
+    except Exception as e:
+        return {'error': f'An error occurred during recipe creation: {str(e)}'}, 500
 
-    @app.route('/api/login', methods=['POST'])
-    def login():
+
+def update_recipe_body(session, sender, recipe_id, user_id, data, versions):
+    try:
+        recipe = session.query(Recipe).filter_by(id=recipe_id).first()
+
+        # Check if the recipe exists
+        if not recipe:
+            return {'error': 'Recipe not found'}, 404
+
+        # Check if the current user is the creator of the recipe
+        if recipe.created_by != user_id:
+            return {'error': 'You are not the creator of this recipe'}, 403
+
+        if versions is not None and recipe.version not in versions:
+            return conflict_error(recipe.version)
+
+        data, errors, message = load_recipe_update(data)
+        if errors:
+            return invalid_error(errors, message)
+
+        # Update the recipe fields
+        recipe.title = data.get('title', recipe.title)
+        recipe.description = data.get('description', recipe.description)
+
+        # Update ingredients only if provided in the request
+        if 'ingredients' in data:
+            recipe.set_ingredients(data['ingredients'])
+
+        recipe.instructions = data.get('instructions', recipe.instructions)
+
+        session.commit()
+        recipe_changed.send(sender, recipe_id=recipe_id, user_id=user_id, action='updated',
+                            ingredients_changed='ingredients' in data)
+        return recipe.to_json(), 200, version_headers(recipe.version)
+
+    except StaleDataError:
+        # Another request committed between our read and our write
+        session.rollback()
+        return conflict_error(current_version(session, recipe_id))
+    except Exception as e:
+        return {'error': f'An error occurred during recipe update: {str(e)}'}, 500
+
+
+def delete_recipe_body(session, sender, recipe_id, user_id):
+    recipe = session.query(Recipe).filter_by(id=recipe_id).first()
+
+    # Check if the recipe exists
+    if not recipe:
+        return {'error': 'Recipe not found'}, 404
+
+    # Check if the current user is the creator of the recipe
+    if recipe.created_by != user_id:
+        return {'error': 'You are not authorized to delete this recipe'}, 403
+
+    session.delete(recipe)
+    session.commit()
+    recipe_changed.send(sender, recipe_id=recipe_id, user_id=user_id, action='deleted')
+    return {'message': 'Recipe deleted successfully'}, 200
+
+
+def add_ingredients_body(session, sender, recipe_id, user_id, data, versions):
+    """
+    Append ingredients. On SQLite this is one UPDATE appending inside the database,
+    so concurrent appends never lose each other and the existing list is not
+    re-serialized. ``versions`` restricts the append to those recipe versions.
+    """
+    if not data:
+        return {'error': 'Invalid JSON format or empty request body'}, 400
+
+    data, errors, message = load_ingredients(data)
+    if errors:
+        return invalid_error(errors, message)
+    new_ingredients = data['ingredients']
+
+    if new_ingredients and user_id is not None and supports_json_append(session.get_bind()):
+        if append_ingredients(session, recipe_id, user_id, new_ingredients,
+                              versions) is not None:
+            session.commit()
+            recipe_changed.send(sender, recipe_id=recipe_id, user_id=user_id, action='updated')
+            recipe = session.get(Recipe, recipe_id)
+            return recipe.to_json(), 200, version_headers(recipe.version)
+        # Nothing matched: tell apart a missing recipe, another owner and a stale version
+        session.rollback()
+
+    recipe = session.query(Recipe).filter_by(id=recipe_id).first()
+
+    if not recipe:
+        return {'error': 'Recipe not found'}, 404
+
+    if recipe.created_by != user_id:
+        return {'error': 'You are not authorized to modify this recipe'}, 403
+
+    if versions is not None and recipe.version not in versions:
+        return conflict_error(recipe.version)
+
+    if new_ingredients:
+        # Databases without in-place JSON appends: the ORM version check guards the write
+        recipe.extend_ingredients(new_ingredients)
         try:
-            data = request.get_json()
-            username = data.get('username')
-            password = data.get('password')
+            session.commit()
+        except StaleDataError:
+            session.rollback()
+            return conflict_error(current_version(session, recipe_id))
+        recipe_changed.send(sender, recipe_id=recipe_id, user_id=user_id, action='updated')
 
-            if not username or not password:
-                return jsonify({'error': 'Missing username or password'}), 400
+    return recipe.to_json(), 200, version_headers(recipe.version)
 
-            user = session.query(User).filter_by(username=username).first()
 
-            if user is None or not check_password_hash(user.password, password):
-                return jsonify({'error': 'Invalid username or password'}), 401
+def patch_ingredients_body(session, sender, recipe_id, user_id, data, versions):
+    """
+    Partial ingredient update: {"operations": [{"op": "add", "ingredient": {...}},
+    {"op": "remove", "index": 2}, {"op": "replace", "index": 0, "ingredient": {...}}]}.
+    Operations apply in order and all or none are saved.
+    """
+    recipe = session.query(Recipe).filter_by(id=recipe_id).first()
 
-            login_user(user)
-            return jsonify({'message': 'Login successful'})
+    if not recipe:
+        return {'error': 'Recipe not found'}, 404
 
-        except Exception as e:
-            return jsonify({'error': 'An error occurred during login: {}'.format(str(e))}), 500
+    if user_id is None or recipe.created_by != user_id:
+        return {'error': 'You are not authorized to modify this recipe'}, 403
+
+    if versions is not None and recipe.version not in versions:
+        return conflict_error(recipe.version)
+
+    if not isinstance(data, dict) or not isinstance(data.get('operations'), list):
+        return {'error': 'Body must be an object with an "operations" list'}, 400
+
+    try:
+        recipe.set_ingredients(apply_ingredient_operations(
+            json.loads(recipe.ingredients or '[]'), data['operations']))
+    except ValueError as e:
+        return {'error': str(e)}, 400
+
+    try:
+        session.commit()
+    except StaleDataError:
+        session.rollback()
+        return conflict_error(current_version(session, recipe_id))
+    recipe_changed.send(sender, recipe_id=recipe_id, user_id=user_id, action='updated')
+    return recipe.to_json(), 200, version_headers(recipe.version)
+
+
+def register_routes(app, RECIPES_PER_PAGE, session):
+    init_recipe_state(app.config, app.extensions, app)
+    recipe_cache = app.extensions['recipe_cache']
+    search_cache = app.extensions['search_cache']
+    search_generations = app.extensions['search_generations']
+    pantry_index = app.extensions['pantry_index']
+    similarity_index = app.extensions['similarity_index']
+    max_recipes_per_page = app.config.get('MAX_RECIPES_PER_PAGE', MAX_PAGE_SIZE)
+
+    password_hasher = PasswordHasher.from_config(app.config)
+    app.extensions['password_hasher'] = password_hasher
+
+    changes = app.extensions['recipe_changes']
+
+    @app.before_request
+    def follow_recipe_changes():
+        # Before anything is served from the caches and indexes
+        if changes.due():
+            changes.poll(session())
+
+    def json_response(body, status=200):
+        return app.response_class(body, status=status, mimetype='application/json')
+
+    def respond(body, status=200, headers=()):
+        """The response for a (body, status[, headers]) result of the shared write helpers."""
+        response = json_response(body) if isinstance(body, str) else jsonify(body)
+        response.status_code = status
+        response.headers.extend(headers)
+        return response
+
+    def current_user_id():
+        return current_user.id if current_user.is_authenticated else None
+
+    max_batch_size = app.config.get('MAX_RECIPE_BATCH_SIZE', MAX_RECIPE_BATCH_SIZE)
+
+    def cached_response(entry):
+        """Serve a cached body with its ETag, answering If-None-Match with 304."""
+        response = json_response(entry.body)
+        response.headers.extend(entry.headers)
+        response.set_etag(entry.etag)
+        return response.make_conditional(request)
+
+    @app.route('/api/register', methods=['POST'])
+    def register_user():
+        return respond(*register_user_body(session, password_hasher,
+                                           request.get_json(silent=True)))
+
+    @app.route('/api/login', methods=['POST'])
+    def login():
+        result, user_id = login_body(session, password_hasher, request.get_json(silent=True))
+        if user_id is not None:
+            login_user(session.get(User, user_id))
+        return respond(*result)
 
     # CRUD Endpoints for Recipes
 
@@ -72,201 +626,257 @@ def register_routes(app, RECIPES_PER_PAGE, session):
         """
         A function to retrieve a list of recipes based on the requested page number.
         Uses the page parameter to calculate the offset for querying recipes from the database.
+        Passing cursor (empty for the first page) switches to keyset pagination instead: the
+        response then carries a next_cursor to pass back, and deep pages cost the same as the first.
+        Repeated ingredient parameters filter the list, e.g. ?ingredient=garlic&ingredient=basil,
+        requiring all of them unless match=any is given, and user=<id> keeps one user's recipes.
+        X-Total-Count, X-Total-Pages and a Link header with the next/prev pages describe the
+        whole listing; unfiltered totals come from the maintained counters in counts.py.
+        With ?ids=1,2,3 the given recipes are returned in that order instead (see get_recipe_batch).
+        fields= picks the returned fields (see projection.py); listings default to the
+        "summary" projection, fetching by ids to the full recipe.
+        Responses are cached per query string until a write touches one of the listed recipes.
         """
+        cache_key = ('list', tuple(sorted(request.args.items(multi=True))))
+        entry = recipe_cache.get(cache_key)
+        if entry is not None:
+            return cached_response(entry)
+        generation = recipe_cache.generation
+
         try:
-            page = request.args.get('page', 1, type=int)
-            offset = (page - 1) * RECIPES_PER_PAGE
-            recipes = Recipe.query.offset(offset).limit(RECIPES_PER_PAGE).all()
+            fields = parse_fields(request.args.get('fields'),
+                                  default='full' if 'ids' in request.args else 'summary')
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        if 'ids' in request.args:
+            try:
+                recipe_ids = parse_recipe_ids(request.args.getlist('ids'))
+            except ValueError:
+                return jsonify({'error': 'Recipe ids must be integers'}), 400
+            if len(recipe_ids) > max_batch_size:
+                return jsonify({'error': f'At most {max_batch_size} ids per request'}), 400
+            try:
+                entry = make_cached_response(
+                    recipe_batch_body(session, recipe_ids, fields, app.logger))
+            except Exception as e:
+                return jsonify({'error': 'An error occurred during recipe retrieval: {}'.format(str(e))}), 500
+            recipe_cache.set(cache_key, entry, tags=[recipe_tag(i) for i in set(recipe_ids)],
+                             generation=generation)
+            return cached_response(entry)
 
-            if not recipes:
+        try:
+            try:
+                listing = recipe_listing(session, request.path, request.args, fields,
+                                         RECIPES_PER_PAGE, max_recipes_per_page, app.logger)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            if listing is None:
                 return jsonify({'message': 'No recipes found'}), 404
 
-            modified_recipes = []
-            for recipe in recipes:
-                try:
-                    # Deserialize ingredients string to list
-                    ingredients = json.loads(recipe.ingredients)
-                    if not isinstance(ingredients, list):
-                        raise ValueError('Ingredients must be a list')
-                    # Ensure all ingredients have a 'quantity' key, if not, add it with an empty string
-                    for ingredient in ingredients:
-                        if 'quantity' not in ingredient:
-                            ingredient['quantity'] = ''
-                except (json.JSONDecodeError, ValueError) as e:
-                    # Skip processing the recipe if ingredients are empty or invalid
-                    app.logger.error(
-                        f'Error processing recipe with ID {recipe.id}: {str(e)}')
-                    continue
-
-                # Update recipe object with modified ingredients list
-                modified_recipe = recipe.serialize()
-                modified_recipe['ingredients'] = ingredients
-                modified_recipes.append(modified_recipe)
-
-            return jsonify(modified_recipes)
+            body, headers, tags = listing
+            entry = make_cached_response(body, headers)
+            recipe_cache.set(cache_key, entry, tags=tags, generation=generation)
+            return cached_response(entry)
         except Exception as e:
             return jsonify({'error': 'An error occurred during recipe retrieval: {}'.format(str(e))}), 500
 
     @app.route('/api/recipes/<int:recipe_id>', methods=['GET'])
     def get_recipe(recipe_id):
         try:
-            recipe = session.query(Recipe).get(recipe_id)
-            if recipe is None:
+            fields = parse_fields(request.args.get('fields'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        cache_key = ('recipe', recipe_id, fields)
+        entry = recipe_cache.get(cache_key)
+        if entry is not None:
+            return cached_response(entry)
+        generation = recipe_cache.generation
+
+        try:
+            found = recipe_body(session, recipe_id, fields)
+            if found is None:
                 return jsonify({'error': 'Recipe not found'}), 404
 
-            # Deserialize ingredients string to list
-            ingredients = json.loads(recipe.ingredients)
+            body, version = found
+            entry = make_cached_response(body, etag=str(version))
+            recipe_cache.set(cache_key, entry, tags=[recipe_tag(recipe_id)],
+                             generation=generation)
+            return cached_response(entry)
 
-            # Ensure all ingredients have a 'quantity' key, if not, add it with an empty string
-            for ingredient in ingredients:
-                if 'quantity' not in ingredient:
-                    ingredient['quantity'] = ''
+        except Exception as e:
+            return jsonify({'error': 'An error occurred during recipe retrieval: {}'.format(str(e))}), 500
 
-            # Update recipe object with modified ingredients list
-            recipe.ingredients = json.dumps(ingredients)
+    @app.route('/api/recipes/batch', methods=['POST'])
+    def get_recipe_batch():
+        """
+        Fetch many recipes at once: {"ids": [3, 1, 7]} returns those recipes in request
+        order, with {"id": 7, "error": "Recipe not found"} in place of unknown ids.
+        fields= in the query string narrows the returned fields as for the listing.
+        """
+        try:
+            fields = parse_fields(request.args.get('fields'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
 
-            return jsonify(recipe.serialize())
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or not isinstance(data.get('ids'), list):
+            return jsonify({'error': 'Body must be an object with an "ids" list'}), 400
+        try:
+            recipe_ids = parse_recipe_ids(data['ids'])
+        except ValueError:
+            return jsonify({'error': 'Recipe ids must be integers'}), 400
+        if len(recipe_ids) > max_batch_size:
+            return jsonify({'error': f'At most {max_batch_size} ids per request'}), 400
 
+        try:
+            return json_response(recipe_batch_body(session, recipe_ids, fields, app.logger))
         except Exception as e:
             return jsonify({'error': 'An error occurred during recipe retrieval: {}'.format(str(e))}), 500
 
     @app.route('/api/recipes', methods=['POST'])
     def create_recipe():
+        return respond(*create_recipe_body(session, app, current_user_id(),
+                                           request.get_json(silent=True)))
+
+    @app.route('/api/recipes/import', methods=['POST'])
+    def import_recipes():
+        """
+        Bulk create recipes from an NDJSON body (one recipe per line). The body is
+        streamed, and valid lines are committed in batches of batch_size. Invalid lines
+        are skipped and reported with their line numbers once the whole body is read.
+        """
         if not current_user.is_authenticated:
             return jsonify({'error': 'User not authenticated'}), 401
 
-        try:
-            data = request.get_json()
-
-            # Define required fields and disallowed fields
-            required_fields = {'title', 'description',
-                               'instructions', 'ingredients'}
-            disallowed_fields = {'created_by', 'id'}
-
-            # Check for disallowed fields
-            for field in disallowed_fields:
-                if field in data:
-                    return jsonify({'error': f'Field "{field}" is not allowed'}), 400
-
-            # Check if all required fields are provided
-            missing_fields = required_fields - set(data.keys())
-            if missing_fields:
-                return jsonify({'error': f'Missing field(s): {", ".join(missing_fields)}'}), 400
-
-            # Ensure ingredients is a list of dictionaries
-            ingredients = data.get('ingredients')
-            if not isinstance(ingredients, list):
-                return jsonify({'error': 'Ingredients must be a list of dictionaries'}), 400
-
-            # Check if each ingredient is a dictionary with 'name' and 'quantity' keys
-            for ingredient in ingredients:
-                if not isinstance(ingredient, dict) or 'name' not in ingredient:
-                    return jsonify({'error': 'Each ingredient must be a dictionary with "name" key'}), 400
-
-            # Convert ingredients to JSON string
-            ingredients_json = json.dumps(ingredients)
-
-            new_recipe = Recipe(
-                title=data['title'],
-                description=data['description'],
-                instructions=data['instructions'],
-                created_by=current_user.id,
-                ingredients=ingredients_json  # Pass the JSON string
-            )
-
-            session.add(new_recipe)
-            session.commit()
-            return jsonify(new_recipe.serialize()), 201
+        batch_size = clamp_limit(request.args.get('batch_size', type=int),
+                                 IMPORT_BATCH_SIZE, MAX_IMPORT_BATCH_SIZE)
+        user_id = current_user.id
 
-        except Exception as e:
-            return jsonify({'error': f'An error occurred during recipe creation: {str(e)}'}), 500
+        def notify(recipe_ids):
+            for recipe_id in recipe_ids:
+                recipe_changed.send(app, recipe_id=recipe_id,
+                                    user_id=user_id, action='created')
 
-    @app.route('/api/recipes/<int:recipe_id>', methods=['PUT'])
-    def update_recipe(recipe_id):
         try:
-            recipe = session.query(Recipe).filter_by(id=recipe_id).first()
-
-            # Check if the recipe exists
-            if not recipe:
-                return jsonify({'error': 'Recipe not found'}), 404
-
-            # Check if the current user is the creator of the recipe
-            if recipe.created_by != current_user.id:
-                return jsonify({'error': 'You are not the creator of this recipe'}), 403
-
-            data = request.get_json()
-
-            # Update the recipe fields
-            recipe.title = data.get('title', recipe.title)
-            recipe.description = data.get('description', recipe.description)
-
-            # Update ingredients only if provided in the request
-            if 'ingredients' in data:
-                new_ingredients = data['ingredients']
-                if not isinstance(new_ingredients, list):
-                    return jsonify({'error': 'Ingredients must be a list of dictionaries'}), 400
-                recipe.ingredients = json.dumps(new_ingredients)
-
-            recipe.instructions = data.get('instructions', recipe.instructions)
+            report = import_ndjson(session, request.stream, user_id,
+                                   batch_size=batch_size, on_commit=notify)
+            return jsonify(report.to_dict())
+        except Exception as e:
+            return jsonify({'error': f'An error occurred during recipe import: {str(e)}'}), 500
 
-            session.commit()
-            return jsonify(recipe.serialize())
+    @app.route('/api/recipes/export', methods=['GET'])
+    def export_recipes():
+        """
+        Stream every recipe, or only those of ?user=<id>, as NDJSON (default) or
+        ?format=csv. With ?compress=gzip the stream is gzip-encoded on the fly.
+        """
+        fmt = request.args.get('format', 'ndjson')
+        if fmt not in EXPORT_FORMATS:
+            return jsonify({'error': 'format must be "ndjson" or "csv"'}), 400
+        compress = request.args.get('compress')
+        if compress not in (None, 'gzip'):
+            return jsonify({'error': 'compress must be "gzip"'}), 400
+        user_id = request.args.get('user', type=int)
+
+        chunks = export_chunks(session, fmt=fmt, user_id=user_id)
+        headers = {'Content-Disposition': f'attachment; filename=recipes.{fmt}'}
+        if compress == 'gzip':
+            chunks = gzip_chunks(chunks)
+            headers['Content-Encoding'] = 'gzip'
+
+        mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+        return app.response_class(stream_with_context(chunks),
+                                  mimetype=mimetype, headers=headers)
 
-        except Exception as e:
-            return jsonify({'error': f'An error occurred during recipe update: {str(e)}'}), 500
+    @app.route('/api/recipes/<int:recipe_id>', methods=['PUT'])
+    def update_recipe(recipe_id):
+        return respond(*update_recipe_body(session, app, recipe_id, current_user_id(),
+                                           request.get_json(silent=True),
+                                           if_match_versions(request.if_match)))
 
     @app.route('/api/recipes/<int:recipe_id>', methods=['DELETE'])
     def delete_recipe(recipe_id):
-        recipe = session.query(Recipe).filter_by(id=recipe_id).first()
-
-        # Check if the recipe exists
-        if not recipe:
-            return jsonify({'error': 'Recipe not found'}), 404
-
-        # Check if the current user is the creator of the recipe
-        if recipe.created_by != current_user.id:
-            return jsonify({'error': 'You are not authorized to delete this recipe'}), 403
-
-        session.delete(recipe)
-        session.commit()
-        return jsonify({'message': 'Recipe deleted successfully'})
+        return respond(*delete_recipe_body(session, app, recipe_id, current_user_id()))
 
     # Endpoint for adding ingredients to a recipe
     @app.route('/api/recipes/<int:recipe_id>/ingredients', methods=['POST'])
     def add_ingredients(recipe_id):
-        recipe = session.query(Recipe).filter_by(id=recipe_id).first()
-
-        if not recipe:
-            return jsonify({'error': 'Recipe not found'}), 404
-
-        if recipe.created_by != current_user.id:
-            return jsonify({'error': 'You are not authorized to modify this recipe'}), 403
-
-        data = request.get_json()
-
-        if not data:
-            return jsonify({'error': 'Invalid JSON format or empty request body'}), 400
-
-        new_ingredients = data.get('ingredients', [])
-
-        if not isinstance(new_ingredients, list):
-            return jsonify({'error': 'Ingredients must be a list'}), 400
+        """
+        Append ingredients (see add_ingredients_body). If-Match restricts the append
+        to the given recipe version.
+        """
+        return respond(*add_ingredients_body(session, app, recipe_id, current_user_id(),
+                                             request.get_json(silent=True),
+                                             if_match_versions(request.if_match)))
+
+    @app.route('/api/recipes/<int:recipe_id>/ingredients', methods=['PATCH'])
+    def patch_ingredients(recipe_id):
+        """Apply ingredient operations (see patch_ingredients_body). Honours If-Match."""
+        return respond(*patch_ingredients_body(session, app, recipe_id, current_user_id(),
+                                               request.get_json(silent=True),
+                                               if_match_versions(request.if_match)))
+
+    @app.route('/api/recipes/match', methods=['POST'])
+    def match_recipes():
+        """
+        "What can I cook": {"pantry": ["egg", "flour", "milk"], "max_missing": 1} returns the
+        recipes using only pantry ingredients, or missing at most max_missing of theirs,
+        fewest missing first and then by the share of their ingredients in the pantry.
+        """
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or not isinstance(data.get('pantry'), list) \
+                or not all(isinstance(name, str) for name in data['pantry']):
+            return jsonify({'error': 'Body must be an object with a "pantry" list of names'}), 400
 
-        # Deserialize the existing ingredients from JSON string to a Python list
-        existing_ingredients = json.loads(recipe.ingredients)
+        max_missing = data.get('max_missing', 0)
+        if not isinstance(max_missing, int) or isinstance(max_missing, bool):
+            return jsonify({'error': 'max_missing must be an integer'}), 400
+        limit = clamp_limit(data.get('limit') if isinstance(data.get('limit'), int) else None,
+                            RECIPES_PER_PAGE, max_recipes_per_page)
 
-        # Append the new ingredients to the existing list
-        existing_ingredients.extend(new_ingredients)
+        try:
+            return jsonify(pantry_matches(session, pantry_index, data['pantry'],
+                                          max_missing, limit))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
 
-        # Serialize the updated list back into a JSON string
-        updated_ingredients_json = json.dumps(existing_ingredients)
+    @app.route('/api/recipes/<int:recipe_id>/similar', methods=['GET'])
+    def get_similar_recipes(recipe_id):
+        """
+        The k (default 10) recipes whose ingredients are most similar to this one's,
+        by Jaccard similarity of the ingredient names, best first.
+        """
+        k = clamp_limit(request.args.get('k', type=int), 10, max_recipes_per_page)
+        items = similar_recipe_items(session, similarity_index, recipe_id, k)
+        if items is None:
+            return jsonify({'error': 'Recipe not found'}), 404
+        return jsonify(items)
 
-        # Update the recipe's ingredients field with the updated JSON string
-        recipe.ingredients = updated_ingredients_json
+    @app.route('/api/shopping-list', methods=['POST'])
+    def get_shopping_list():
+        """
+        Merged ingredient totals for a meal plan: {"recipes": [{"id": 1, "multiplier": 2},
+        {"id": 3}]} returns every ingredient of those recipes once, with its amounts
+        scaled by the multipliers, converted to a common unit and summed.
+        """
+        try:
+            plan = parse_plan(request.get_json(silent=True), max_batch_size)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
 
-        session.commit()
+        try:
+            return jsonify(shopping_list(session, plan))
+        except Exception as e:
+            return jsonify({'error': f'An error occurred building the shopping list: {str(e)}'}), 500
 
-        return jsonify(recipe.serialize())
+    @app.route('/api/cache/stats', methods=['GET'])
+    def cache_stats():
+        stats = {'recipes': recipe_cache.stats(), 'search': search_cache.stats()}
+        if 'user_cache' in app.extensions:
+            stats['users'] = app.extensions['user_cache'].stats()
+        return jsonify(stats)
 
     # Search functionality for recipes by title or ingredients
     @app.route('/api/recipes/search', methods=['GET'])
@@ -274,20 +884,32 @@ def register_routes(app, RECIPES_PER_PAGE, session):
         keyword = request.args.get('q')
         if not keyword:
             return jsonify({'error': 'Query parameter "q" is required for search'}), 400
+        try:
+            fields = parse_fields(request.args.get('fields'), default='summary')
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
 
         try:
             # Check if the user is authenticated
             if not current_user.is_authenticated:
                 return jsonify({'error': 'User not authenticated'}), 401
 
-            # Search by title or ingredients only for recipes created by the authenticated user
-            recipes = session.query(Recipe).filter(
-                (Recipe.created_by == current_user.id) &
-                ((Recipe.title.ilike(f'%{keyword}%')) | (
-                    Recipe.ingredients.ilike(f'%{keyword}%')))
-            ).all()
-
-            return jsonify([recipe.serialize() for recipe in recipes])
+            # Search by title or ingredients only for recipes created by the authenticated user,
+            # ranked by relevance through the full-text index
+            page = max(request.args.get('page', 1, type=int), 1)
+            user_id = current_user.id
+            # The generation is read first: a write during the query leaves the
+            # result under a key that is already out of date
+            cache_key = (user_id, search_generations.get(user_id),
+                         normalize_query(session.get_bind(), keyword), page, fields)
+            entry = search_cache.get(cache_key)
+            if entry is not None:
+                return cached_response(entry)
+
+            entry = make_cached_response(
+                search_body(session, user_id, keyword, page, fields, RECIPES_PER_PAGE))
+            search_cache.set(cache_key, entry)
+            return cached_response(entry)
 
         except Exception as e:
             return jsonify({'error': 'An error occurred during search: ' + str(e)}), 500
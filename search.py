@@ -0,0 +1,175 @@
+import json
+import re
+
+from sqlalchemy import DDL, column, event, table, text
+
+from models import Base, Recipe, write_after_flush
+
+# Word characters only, so punctuation in user input can never be parsed
+# as FTS5 query syntax (quotes, NEAR, column filters, ...)
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Title matches weigh more than ingredient matches when ranking
+TITLE_WEIGHT = 10.0
+INGREDIENTS_WEIGHT = 1.0
+
+REBUILD_BATCH_SIZE = 1000
+
+CREATE_FTS_TABLE = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS recipes_fts USING fts5("
+    "title, ingredients, tokenize='unicode61 remove_diacritics 2')"
+)
+
+recipes_fts = table('recipes_fts', column('rowid'),
+                    column('title'), column('ingredients'))
+
+event.listen(
+    Base.metadata, 'after_create',
+    DDL(CREATE_FTS_TABLE).execute_if(dialect='sqlite')
+)
+event.listen(
+    Base.metadata, 'before_drop',
+    DDL('DROP TABLE IF EXISTS recipes_fts').execute_if(dialect='sqlite')
+)
+
+
+def fts_enabled(bind):
+    return bind.dialect.name == 'sqlite'
+
+
+def ingredient_text(ingredients):
+    """
+    Flatten a JSON ingredients blob into the ingredient names only, so that
+    JSON keys such as "name" or "quantity" never end up in the index.
+    """
+    try:
+        items = json.loads(ingredients) if ingredients else []
+    except (TypeError, ValueError):
+        return ''
+    if not isinstance(items, list):
+        return ''
+    return ' '.join(str(item['name']) for item in items
+                    if isinstance(item, dict) and item.get('name'))
+
+
+def normalize_query(bind, keyword):
+    """
+    ``keyword`` reduced to what find_recipes searches for, so that queries such as
+    "Garlic, tomato" and "garlic tomato" that return the same recipes compare equal.
+    """
+    if not fts_enabled(bind):
+        return keyword.lower()
+    return ' '.join(TOKEN_RE.findall(keyword.lower()))
+
+
+def build_match_query(keyword):
+    """
+    Turn free text into an FTS5 MATCH expression where every token must be
+    present and may be a prefix, e.g. "garl tom" -> '"garl"* "tom"*'.
+    Returns None when the keyword contains no searchable tokens.
+    """
+    tokens = TOKEN_RE.findall(keyword.lower())
+    if not tokens:
+        return None
+    return ' '.join('"{}"*'.format(token) for token in tokens)
+
+
+_UNINDEX = text('DELETE FROM recipes_fts WHERE rowid = :id')
+_INDEX = text('INSERT INTO recipes_fts (rowid, title, ingredients) '
+              'VALUES (:id, :title, :ingredients)')
+
+
+def _index_row(recipe_id, title, ingredients):
+    return {'id': recipe_id, 'title': title or '', 'ingredients': ingredient_text(ingredients)}
+
+
+def index_recipe(connection, recipe_id, title, ingredients):
+    connection.execute(_UNINDEX, {'id': recipe_id})
+    connection.execute(_INDEX, _index_row(recipe_id, title, ingredients))
+
+
+def unindex_recipe(connection, recipe_id):
+    connection.execute(_UNINDEX, {'id': recipe_id})
+
+
+@event.listens_for(Recipe, 'after_insert')
+@event.listens_for(Recipe, 'after_update')
+def _sync_recipe(mapper, connection, target):
+    if fts_enabled(connection):
+        # Batched with the other recipes of the flush, see write_after_flush
+        write_after_flush(target, _UNINDEX, {'id': target.id})
+        write_after_flush(target, _INDEX, _index_row(target.id, target.title, target.ingredients))
+
+
+@event.listens_for(Recipe, 'after_delete')
+def _remove_recipe(mapper, connection, target):
+    if fts_enabled(connection):
+        unindex_recipe(connection, target.id)
+
+
+def find_recipes(session, user_id, keyword, limit, offset=0, options=()):
+    """
+    Return the recipes of ``user_id`` matching ``keyword``, best match first.
+    Falls back to a substring scan on databases without FTS5. ``options`` are
+    applied to the query, e.g. load_only() to leave unneeded columns unread.
+    """
+    query = session.query(Recipe).options(*options).filter(Recipe.created_by == user_id)
+
+    if not fts_enabled(session.get_bind()):
+        query = query.filter(
+            Recipe.title.ilike(f'%{keyword}%') |
+            Recipe.ingredients.ilike(f'%{keyword}%')
+        ).order_by(Recipe.id)
+        return query.offset(offset).limit(limit).all()
+
+    match = build_match_query(keyword)
+    if match is None:
+        return []
+
+    query = (
+        query.join(recipes_fts, recipes_fts.c.rowid == Recipe.id)
+        .filter(text('recipes_fts MATCH :match'))
+        .order_by(text('bm25(recipes_fts, :title_weight, :ingredients_weight)'),
+                  Recipe.id)
+        .params(match=match, title_weight=TITLE_WEIGHT,
+                ingredients_weight=INGREDIENTS_WEIGHT)
+    )
+    return query.offset(offset).limit(limit).all()
+
+
+def rebuild_index(session):
+    """
+    Repopulate the FTS table from the recipes table, e.g. for databases
+    created before the index existed. Returns the number of indexed recipes.
+    """
+    connection = session.connection()
+    if not fts_enabled(connection):
+        return 0
+
+    connection.execute(text(CREATE_FTS_TABLE))
+    connection.execute(text('DELETE FROM recipes_fts'))
+
+    count = 0
+    rows = session.query(Recipe.id, Recipe.title, Recipe.ingredients) \
+        .order_by(Recipe.id).yield_per(REBUILD_BATCH_SIZE)
+    batch = []
+    for recipe_id, title, ingredients in rows:
+        batch.append({'id': recipe_id, 'title': title or '',
+                      'ingredients': ingredient_text(ingredients)})
+        if len(batch) >= REBUILD_BATCH_SIZE:
+            count += _insert_batch(connection, batch)
+            batch = []
+    if batch:
+        count += _insert_batch(connection, batch)
+
+    session.commit()
+    return count
+
+
+def _insert_batch(connection, batch):
+    connection.execute(
+        text('INSERT INTO recipes_fts (rowid, title, ingredients) '
+             'VALUES (:id, :title, :ingredients)'),
+        batch
+    )
+    return len(batch)
@@ -0,0 +1,73 @@
+"""
+Shopping lists: the ingredients of a set of recipes merged into totals.
+
+Ingredient rows carry their quantity already parsed into a canonical amount
+and unit (see units.py), so a list is a single GROUP BY over
+recipe_ingredients: amounts are multiplied by each recipe's multiplier and
+summed per ingredient name and unit, in the database, with no quantity
+strings parsed per request.
+"""
+from sqlalchemy import case, func
+
+from models import Recipe, RecipeIngredient
+from units import display_quantity
+
+
+def parse_plan(data, max_recipes):
+    """
+    Recipe id -> multiplier from a body such as
+    {"recipes": [{"id": 1, "multiplier": 2}, {"id": 3}]}. A recipe listed twice
+    counts with the sum of its multipliers. Raises ValueError with the message
+    for a 400 response.
+    """
+    if not isinstance(data, dict) or not isinstance(data.get('recipes'), list):
+        raise ValueError('Body must be an object with a "recipes" list')
+    if len(data['recipes']) > max_recipes:
+        raise ValueError(f'At most {max_recipes} recipes per shopping list')
+
+    plan = {}
+    for number, entry in enumerate(data['recipes']):
+        recipe_id = entry.get('id') if isinstance(entry, dict) else None
+        if not isinstance(recipe_id, int) or isinstance(recipe_id, bool):
+            raise ValueError(f'Recipe {number}: "id" must be an integer')
+        multiplier = entry.get('multiplier', 1)
+        if not isinstance(multiplier, (int, float)) or isinstance(multiplier, bool) \
+                or not 0 < multiplier <= 1000:
+            raise ValueError(f'Recipe {number}: "multiplier" must be a number '
+                             'above 0 and at most 1000')
+        plan[recipe_id] = plan.get(recipe_id, 0) + multiplier
+    return plan
+
+
+def shopping_list(session, plan):
+    """
+    The merged ingredients of the recipes in ``plan`` (recipe id -> multiplier):
+    ``{"items": [...], "missing": [ids of unknown recipes]}``. Each item has the
+    ingredient name, the total amount and its unit, and the number of recipes
+    using it. Ingredients whose quantity could not be parsed ("to taste") are
+    listed with a null amount and unit.
+    """
+    if not plan:
+        return {'items': [], 'missing': []}
+    rows = RecipeIngredient
+    multiplier = case(plan, value=rows.recipe_id)
+    grouped = session.query(
+        rows.name_key,
+        func.min(rows.name),
+        rows.unit,
+        func.sum(rows.amount * multiplier),
+        func.count(func.distinct(rows.recipe_id)),
+    ).filter(rows.recipe_id.in_(plan)) \
+        .group_by(rows.name_key, rows.unit) \
+        .order_by(rows.name_key, rows.unit).all()
+
+    items = []
+    for _, name, unit, amount, recipes in grouped:
+        item = {'name': name, 'amount': None, 'unit': None, 'recipes': recipes}
+        if unit is not None and amount is not None:
+            item['amount'], item['unit'] = display_quantity(amount, unit)
+        items.append(item)
+
+    found = {recipe_id for (recipe_id,) in
+             session.query(Recipe.id).filter(Recipe.id.in_(plan))}
+    return {'items': items, 'missing': [recipe_id for recipe_id in plan if recipe_id not in found]}
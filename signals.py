@@ -0,0 +1,11 @@
+from blinker import Namespace
+
+_signals = Namespace()
+
+# Sent by the app after a recipe write has been committed, with the keyword
+# arguments recipe_id, user_id and action ('created', 'updated' or 'deleted').
+# Updates also pass ingredients_changed, False when the ingredients were kept.
+recipe_changed = _signals.signal('recipe-changed')
+
+# Sent when a user row is updated or deleted, with the keyword argument user_id.
+user_changed = _signals.signal('user-changed')
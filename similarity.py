@@ -0,0 +1,303 @@
+"""
+Similar-recipe lookup by ingredient Jaccard similarity, using MinHash and LSH.
+
+Each recipe's set of ingredient names is summarized by a MinHash signature of
+NUM_PERMUTATIONS 32-bit values, stored in recipe_signatures and kept current by
+mapper events. The share of positions in which two signatures agree estimates
+the Jaccard similarity of the two sets. Signatures are cut into LSH_BANDS bands,
+and recipes sharing a whole band become candidates, so a lookup only looks at
+recipes that are likely to be similar (a Jaccard similarity of about 0.5 and up
+with 16 bands of 4 rows) instead of the whole catalog. The best candidates are
+then ranked by their exact Jaccard similarity from recipe_ingredients.
+"""
+import heapq
+import json
+import os
+import random
+import threading
+import zlib
+from array import array
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
+
+from sqlalchemy import bindparam, delete, event, insert, inspect
+
+from models import (Recipe, RecipeIngredient, RecipeSignature, ingredient_key,
+                    is_named_ingredient, write_after_flush)
+
+NUM_PERMUTATIONS = 64
+LSH_BANDS = 16
+SIGNATURE_BATCH_SIZE = 2000
+# Candidates ranked exactly per lookup, as a multiple of the results asked for
+CANDIDATE_FACTOR = 5
+
+_PRIME = (1 << 61) - 1
+# A fixed seed: signatures are compared across processes and restarts
+_random = random.Random(20240415)
+_PERMUTATIONS = [(_random.randrange(1, _PRIME), _random.randrange(_PRIME))
+                 for _ in range(NUM_PERMUTATIONS)]
+
+
+def compute_signature(keys):
+    """MinHash signature of the ingredient name keys, or None for an empty set."""
+    hashes = [zlib.crc32(key.encode('utf-8')) for key in set(keys)]
+    if not hashes:
+        return None
+    return array('I', (min((a * value + b) % _PRIME for value in hashes) & 0xFFFFFFFF
+                       for a, b in _PERMUTATIONS))
+
+
+def ingredient_keys(blob):
+    """Name keys of the named ingredients in a recipe's ingredients blob."""
+    try:
+        ingredients = json.loads(blob or '[]')
+    except ValueError:
+        return set()
+    if not isinstance(ingredients, list):
+        return set()
+    return {ingredient_key(ingredient['name'])
+            for ingredient in ingredients if is_named_ingredient(ingredient)}
+
+
+_signatures = RecipeSignature.__table__
+_DELETE_SIGNATURE = delete(_signatures).where(_signatures.c.recipe_id == bindparam('id'))
+_INSERT_SIGNATURE = insert(_signatures)
+
+
+def store_signature(connection, recipe_id, keys):
+    connection.execute(_DELETE_SIGNATURE, {'id': recipe_id})
+    signature = compute_signature(keys)
+    if signature is not None:
+        connection.execute(_INSERT_SIGNATURE,
+                           {'recipe_id': recipe_id, 'signature': signature.tobytes()})
+
+
+def _queue_signature(target):
+    # Batched with the other recipes of the flush, see write_after_flush
+    write_after_flush(target, _DELETE_SIGNATURE, {'id': target.id})
+    signature = compute_signature(ingredient_keys(target.ingredients))
+    if signature is not None:
+        write_after_flush(target, _INSERT_SIGNATURE,
+                          {'recipe_id': target.id, 'signature': signature.tobytes()})
+
+
+@event.listens_for(Recipe, 'after_insert')
+def _store_signature_on_insert(mapper, connection, target):
+    _queue_signature(target)
+
+
+@event.listens_for(Recipe, 'after_update')
+def _store_signature_on_update(mapper, connection, target):
+    if inspect(target).attrs.ingredients.history.has_changes():
+        _queue_signature(target)
+
+
+@event.listens_for(Recipe, 'before_delete')
+def _remove_signature(mapper, connection, target):
+    # Before the recipe row goes, or an enforced foreign key rejects the delete
+    connection.execute(_DELETE_SIGNATURE, {'id': target.id})
+
+
+def signature_batch(batch):
+    """(recipe_id, signature bytes) for (recipe_id, keys) pairs; runs in worker processes."""
+    return [(recipe_id, compute_signature(keys).tobytes())
+            for recipe_id, keys in batch if keys]
+
+
+def rebuild_signatures(session, workers=None, batch_size=SIGNATURE_BATCH_SIZE):
+    """
+    Recompute every signature from recipe_ingredients, hashing batches of recipes
+    in ``workers`` processes (all cores by default, 0 for in-process). Returns the
+    number of signatures written.
+    """
+    workers = (os.cpu_count() or 1) if workers is None else workers
+    table = RecipeSignature.__table__
+    connection = session.connection()
+    connection.execute(delete(table))
+
+    def batches():
+        rows = session.query(RecipeIngredient.recipe_id, RecipeIngredient.name_key) \
+            .order_by(RecipeIngredient.recipe_id).yield_per(batch_size * 10)
+        batch = []
+        for recipe_id, group in groupby(rows, key=lambda row: row[0]):
+            batch.append((recipe_id, {key for _, key in group}))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def write(signatures):
+        if signatures:
+            connection.execute(insert(table), [
+                {'recipe_id': recipe_id, 'signature': signature}
+                for recipe_id, signature in signatures])
+        return len(signatures)
+
+    count = 0
+    if workers == 0:
+        for batch in batches():
+            count += write(signature_batch(batch))
+    else:
+        with ProcessPoolExecutor(workers) as executor:
+            # A bounded window keeps memory flat however large the catalog is
+            window = deque()
+            for batch in batches():
+                window.append(executor.submit(signature_batch, batch))
+                if len(window) >= 2 * workers:
+                    count += write(window.popleft().result())
+            while window:
+                count += write(window.popleft().result())
+    session.commit()
+    return count
+
+
+class SimilarityIndex:
+    """
+    LSH buckets over the stored signatures, built on first use and kept current
+    through the recipe_changed signal, other processes' writes included, like
+    the pantry index.
+    """
+
+    def __init__(self, bands=LSH_BANDS):
+        self.bands = bands
+        self.rows = NUM_PERMUTATIONS // bands
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._pending = set()
+        self._building = False
+        self.ready = False
+        self._reset()
+
+    def _reset(self):
+        self._signatures = {}           # recipe id -> array('I') signature
+        self._buckets = [{} for _ in range(self.bands)]  # band -> band bytes -> recipe ids
+
+    def __len__(self):
+        return len(self._signatures)
+
+    def clear(self):
+        """Drop everything; the index is rebuilt on the next refresh."""
+        with self._lock:
+            self.ready = False
+            self._pending.clear()
+            self._reset()
+
+    def invalidate(self, recipe_id):
+        """Queue ``recipe_id`` to be reloaded before the next lookup."""
+        with self._lock:
+            if self.ready or self._building:
+                self._pending.add(recipe_id)
+
+    def build(self, session, batch_size=SIGNATURE_BATCH_SIZE):
+        """
+        (Re)build the buckets from recipe_signatures into a separate index, outside
+        the lock, as PantryIndex.build does; recipes invalidated meanwhile stay queued.
+        """
+        with self._lock:
+            self._building = True
+            self._pending.clear()
+        try:
+            fresh = SimilarityIndex(self.bands)
+            rows = session.query(RecipeSignature.recipe_id, RecipeSignature.signature) \
+                .yield_per(batch_size)
+            for recipe_id, signature in rows:
+                fresh._add(recipe_id, signature)
+        except BaseException:
+            with self._lock:
+                self._building = False
+            raise
+        with self._lock:
+            self._signatures, self._buckets = fresh._signatures, fresh._buckets
+            self._building = False
+            self.ready = True
+
+    def refresh(self, session):
+        """Build the index if needed and reload the recipes changed since the last lookup."""
+        if not self.ready:
+            with self._build_lock:
+                if not self.ready:
+                    self.build(session)
+        with self._lock:
+            pending, self._pending = list(self._pending), set()
+        if not pending:
+            return
+
+        signatures = dict.fromkeys(pending)
+        for start in range(0, len(pending), SIGNATURE_BATCH_SIZE):
+            chunk = pending[start:start + SIGNATURE_BATCH_SIZE]
+            signatures.update(
+                session.query(RecipeSignature.recipe_id, RecipeSignature.signature)
+                .filter(RecipeSignature.recipe_id.in_(chunk)))
+        with self._lock:
+            for recipe_id, signature in signatures.items():
+                self._remove(recipe_id)
+                if signature is not None:
+                    self._add(recipe_id, signature)
+
+    def candidates(self, recipe_id, limit):
+        """
+        Up to ``limit`` recipes sharing an LSH band with ``recipe_id``, the ones whose
+        signatures agree most first.
+        """
+        with self._lock:
+            signature = self._signatures.get(recipe_id)
+            if signature is None:
+                return []
+            found = set()
+            for band, key in enumerate(self._band_keys(signature)):
+                found.update(self._buckets[band].get(key, ()))
+            found.discard(recipe_id)
+            agreeing = ((sum(a == b for a, b in zip(signature, self._signatures[other])), other)
+                        for other in found)
+            return [other for _, other in heapq.nlargest(limit, agreeing)]
+
+    def _band_keys(self, signature):
+        raw = signature.tobytes()
+        width = self.rows * signature.itemsize
+        return [raw[band * width:(band + 1) * width] for band in range(self.bands)]
+
+    def _add(self, recipe_id, raw):
+        signature = array('I')
+        signature.frombytes(raw)
+        self._signatures[recipe_id] = signature
+        for band, key in enumerate(self._band_keys(signature)):
+            self._buckets[band].setdefault(key, set()).add(recipe_id)
+
+    def _remove(self, recipe_id):
+        signature = self._signatures.pop(recipe_id, None)
+        if signature is None:
+            return
+        for band, key in enumerate(self._band_keys(signature)):
+            bucket = self._buckets[band].get(key)
+            if bucket is not None:
+                bucket.discard(recipe_id)
+                if not bucket:
+                    del self._buckets[band][key]
+
+
+def similar_recipes(session, index, recipe_id, limit):
+    """
+    The ``limit`` recipes most similar to ``recipe_id`` as (recipe_id, jaccard)
+    pairs, best first. Only LSH candidates are considered.
+    """
+    index.refresh(session)
+    candidates = index.candidates(recipe_id, limit * CANDIDATE_FACTOR)
+    if not candidates:
+        return []
+
+    keys = defaultdict(set)
+    rows = session.query(RecipeIngredient.recipe_id, RecipeIngredient.name_key) \
+        .filter(RecipeIngredient.recipe_id.in_(candidates + [recipe_id]))
+    for other, key in rows:
+        keys[other].add(key)
+
+    target = keys.get(recipe_id, set())
+    scored = []
+    for other in candidates:
+        shared = len(target & keys[other])
+        if shared:
+            scored.append((shared / len(target | keys[other]), other))
+    scored.sort(key=lambda item: (-item[0], item[1]))
+    return [(other, similarity) for similarity, other in scored[:limit]]
@@ -0,0 +1,53 @@
+import os
+import unittest
+from contextlib import contextmanager
+from unittest.mock import patch
+
+from sqlalchemy.orm import Session
+
+# Replay writes made outside the app on the very next request
+os.environ.setdefault('CHANGE_POLL_INTERVAL_MS', '0')
+
+from main import app
+from models import Base, engine, session
+
+
+@contextmanager
+def another_process():
+    """A session whose writes look like those of another worker or a CLI command."""
+    with patch('changes.ORIGIN', 'another-process'), Session(engine) as other:
+        yield other
+
+
+class ApiTestCase(unittest.TestCase):
+    """Creates the schema for the class and logs ``self.client`` in as ``username``."""
+    username = 'api_user'
+
+    @classmethod
+    def setUpClass(cls):
+        Base.metadata.create_all(engine)
+
+    @classmethod
+    def tearDownClass(cls):
+        session.remove()
+        Base.metadata.drop_all(engine)
+
+    def setUp(self):
+        self.client = self.login(self.username)
+
+    def login(self, username):
+        client = app.test_client()
+        data = {'username': username,
+                'email': f'{username}@example.com', 'password': 'password123'}
+        client.post('/api/register', json=data)
+        self.assertEqual(client.post('/api/login', json=data).status_code, 200)
+        return client
+
+    def create_recipe(self, title, ingredients=(), **fields):
+        data = {'title': title, 'description': '', 'instructions': '',
+                'ingredients': [{'name': ingredient} if isinstance(ingredient, str)
+                                else ingredient for ingredient in ingredients],
+                **fields}
+        response = self.client.post('/api/recipes', json=data)
+        self.assertEqual(response.status_code, 201)
+        return response.json['id']
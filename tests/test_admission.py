@@ -0,0 +1,116 @@
+import asyncio
+import threading
+import time
+import unittest
+from unittest import mock
+
+from admission import AsyncConcurrencyLimit, ConcurrencyLimit, TokenBuckets
+from main import app
+from tests import ApiTestCase
+
+
+class TestLimits(unittest.TestCase):
+    def test_concurrency_limit_queues_then_sheds(self):
+        limit = ConcurrencyLimit(1, queue_depth=1, queue_timeout=5)
+        self.assertIsNone(limit.acquire())
+
+        results = []
+        waiter = threading.Thread(target=lambda: results.append(limit.acquire()))
+        waiter.start()
+        while limit.stats()['queued'] == 0:
+            time.sleep(0.001)
+        # The queue is full: shed at once
+        self.assertEqual(limit.acquire(), 'queue_full')
+        limit.release()
+        waiter.join()
+        self.assertEqual(results, [None])
+        self.assertEqual(limit.stats(), {'active': 1, 'queued': 0, 'limit': 1, 'admitted': 2,
+                                         'rejected': {'queue_full': 1}})
+
+    def test_queue_timeout(self):
+        limit = ConcurrencyLimit(1, queue_depth=1, queue_timeout=0.01)
+        limit.acquire()
+        self.assertEqual(limit.acquire(), 'queue_timeout')
+        limit.release()
+        self.assertIsNone(limit.acquire())
+
+    def test_async_limit_hands_slots_to_waiters(self):
+        async def scenario():
+            limit = AsyncConcurrencyLimit(1, queue_depth=1, queue_timeout=5)
+            self.assertIsNone(await limit.acquire())
+            waiter = asyncio.ensure_future(limit.acquire())
+            await asyncio.sleep(0)
+            self.assertEqual(await limit.acquire(), 'queue_full')
+            limit.release()
+            self.assertIsNone(await waiter)
+            self.assertEqual(limit.stats()['active'], 1)
+
+            limit.queue_timeout = 0.01
+            self.assertEqual(await limit.acquire(), 'queue_timeout')
+            limit.release()
+            return limit.stats()
+
+        self.assertEqual(asyncio.run(scenario()), {
+            'active': 0, 'queued': 0, 'limit': 1, 'admitted': 2,
+            'rejected': {'queue_full': 1, 'queue_timeout': 1}})
+
+    def test_token_bucket(self):
+        buckets = TokenBuckets(rate=2, burst=2, max_keys=1)
+        with mock.patch('admission.time.monotonic', return_value=100.0):
+            self.assertEqual([buckets.take('a'), buckets.take('a')], [0, 0])
+            self.assertEqual(buckets.take('a'), 0.5)
+            # Buckets are per key
+            self.assertEqual(buckets.take('b'), 0)
+        with mock.patch('admission.time.monotonic', return_value=100.5):
+            self.assertEqual(buckets.take('b'), 0)
+            self.assertEqual(buckets.take('b'), 0)
+            self.assertEqual(buckets.take('b'), 0.5)
+        self.assertEqual(buckets.rejected, 2)
+        self.assertEqual(len(buckets._buckets), 1)
+
+
+class TestAdmission(ApiTestCase):
+    username = 'admission_user'
+
+    def setUp(self):
+        self.controller = app.extensions['admission']
+        super().setUp()
+        self.recipe_id = self.create_recipe('Admitted', ['oats'])
+
+    def test_rate_limit(self):
+        with mock.patch.dict(self.controller.buckets, {'search': TokenBuckets(rate=1, burst=2)}):
+            for _ in range(2):
+                response = self.client.get('/api/recipes/search', query_string={'q': 'oats'})
+                self.assertEqual(response.status_code, 200)
+            response = self.client.get('/api/recipes/search', query_string={'q': 'oats'})
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response.headers['Retry-After'], '1')
+            # Other route classes have their own buckets
+            self.assertEqual(self.client.get('/api/recipes').status_code, 200)
+
+    def test_saturated_class_is_shed_and_cheap_routes_are_not(self):
+        saturated = ConcurrencyLimit(1, queue_depth=0)
+        saturated.acquire()
+        with mock.patch.dict(self.controller.limits, {'search': saturated}):
+            response = self.client.get('/api/recipes/search', query_string={'q': 'oats'})
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.headers['Retry-After'], '1')
+            self.assertEqual(self.client.get(f'/api/recipes/{self.recipe_id}').status_code, 200)
+
+            metrics = self.client.get('/metrics').get_data(as_text=True)
+            self.assertIn('recipe_admission_active{route_class="search"} 1', metrics)
+            self.assertIn('recipe_admission_rejected_total'
+                          '{route_class="search",reason="queue_full"} 1', metrics)
+
+    def test_slots_are_released(self):
+        limit = self.controller.limits['listing']
+        before = limit.stats()['admitted']
+        self.client.get('/api/recipes')
+        self.client.get('/api/recipes/export')
+        self.assertEqual(limit.stats()['admitted'], before + 1)
+        self.assertEqual(limit.stats()['active'], 0)
+        self.assertEqual(self.controller.limits['bulk'].stats()['active'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
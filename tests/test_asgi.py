@@ -0,0 +1,139 @@
+import importlib.util
+import json
+import unittest
+
+ASGI_DEPENDENCIES = ('starlette', 'aiosqlite', 'httpx')
+MISSING = [name for name in ASGI_DEPENDENCIES if importlib.util.find_spec(name) is None]
+
+if not MISSING:
+    from starlette.testclient import TestClient
+
+    from asgi import create_asgi_app
+
+from main import app
+from models import Base, engine, session
+
+# Headers that must be the same whichever app answered
+CONTRACT_HEADERS = ('content-type', 'etag', 'x-total-count', 'x-total-pages', 'link')
+
+
+def recipe(title, *names):
+    return {'title': title, 'description': '', 'instructions': '',
+            'ingredients': [{'name': name, 'quantity': '1'} for name in names]}
+
+
+@unittest.skipIf(MISSING, f'ASGI dependencies not installed: {", ".join(MISSING)}')
+class TestAsgiApp(unittest.TestCase):
+    credentials = {'username': 'asgi_user', 'email': 'asgi_user@example.com',
+                   'password': 'password123'}
+
+    @classmethod
+    def setUpClass(cls):
+        Base.metadata.create_all(engine)
+
+    @classmethod
+    def tearDownClass(cls):
+        session.remove()
+        Base.metadata.drop_all(engine)
+
+    def setUp(self):
+        # Both apps on the same database (Config), each with its own caches
+        self.flask = app.test_client()
+        self.flask.post('/api/register', json=self.credentials)
+        self.assertEqual(self.flask.post('/api/login', json=self.credentials).status_code, 200)
+        self.asgi = TestClient(create_asgi_app())
+        self.asgi.__enter__()
+        self.addCleanup(self.asgi.__exit__, None, None, None)
+
+    def login(self):
+        response = self.asgi.post('/api/login', json=self.credentials)
+        self.assertEqual(response.status_code, 200)
+
+    def test_responses_match_flask(self):
+        self.login()
+        ids = [self.flask.post('/api/recipes', json=recipe(f'Stew {i}', 'onion', 'carrot'))
+               .json['id'] for i in range(3)]
+
+        for method, path, body in [
+            ('GET', '/api/recipes', None),
+            ('GET', '/api/recipes?page=2&limit=2', None),
+            ('GET', '/api/recipes?cursor=&limit=2&ingredient=onion', None),
+            ('GET', '/api/recipes?page=99', None),
+            ('GET', '/api/recipes?cursor=bogus', None),
+            ('GET', f'/api/recipes/{ids[0]}?fields=summary', None),
+            ('GET', '/api/recipes/0', None),
+            ('GET', '/api/recipes/search?q=stew', None),
+            ('POST', '/api/recipes/batch', {'ids': [ids[1], 0]}),
+            ('POST', '/api/recipes/match', {'pantry': ['onion', 'carrot']}),
+            ('POST', '/api/shopping-list', {'recipes': [{'id': ids[0], 'multiplier': 2},
+                                                        {'id': ids[1]}]}),
+            ('POST', '/api/recipes', {'title': 'No ingredients'}),
+            ('PUT', f'/api/recipes/{ids[2]}', {'title': 'Renamed'}),
+        ]:
+            with self.subTest(method=method, path=path):
+                expected = self.flask.open(path, method=method, json=body)
+                if method == 'PUT':
+                    # The version moved on: put it back so both apps see the same state
+                    self.flask.put(path, json={'title': 'Stew 2'})
+                actual = self.asgi.request(method, path, json=body)
+                self.assertEqual(actual.status_code, expected.status_code)
+                if method == 'PUT':
+                    self.assertEqual(actual.json()['version'], expected.json['version'] + 2)
+                    continue
+                self.assertEqual(actual.content, expected.data)
+                for name in CONTRACT_HEADERS:
+                    self.assertEqual(actual.headers.get(name), expected.headers.get(name), name)
+
+    def test_login_cookie_is_shared_with_flask(self):
+        self.asgi.cookies.set('session', self.flask.get_cookie('session').value)
+        response = self.asgi.post('/api/recipes', json=recipe('Cross app', 'rice'))
+        self.assertEqual(response.status_code, 201)
+
+        self.asgi.cookies.clear()
+        self.flask.delete_cookie('session')
+        self.login()
+        self.flask.set_cookie('session', self.asgi.cookies['session'])
+        self.assertEqual(self.flask.delete(f'/api/recipes/{response.json()["id"]}').status_code, 200)
+
+    def test_anonymous_writes_are_rejected(self):
+        self.assertEqual(self.asgi.post('/api/recipes', json=recipe('A', 'x')).status_code, 401)
+        self.asgi.cookies.set('session', 'forged')
+        self.assertEqual(self.asgi.get('/api/recipes/search?q=a').status_code, 401)
+
+    def test_conditional_and_cache_invalidation(self):
+        self.login()
+        created = self.asgi.post('/api/recipes', json=recipe('Cached', 'leek')).json()
+        path = f'/api/recipes/{created["id"]}'
+        first = self.asgi.get(path)
+        self.assertEqual(self.asgi.get(path, headers={'If-None-Match': first.headers['etag']})
+                         .status_code, 304)
+
+        self.asgi.put(path, json={'title': 'Changed'}, headers={'If-Match': '"1"'})
+        self.assertEqual(self.asgi.put(path, json={'title': 'Stale'}, headers={'If-Match': '"1"'})
+                         .status_code, 409)
+        self.assertEqual(self.asgi.get(path).json()['title'], 'Changed')
+
+    def test_import_and_export_stream(self):
+        self.login()
+        body = '\n'.join([json.dumps(recipe('Imported A', 'kale')), '{broken',
+                          json.dumps(recipe('Imported B', 'kale'))])
+        report = self.asgi.post('/api/recipes/import?batch_size=1', content=body.encode(),
+                                headers={'Content-Type': 'application/x-ndjson'}).json()
+        self.assertEqual(report['imported'], 2)
+        self.assertEqual(report['errors'], [{'line': 2, 'error': 'Invalid JSON'}])
+
+        response = self.asgi.get('/api/recipes/export')
+        self.assertEqual(response.headers['content-type'], 'application/x-ndjson')
+        titles = [json.loads(line)['title'] for line in response.text.splitlines()]
+        self.assertIn('Imported B', titles)
+
+    def test_metrics_and_admission(self):
+        self.asgi.get('/api/recipes')
+        metrics = self.asgi.get('/metrics').text
+        self.assertIn('recipe_http_requests_total{endpoint="get_recipes",method="GET"', metrics)
+        self.assertIn('recipe_admission_admitted_total{route_class="listing"} 1', metrics)
+        self.assertIn('recipe_admission_active{route_class="bulk"} 0', metrics)
+
+
+if __name__ == '__main__':
+    unittest.main()
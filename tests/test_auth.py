@@ -0,0 +1,125 @@
+import unittest
+from concurrent.futures import Future
+from unittest.mock import patch
+
+from werkzeug.security import generate_password_hash
+
+from auth import CachedUser
+from config import Config
+from main import app
+from models import User, session
+from passwords import PASSWORD_HASH_WORKERS, HashingBusy, PasswordHasher
+from tests import ApiTestCase
+
+CHEAP_METHOD = 'pbkdf2:sha256:1000'
+
+
+class TestPasswordHasher(unittest.TestCase):
+    def test_inline_hash_and_verify(self):
+        hasher = PasswordHasher(method=CHEAP_METHOD)
+        pwhash = hasher.hash('secret123')
+        self.assertTrue(pwhash.startswith(CHEAP_METHOD + '$'))
+        self.assertTrue(hasher.verify(pwhash, 'secret123'))
+        self.assertFalse(hasher.verify(pwhash, 'wrong'))
+
+    def test_process_pool(self):
+        hasher = PasswordHasher(method=CHEAP_METHOD, workers=1)
+        self.assertTrue(hasher.verify(hasher.hash('secret123'), 'secret123'))
+
+    def test_default_pool_is_small(self):
+        # Not one process per core: each pre-forked app worker starts its own pool
+        self.assertEqual(PasswordHasher.from_config({}).workers, PASSWORD_HASH_WORKERS)
+        self.assertEqual(Config.PASSWORD_HASH_WORKERS, PASSWORD_HASH_WORKERS)
+        self.assertLessEqual(PASSWORD_HASH_WORKERS, 2)
+
+    def test_needs_rehash(self):
+        hasher = PasswordHasher(method=CHEAP_METHOD)
+        self.assertFalse(hasher.needs_rehash(hasher.hash('x')))
+        self.assertTrue(hasher.needs_rehash(
+            generate_password_hash('x', 'pbkdf2:sha256:2000')))
+
+    def test_rejects_when_queue_is_full(self):
+        hasher = PasswordHasher(method=CHEAP_METHOD, max_pending=1)
+        hasher._slots.acquire()
+        with self.assertRaises(HashingBusy):
+            hasher.hash('secret123')
+        self.assertEqual(hasher.stats()['rejected'], 1)
+
+    def test_timed_out_hash_keeps_its_slot(self):
+        hasher = PasswordHasher(method=CHEAP_METHOD, workers=1, max_pending=1, timeout=0.01)
+        running = Future()
+        running.set_running_or_notify_cancel()
+        with patch.object(hasher, '_get_executor') as get_executor:
+            get_executor.return_value.submit.return_value = running
+            with self.assertRaises(HashingBusy):
+                hasher.hash('secret123')
+            # Still running in the pool: no new submission may be queued
+            self.assertEqual(hasher.stats()['pending'], 1)
+            with self.assertRaises(HashingBusy):
+                hasher.hash('secret123')
+            running.set_result('done')
+            self.assertEqual(hasher.stats()['pending'], 0)
+
+
+class TestUserLoaderCache(ApiTestCase):
+    username = 'auth_user'
+
+    def setUp(self):
+        self.user_cache = app.extensions['user_cache']
+        self.user_cache.clear()
+        super().setUp()
+        self.user_id = session.query(User).filter_by(username='auth_user').first().id
+
+    def search(self):
+        return self.client.get('/api/recipes/search', query_string={'q': 'x'})
+
+    def test_loader_is_served_from_cache(self):
+        self.assertEqual(self.search().status_code, 200)
+        hits = self.user_cache.hits
+        self.assertEqual(self.search().status_code, 200)
+        self.assertEqual(self.user_cache.hits, hits + 1)
+
+        cached = self.user_cache.get(self.user_id)
+        self.assertIsInstance(cached, CachedUser)
+        self.assertEqual((cached.id, cached.get_id()), (self.user_id, str(self.user_id)))
+
+    def test_user_update_invalidates(self):
+        self.search()
+        self.assertIsNotNone(self.user_cache.get(self.user_id))
+
+        user = session.get(User, self.user_id)
+        user.email = 'auth_user_changed@example.com'
+        session.commit()
+        self.assertIsNone(self.user_cache.get(self.user_id))
+
+    def test_hit_rate_is_reported(self):
+        self.search()
+        self.search()
+        stats = self.client.get('/api/cache/stats').json['users']
+        self.assertGreater(stats['hit_rate'], 0)
+        self.assertIn('ttl', stats)
+
+    def test_rehash_on_login(self):
+        user = session.get(User, self.user_id)
+        user.password = generate_password_hash('password123', CHEAP_METHOD)
+        session.commit()
+
+        data = {'username': 'auth_user', 'password': 'password123'}
+        self.assertEqual(self.client.post('/api/login', json=data).status_code, 200)
+        session.expire_all()
+        stored = session.get(User, self.user_id).password
+        hasher = app.extensions['password_hasher']
+        self.assertFalse(hasher.needs_rehash(stored))
+        self.assertTrue(hasher.verify(stored, 'password123'))
+
+    def test_login_busy(self):
+        hasher = app.extensions['password_hasher']
+        with patch.object(hasher, 'verify', side_effect=HashingBusy):
+            response = self.client.post(
+                '/api/login', json={'username': 'auth_user', 'password': 'password123'})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '1')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+
+from main import app
+from routes import parse_recipe_ids
+from tests import ApiTestCase
+
+
+class TestParseRecipeIds(unittest.TestCase):
+    def test_query_values(self):
+        self.assertEqual(parse_recipe_ids(['3,1', '7', '']), [3, 1, 7])
+
+    def test_json_values(self):
+        self.assertEqual(parse_recipe_ids([3, 1]), [3, 1])
+
+    def test_rejects_non_integers(self):
+        for values in (['a'], [1.5], [True], [None]):
+            with self.assertRaises(ValueError):
+                parse_recipe_ids(values)
+
+
+class TestBatchFetch(ApiTestCase):
+    username = 'batch_user'
+
+    def setUp(self):
+        app.extensions['recipe_cache'].clear()
+        super().setUp()
+        self.ids = [self.create_recipe(title, ['salt']) for title in ('First', 'Second', 'Third')]
+
+    def test_post_keeps_request_order(self):
+        requested = [self.ids[2], self.ids[0], self.ids[1]]
+        response = self.client.post('/api/recipes/batch', json={'ids': requested})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r['id'] for r in response.json], requested)
+        self.assertEqual(response.json[0]['title'], 'Third')
+
+    def test_missing_ids_get_markers(self):
+        missing = max(self.ids) + 1000
+        response = self.client.post('/api/recipes/batch',
+                                    json={'ids': [self.ids[0], missing, self.ids[0]]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json[1], {'id': missing, 'error': 'Recipe not found'})
+        self.assertEqual(response.json[0], response.json[2])
+
+    def test_get_with_ids(self):
+        ids = ','.join(str(i) for i in reversed(self.ids))
+        response = self.client.get('/api/recipes', query_string={'ids': ids})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r['id'] for r in response.json], list(reversed(self.ids)))
+
+        self.client.put(f'/api/recipes/{self.ids[0]}', json={'title': 'Changed'})
+        response = self.client.get('/api/recipes', query_string={'ids': ids})
+        self.assertEqual(response.json[-1]['title'], 'Changed')
+
+    def test_batch_size_is_capped(self):
+        limit = app.config['MAX_RECIPE_BATCH_SIZE']
+        response = self.client.post('/api/recipes/batch',
+                                    json={'ids': list(range(1, limit + 2))})
+        self.assertEqual(response.status_code, 400)
+
+    def test_invalid_ids(self):
+        self.assertEqual(self.client.post('/api/recipes/batch', json={'ids': ['x']}).status_code, 400)
+        self.assertEqual(self.client.post('/api/recipes/batch', json=[1, 2]).status_code, 400)
+        self.assertEqual(self.client.get('/api/recipes?ids=1,x').status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
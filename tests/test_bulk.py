@@ -0,0 +1,150 @@
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+import unittest
+
+from sqlalchemy import event
+
+from bulk import export_chunks, import_ndjson
+from main import app
+from models import Recipe, RecipeIngredient, RecipeSignature, User, engine, session
+from tests import ApiTestCase
+
+
+def ndjson(*records):
+    return '\n'.join(r if isinstance(r, str) else json.dumps(r) for r in records)
+
+
+def recipe(title):
+    return {'title': title, 'description': '', 'instructions': '',
+            'ingredients': [{'name': 'flour', 'quantity': '1 cup'}]}
+
+
+class TestBulkImport(ApiTestCase):
+    username = 'bulk_user'
+
+    def setUp(self):
+        super().setUp()
+        self.user_id = session.query(User).filter_by(username='bulk_user').first().id
+
+    def test_batches_and_line_errors(self):
+        committed = []
+        lines = ndjson(recipe('A'), '{broken', recipe('B'), '',
+                       {'title': 'No fields'}, recipe('C')).splitlines()
+        report = import_ndjson(session, lines, self.user_id, batch_size=2,
+                               on_commit=committed.append)
+
+        self.assertEqual((report.imported, report.failed), (3, 2))
+        self.assertEqual([e['line'] for e in report.errors], [2, 5])
+        self.assertEqual([len(ids) for ids in committed], [2, 1])
+        imported = session.get(Recipe, committed[0][0])
+        self.assertEqual(imported.created_by, self.user_id)
+        self.assertEqual(json.loads(imported.payload)['ingredients'],
+                         [{'name': 'flour', 'quantity': '1 cup'}])
+
+    def test_follow_up_writes_are_batched(self):
+        statements = []
+
+        def record(connection, cursor, statement, parameters, context, executemany):
+            statements.append(statement.split()[:3])
+
+        records = [{**recipe(f'Batched {i}'),
+                    'ingredients': [{'name': 'flour'}, {'name': f'spice {i}'}]}
+                   for i in range(20)]
+        committed = []
+        event.listen(engine, 'before_cursor_execute', record)
+        try:
+            report = import_ndjson(session, ndjson(*records).splitlines(), self.user_id,
+                                   batch_size=20, on_commit=committed.extend)
+        finally:
+            event.remove(engine, 'before_cursor_execute', record)
+        self.assertEqual(report.imported, 20)
+        # One INSERT per recipe, then one executemany per follow-up write
+        self.assertLess(len(statements), 40)
+
+        last = committed[-1]
+        self.assertEqual(json.loads(session.get(Recipe, last).payload)['title'], 'Batched 19')
+        self.assertEqual([row.name for row in session.query(RecipeIngredient)
+                          .filter_by(recipe_id=last).order_by(RecipeIngredient.position)],
+                         ['flour', 'spice 19'])
+        self.assertIsNotNone(session.get(RecipeSignature, last))
+        found = self.client.get('/api/recipes/search', query_string={'q': 'spice 19'}).json
+        self.assertEqual([r['id'] for r in found], [last])
+
+    def test_import_endpoint(self):
+        body = ndjson(recipe('Imported 1'), {**recipe('Bad'), 'id': 3}, recipe('Imported 2'))
+        response = self.client.post('/api/recipes/import?batch_size=1', data=body,
+                                    content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['imported'], 2)
+        self.assertEqual(response.json['errors'],
+                         [{'line': 2, 'error': 'Field "id" is not allowed'}])
+
+        found = self.client.get('/api/recipes/search', query_string={'q': 'imported'}).json
+        self.assertEqual(len(found), 2)
+
+    def test_import_requires_login(self):
+        response = app.test_client().post('/api/recipes/import', data=ndjson(recipe('X')))
+        self.assertEqual(response.status_code, 401)
+
+    def test_cli(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.ndjson', delete=False) as f:
+            f.write(ndjson(recipe('From CLI'), 'nope'))
+        try:
+            result = app.test_cli_runner().invoke(
+                args=['import-recipes', f.name, '--user', 'bulk_user'])
+        finally:
+            os.unlink(f.name)
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('Imported 1 recipe(s), 1 failed', result.output)
+
+    def import_titles(self, *titles):
+        report = import_ndjson(session, [json.dumps(recipe(t)) for t in titles],
+                               self.user_id)
+        self.assertEqual(report.imported, len(titles))
+
+    def test_export_ndjson(self):
+        self.import_titles('Export 1', 'Export 2')
+        response = self.client.get('/api/recipes/export',
+                                   query_string={'user': self.user_id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        records = [json.loads(line) for line in response.data.decode().splitlines()]
+        titles = [r['title'] for r in records]
+        self.assertIn('Export 1', titles)
+        self.assertTrue(all(r['created_by'] == self.user_id for r in records))
+
+        other = self.client.get('/api/recipes/export', query_string={'user': 0})
+        self.assertEqual(other.data, b'')
+
+    def test_export_csv_gzip(self):
+        self.import_titles('Csv, with comma')
+        response = self.client.get('/api/recipes/export',
+                                   query_string={'format': 'csv', 'compress': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        rows = list(csv.DictReader(io.StringIO(gzip.decompress(response.data).decode())))
+        row = next(r for r in rows if r['title'] == 'Csv, with comma')
+        self.assertEqual(json.loads(row['ingredients'])[0]['name'], 'flour')
+
+    def test_export_rejects_unknown_format(self):
+        response = self.client.get('/api/recipes/export', query_string={'format': 'xml'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_export_chunks_are_batched(self):
+        self.import_titles('Chunk 1', 'Chunk 2', 'Chunk 3')
+        chunks = list(export_chunks(session, user_id=self.user_id, batch_size=2))
+        self.assertTrue(all(chunk.count('\n') <= 2 for chunk in chunks))
+
+    def test_export_cli(self):
+        self.import_titles('Cli export')
+        result = app.test_cli_runner().invoke(
+            args=['export-recipes', '--user', 'bulk_user'])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('Cli export', result.output)
+
+
+if __name__ == '__main__':
+    unittest.main()
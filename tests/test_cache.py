@@ -0,0 +1,146 @@
+import time
+import unittest
+from unittest.mock import patch
+
+from cache import LRUCache, make_cached_response
+from main import app
+from tests import ApiTestCase
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_eviction_order(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_invalidate_by_tag(self):
+        cache = LRUCache(10)
+        cache.set('recipe', 1, tags=['r1'])
+        cache.set('list', [1, 2], tags=['r1', 'r2', 'lists'])
+        cache.set('other', [3], tags=['r3', 'lists'])
+        cache.invalidate('r1')
+        self.assertIsNone(cache.get('recipe'))
+        self.assertIsNone(cache.get('list'))
+        self.assertEqual(cache.get('other'), [3])
+
+    def test_stale_generation_is_not_stored(self):
+        cache = LRUCache(10)
+        generation = cache.generation
+        cache.invalidate('r1')
+        cache.set('recipe', 1, generation=generation)
+        self.assertIsNone(cache.get('recipe'))
+
+    def test_stats(self):
+        cache = LRUCache(10)
+        cache.set('a', 1)
+        cache.get('a')
+        cache.get('b')
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 1, 'hit_rate': 0.5,
+                                         'evictions': 0, 'size': 1, 'maxsize': 10})
+
+    def test_ttl_expiry(self):
+        cache = LRUCache(10, ttl=60)
+        cache.set('a', 1)
+        with patch('cache.time.monotonic', return_value=time.monotonic() + 61):
+            self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['expirations'], 1)
+        self.assertEqual(len(cache), 0)
+
+    def test_etag_is_stable(self):
+        self.assertEqual(make_cached_response('[1]').etag,
+                         make_cached_response('[1]').etag)
+        self.assertNotEqual(make_cached_response('[1]').etag,
+                            make_cached_response('[2]').etag)
+
+
+class TestResponseCache(ApiTestCase):
+    username = 'cache_user'
+
+    def setUp(self):
+        self.cache = app.extensions['recipe_cache']
+        self.cache.clear()
+        super().setUp()
+        self.recipe_id = self.create_recipe('Cached', ['salt'])
+
+    def test_hit_and_conditional_get(self):
+        url = f'/api/recipes/{self.recipe_id}'
+        first = self.client.get(url)
+        hits = self.cache.hits
+        second = self.client.get(url)
+        self.assertEqual(self.cache.hits, hits + 1)
+        self.assertEqual(first.data, second.data)
+        self.assertIsNotNone(first.headers.get('ETag'))
+
+        not_modified = self.client.get(
+            url, headers={'If-None-Match': first.headers['ETag']})
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.data, b'')
+
+    def test_update_invalidates(self):
+        url = f'/api/recipes/{self.recipe_id}'
+        etag = self.client.get(url).headers['ETag']
+        self.client.get('/api/recipes', query_string={'cursor': ''})
+
+        self.client.put(url, json={'title': 'Changed'})
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['title'], 'Changed')
+
+        listing = self.client.get('/api/recipes', query_string={'cursor': ''}).json
+        titles = {r['id']: r['title'] for r in listing['recipes']}
+        self.assertEqual(titles[self.recipe_id], 'Changed')
+
+    def test_create_and_delete_invalidate_listings(self):
+        self.client.get('/api/recipes', query_string={'cursor': ''})
+        data = {'title': 'New', 'description': '', 'instructions': '',
+                'ingredients': []}
+        new_id = self.client.post('/api/recipes', json=data).json['id']
+        listing = self.client.get('/api/recipes', query_string={'cursor': '', 'limit': 100})
+        self.assertIn(new_id, [r['id'] for r in listing.json['recipes']])
+
+        self.client.delete(f'/api/recipes/{new_id}')
+        listing = self.client.get('/api/recipes', query_string={'cursor': '', 'limit': 100})
+        self.assertNotIn(new_id, [r['id'] for r in listing.json['recipes']])
+        self.assertEqual(self.client.get(f'/api/recipes/{new_id}').status_code, 404)
+
+    def test_ingredient_change_invalidates_filtered_listings(self):
+        def filtered(name):
+            response = self.client.get('/api/recipes', query_string={
+                'ingredient': name, 'cursor': '', 'limit': 100})
+            return [r['id'] for r in response.json['recipes']], response.headers['X-Total-Count']
+
+        url = f'/api/recipes/{self.recipe_id}'
+        self.assertEqual(filtered('cache-basil'), ([], '0'))
+        self.client.put(url, json={'ingredients': [{'name': 'cache-basil'}]})
+        self.assertEqual(filtered('cache-basil'), ([self.recipe_id], '1'))
+
+        self.assertEqual(filtered('cache-tomato'), ([], '0'))
+        self.client.post(f'{url}/ingredients', json={'ingredients': [{'name': 'cache-tomato'}]})
+        self.assertEqual(filtered('cache-tomato'), ([self.recipe_id], '1'))
+
+        operations = [{'op': 'replace', 'index': 0, 'ingredient': {'name': 'cache-leek'}}]
+        self.assertEqual(filtered('cache-leek'), ([], '0'))
+        self.client.patch(f'{url}/ingredients', json={'operations': operations})
+        self.assertEqual(filtered('cache-leek'), ([self.recipe_id], '1'))
+
+        # Other updates keep those the recipe is not on
+        self.assertEqual(filtered('cache-basil'), ([], '0'))
+        hits = self.cache.hits
+        self.client.put(url, json={'title': 'Renamed only'})
+        filtered('cache-basil')
+        self.assertEqual(self.cache.hits, hits + 1)
+
+    def test_stats_endpoint(self):
+        response = self.client.get('/api/cache/stats')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.json['recipes']),
+                         {'hits', 'misses', 'hit_rate', 'evictions', 'size', 'maxsize'})
+
+
+if __name__ == '__main__':
+    unittest.main()
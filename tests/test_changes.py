@@ -0,0 +1,141 @@
+import unittest
+
+import changes
+from changes import ChangeFeed, prune_changes
+from main import app
+from models import Recipe, RecipeChange, RecipeIngredient, User, session
+from signals import recipe_changed
+from tests import ApiTestCase, another_process
+
+
+class TestChangeFeed(ApiTestCase):
+    username = 'changes_user'
+
+    def setUp(self):
+        super().setUp()
+        self.user_id = session.query(User).filter_by(username=self.username).one().id
+        session.remove()
+        self.sent = []
+        self.sender = object()
+        recipe_changed.connect(self.record, sender=self.sender)
+        self.addCleanup(recipe_changed.disconnect, self.record, sender=self.sender)
+        self.feed = ChangeFeed(self.sender, interval_ms=0)
+        self.feed.poll(session())
+
+    def record(self, sender, **kwargs):
+        self.sent.append(kwargs)
+
+    def test_writes_are_recorded_with_their_owner(self):
+        with another_process() as other:
+            recipe = Recipe(title='Elsewhere', ingredients='[]', created_by=self.user_id)
+            other.add(recipe)
+            other.commit()
+            recipe_id = recipe.id
+            recipe.title = 'Renamed elsewhere'
+            other.commit()
+            row = RecipeIngredient.from_dict(0, {'name': 'salt'})
+            row.recipe_id = recipe_id
+            other.add(row)
+            other.commit()
+            other.delete(recipe)
+            other.commit()
+
+        self.assertEqual(self.feed.poll(session()), 4)
+        self.assertEqual([(change['recipe_id'], change['user_id'], change['action'],
+                           change['ingredients_changed']) for change in self.sent], [
+            (recipe_id, self.user_id, 'created', True),
+            (recipe_id, self.user_id, 'updated', False),
+            (recipe_id, self.user_id, 'updated', True),
+            (recipe_id, self.user_id, 'deleted', True),
+        ])
+        self.assertEqual(self.feed.poll(session()), 0)
+
+    def test_own_writes_are_not_replayed(self):
+        self.create_recipe('Served here')
+        self.assertEqual(self.feed.poll(session()), 0)
+        self.assertEqual(self.sent, [])
+
+    def test_polls_are_spaced_by_the_interval(self):
+        feed = ChangeFeed(self.sender, interval_ms=60000)
+        feed.poll(session())
+        self.assertFalse(feed.due())
+        with another_process() as other:
+            other.add(Recipe(title='Later', ingredients='[]', created_by=self.user_id))
+            other.commit()
+        self.assertEqual(feed.poll(session()), 0)
+
+    def test_late_commits_below_the_newest_id_are_replayed(self):
+        with another_process() as other:
+            other.add(Recipe(title='Committed late', ingredients='[]', created_by=self.user_id))
+            other.commit()
+        late = session.query(RecipeChange).order_by(RecipeChange.id.desc()).first()
+        session.remove()
+        # As if the feed had read past it before its transaction committed
+        self.feed._newest = late.id
+        self.assertEqual(self.feed.poll(session()), 1)
+        self.assertEqual(self.sent[0]['recipe_id'], late.recipe_id)
+
+    def test_missed_changes_reset(self):
+        reset = []
+        feed = ChangeFeed(self.sender, interval_ms=0, on_reset=lambda: reset.append(True))
+        feed.poll(session())
+        with another_process() as other:
+            other.add(Recipe(title='Pruned', ingredients='[]', created_by=self.user_id))
+            other.commit()
+            other.add(Recipe(title='Kept', ingredients='[]', created_by=self.user_id))
+            other.commit()
+        prune_changes(session, keep=1)
+
+        self.assertEqual(feed.poll(session()), 0)
+        self.assertEqual(reset, [True])
+        self.assertEqual(self.sent, [])
+        self.assertEqual(feed.stats()['resets'], 1)
+
+    def test_fork_gets_its_own_origin(self):
+        origin = changes.ORIGIN
+        changes._reset_origin()
+        self.addCleanup(setattr, changes, 'ORIGIN', origin)
+        self.assertNotEqual(changes.ORIGIN, origin)
+
+
+class TestCachesFollowOtherProcesses(ApiTestCase):
+    username = 'followed_user'
+
+    def setUp(self):
+        app.extensions['recipe_cache'].clear()
+        super().setUp()
+        self.recipe_id = self.create_recipe('Shared', ['salt'])
+
+    def test_cached_recipe_and_listing_see_other_writes(self):
+        url = f'/api/recipes/{self.recipe_id}'
+        self.client.get(url)
+        self.client.get('/api/recipes', query_string={'cursor': '', 'limit': 100})
+
+        with another_process() as other:
+            other.get(Recipe, self.recipe_id).title = 'Changed elsewhere'
+            other.commit()
+
+        self.assertEqual(self.client.get(url).json['title'], 'Changed elsewhere')
+        listing = self.client.get('/api/recipes', query_string={'cursor': '', 'limit': 100})
+        titles = {r['id']: r['title'] for r in listing.json['recipes']}
+        self.assertEqual(titles[self.recipe_id], 'Changed elsewhere')
+
+        with another_process() as other:
+            other.delete(other.get(Recipe, self.recipe_id))
+            other.commit()
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_reset_clears_the_caches(self):
+        url = f'/api/recipes/{self.recipe_id}'
+        self.client.get(url)
+        self.assertGreater(app.extensions['recipe_cache'].stats()['size'], 0)
+        with another_process() as other:
+            other.get(Recipe, self.recipe_id).title = 'Missed'
+            other.commit()
+        prune_changes(session, keep=0)
+
+        self.assertEqual(self.client.get(url).json['title'], 'Missed')
+
+
+if __name__ == '__main__':
+    unittest.main()
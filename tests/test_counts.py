@@ -0,0 +1,147 @@
+import unittest
+from unittest.mock import patch
+
+from sqlalchemy import func
+
+import counts
+from counts import ALL_RECIPES, initialize_recipe_counts, rebuild_recipe_counts, recipe_count
+from main import app
+from models import Recipe, RecipeCount, User, engine, session
+from tests import ApiTestCase
+
+
+class TestRecipeCounts(ApiTestCase):
+    username = 'count_user'
+
+    def setUp(self):
+        app.extensions['recipe_cache'].clear()
+        super().setUp()
+        self.user_id = session.query(User).filter_by(username='count_user').one().id
+        session.remove()
+
+    def actual_count(self, user_id=None):
+        query = session.query(func.count(Recipe.id))
+        if user_id is not None:
+            query = query.filter(Recipe.created_by == user_id)
+        return query.scalar()
+
+    def assert_counts_match(self):
+        session.remove()
+        self.assertEqual(recipe_count(session), self.actual_count())
+        self.assertEqual(recipe_count(session, self.user_id), self.actual_count(self.user_id))
+
+    def test_create_and_delete_update_counters(self):
+        before = recipe_count(session, self.user_id)
+        recipe_ids = [self.create_recipe(f'Counted {i}') for i in range(3)]
+        self.assert_counts_match()
+        self.assertEqual(recipe_count(session, self.user_id), before + 3)
+
+        self.assertEqual(self.client.delete(f'/api/recipes/{recipe_ids[0]}').status_code, 200)
+        self.assert_counts_match()
+        self.assertEqual(recipe_count(session, self.user_id), before + 2)
+
+    def test_rolled_back_insert_is_not_counted(self):
+        before = recipe_count(session)
+        session.add(Recipe(title='Discarded', ingredients='[]', created_by=self.user_id))
+        session.flush()
+        session.rollback()
+        self.assertEqual(recipe_count(session), before)
+
+    def test_missing_counters_are_initialized(self):
+        self.create_recipe('Before counters')
+        session.query(RecipeCount).delete()
+        session.commit()
+        # Read live, without writing from the read
+        self.assert_counts_match()
+        self.assertEqual(session.query(RecipeCount).count(), 0)
+        # A write to an uninitialized counter counts the existing recipes too
+        self.create_recipe('After counters')
+        self.assert_counts_match()
+        self.assertIsNotNone(session.get(RecipeCount, self.user_id))
+
+    def test_startup_initializes_every_counter(self):
+        self.create_recipe('Startup')
+        session.query(RecipeCount).delete()
+        session.commit()
+        with engine.begin() as connection:
+            self.assertEqual(initialize_recipe_counts(connection), session.query(User).count() + 1)
+            self.assertEqual(initialize_recipe_counts(connection), 0)
+        session.remove()
+        self.assertEqual(session.get(RecipeCount, self.user_id).count,
+                         self.actual_count(self.user_id))
+        self.assert_counts_match()
+
+    def test_new_users_get_a_counter(self):
+        self.login('count_newcomer')
+        user_id = session.query(User).filter_by(username='count_newcomer').one().id
+        self.assertEqual(session.get(RecipeCount, user_id).count, 0)
+
+    def test_reading_an_empty_scope_writes_nothing(self):
+        anonymous = app.test_client()
+        response = anonymous.get('/api/recipes', query_string={'user': 987654, 'cursor': ''})
+        self.assertEqual(response.headers['X-Total-Count'], '0')
+        self.assertIsNone(session.get(RecipeCount, 987654))
+
+    def test_concurrently_initialized_counter_keeps_the_change(self):
+        self.create_recipe('Raced')
+        session.query(RecipeCount).filter_by(user_id=self.user_id).delete()
+        session.commit()
+        existing = self.actual_count(self.user_id)
+        real_update = counts._update
+
+        def update_after_race(connection, scope, delta):
+            rowcount = real_update(connection, scope, delta)
+            if not rowcount and scope == self.user_id:
+                # Another request creates the counter, without this flush's recipe
+                connection.execute(RecipeCount.__table__.insert().values(
+                    user_id=scope, count=existing))
+            return rowcount
+
+        with patch.object(counts, '_update', side_effect=update_after_race):
+            session.add(Recipe(title='Raced again', ingredients='[]', created_by=self.user_id))
+            session.commit()
+        self.assert_counts_match()
+
+    def test_rebuild(self):
+        self.create_recipe('Rebuilt')
+        session.query(RecipeCount).update({'count': 999})
+        session.commit()
+        self.assertEqual(rebuild_recipe_counts(session), self.actual_count())
+        self.assert_counts_match()
+        self.assertIsNotNone(session.get(RecipeCount, ALL_RECIPES))
+
+    def test_listing_headers(self):
+        for i in range(3):
+            self.create_recipe(f'Paged {i}')
+        total = self.actual_count(self.user_id)
+        pages = -(-total // 2)
+
+        response = self.client.get('/api/recipes', query_string={'user': self.user_id,
+                                                                 'limit': 2, 'page': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['X-Total-Count'], str(total))
+        self.assertEqual(response.headers['X-Total-Pages'], str(pages))
+        self.assertIn(f'</api/recipes?user={self.user_id}&limit=2&page=1>; rel="prev"',
+                      response.headers['Link'])
+        self.assertEqual('rel="next"' in response.headers['Link'], pages > 2)
+        self.assertTrue(all(recipe['created_by'] == self.user_id for recipe in response.json))
+
+        cursor = self.client.get('/api/recipes', query_string={'user': self.user_id,
+                                                               'limit': 2, 'cursor': ''})
+        self.assertEqual(cursor.headers['X-Total-Count'], str(total))
+        self.assertIn(f'cursor={cursor.json["next_cursor"]}>; rel="next"',
+                      cursor.headers['Link'])
+
+    def test_total_change_changes_etag(self):
+        self.create_recipe('Tagged')
+        first = self.client.get('/api/recipes', query_string={'user': self.user_id})
+        self.create_recipe('Tagged again')
+        second = self.client.get('/api/recipes', query_string={'user': self.user_id},
+                                 headers={'If-None-Match': first.headers['ETag']})
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(int(second.headers['X-Total-Count']),
+                         int(first.headers['X-Total-Count']) + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
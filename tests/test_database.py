@@ -0,0 +1,62 @@
+import os
+import tempfile
+import unittest
+
+from sqlalchemy import text
+
+from config import Config
+from database import async_database_url, build_engine
+from main import app, create_app
+from models import session
+
+
+class TestConfig(Config):
+    DB_POOL_SIZE = 3
+    DB_MAX_OVERFLOW = 2
+
+
+class TestBuildEngine(unittest.TestCase):
+    def test_file_sqlite_uses_pool_and_pragmas(self):
+        with tempfile.TemporaryDirectory() as directory:
+            TestConfig.DATABASE_URL = 'sqlite:///' + os.path.join(directory, 'test.db')
+            engine = build_engine(TestConfig)
+            try:
+                self.assertEqual(engine.pool.size(), 3)
+                self.assertFalse(engine.echo)
+                with engine.connect() as connection:
+                    mode = connection.execute(text('PRAGMA journal_mode')).scalar()
+                    timeout = connection.execute(text('PRAGMA busy_timeout')).scalar()
+                self.assertEqual(mode, 'wal')
+                self.assertEqual(timeout, Config.SQLITE_PRAGMAS['busy_timeout'])
+            finally:
+                engine.dispose()
+
+    def test_memory_sqlite(self):
+        TestConfig.DATABASE_URL = 'sqlite://'
+        engine = build_engine(TestConfig)
+        with engine.connect() as connection:
+            self.assertEqual(connection.execute(text('SELECT 1')).scalar(), 1)
+
+    def test_async_database_url(self):
+        self.assertEqual(str(async_database_url('sqlite:////tmp/a.db')),
+                         'sqlite+aiosqlite:////tmp/a.db')
+        self.assertEqual(
+            async_database_url('postgresql+psycopg2://u:p@db/recipes').drivername,
+            'postgresql+asyncpg')
+        with self.assertRaises(ValueError):
+            async_database_url('mssql+pyodbc://db')
+
+
+class TestAppFactory(unittest.TestCase):
+    def test_create_app_applies_config(self):
+        class SmallPages(Config):
+            RECIPES_PER_PAGE = 3
+        self.assertEqual(create_app(SmallPages).config['RECIPES_PER_PAGE'], 3)
+
+    def test_session_removed_after_request(self):
+        app.test_client().get('/api/recipes/1')
+        self.assertFalse(session.registry.has())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,197 @@
+import unittest
+
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
+
+from ingredients import apply_ingredient_operations
+from main import app
+from migrations import backfill_recipe_ingredients
+from models import Recipe, RecipeIngredient, engine, ingredient_key, session
+from tests import ApiTestCase
+
+
+class TestIngredientFilters(ApiTestCase):
+    username = 'ingredient_user'
+
+    def filter_ids(self, *names, **params):
+        response = self.client.get(
+            '/api/recipes', query_string={'ingredient': list(names), **params})
+        if response.status_code == 404:
+            return []
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.json]
+
+    def test_ingredient_key(self):
+        self.assertEqual(ingredient_key('  Fresh   BASIL '), 'fresh basil')
+
+    def test_rows_follow_create_and_append(self):
+        recipe_id = self.create_recipe('Pesto', ['Basil', 'Garlic'])
+        self.client.post(f'/api/recipes/{recipe_id}/ingredients',
+                         json={'ingredients': [{'name': 'Pine nuts'}]})
+
+        rows = session.query(RecipeIngredient).filter_by(
+            recipe_id=recipe_id).order_by(RecipeIngredient.position).all()
+        self.assertEqual([(row.position, row.name_key) for row in rows],
+                         [(0, 'basil'), (1, 'garlic'), (2, 'pine nuts')])
+
+    def test_all_and_any_filters(self):
+        pesto = self.create_recipe('Pesto AND', ['Basil', 'Garlic x'])
+        bread = self.create_recipe('Bread AND', ['Garlic x', 'Flour'])
+
+        self.assertEqual(self.filter_ids('garlic X', 'BASIL'), [pesto])
+        self.assertEqual(self.filter_ids('basil', 'flour', match='any')[-2:],
+                         [pesto, bread])
+        self.assertEqual(self.filter_ids('garlic x', 'unobtainium'), [])
+
+    def test_invalid_match_mode(self):
+        response = self.client.get(
+            '/api/recipes', query_string={'ingredient': 'basil', 'match': 'some'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_update_replaces_rows(self):
+        recipe_id = self.create_recipe('Soup', ['Kale'])
+        self.client.put(f'/api/recipes/{recipe_id}',
+                        json={'ingredients': [{'name': 'Spinach'}]})
+        self.assertNotIn(recipe_id, self.filter_ids('kale'))
+        self.assertIn(recipe_id, self.filter_ids('spinach'))
+
+    def test_backfill_from_blob(self):
+        recipe = Recipe(title='Legacy', description='', instructions='',
+                        ingredients='[{"name": "Sorrel", "quantity": "1"}]')
+        session.add(recipe)
+        session.commit()
+        self.assertNotIn(recipe.id, self.filter_ids('sorrel'))
+
+        self.assertGreaterEqual(backfill_recipe_ingredients(session), 1)
+        self.assertIn(recipe.id, self.filter_ids('sorrel'))
+        self.assertEqual(backfill_recipe_ingredients(session), 0)
+
+
+class TestIngredientUpdates(ApiTestCase):
+    username = 'append_user'
+
+    def setUp(self):
+        app.extensions['recipe_cache'].clear()
+        super().setUp()
+        self.recipe_id = self.create_recipe('Stew', [{'name': 'Beef', 'quantity': '1 kg'}])
+        self.url = f'/api/recipes/{self.recipe_id}'
+
+    def test_apply_operations(self):
+        ingredients = [{'name': 'a'}, {'name': 'b'}]
+        self.assertEqual(apply_ingredient_operations(ingredients, [
+            {'op': 'add', 'ingredient': {'name': 'c'}},
+            {'op': 'add', 'index': 0, 'ingredient': {'name': 'z'}},
+            {'op': 'remove', 'index': 1},
+            {'op': 'replace', 'index': 2, 'ingredient': {'name': 'y'}},
+        ]), [{'name': 'z'}, {'name': 'b'}, {'name': 'y'}])
+        self.assertEqual(ingredients, [{'name': 'a'}, {'name': 'b'}])
+        for operation in ({'op': 'remove', 'index': 2}, {'op': 'move'},
+                          {'op': 'replace', 'index': 0}, {'op': 'remove', 'index': True}):
+            with self.assertRaises(ValueError):
+                apply_ingredient_operations(ingredients, [operation])
+
+    def test_append_keeps_everything_in_step(self):
+        response = self.client.post(f'{self.url}/ingredients', json={
+            'ingredients': [{'name': 'Carrot'}, {'name': 'Thyme', 'quantity': '2 sprigs'}]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['version'], 2)
+        self.assertEqual(response.json['ingredients'], [
+            {'name': 'Beef', 'quantity': '1 kg'}, {'name': 'Carrot', 'quantity': ''},
+            {'name': 'Thyme', 'quantity': '2 sprigs'}])
+        self.assertEqual(self.client.get(self.url).json, response.json)
+
+        rows = session.query(RecipeIngredient.position, RecipeIngredient.name_key) \
+            .filter_by(recipe_id=self.recipe_id).order_by(RecipeIngredient.position).all()
+        self.assertEqual(rows, [(0, 'beef'), (1, 'carrot'), (2, 'thyme')])
+        search = self.client.get('/api/recipes/search', query_string={'q': 'thyme'})
+        self.assertIn(self.recipe_id, [r['id'] for r in search.json])
+
+    def test_append_if_match(self):
+        response = self.client.post(f'{self.url}/ingredients', headers={'If-Match': '"7"'},
+                                    json={'ingredients': [{'name': 'Salt'}]})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json['version'], 1)
+        response = self.client.post(f'{self.url}/ingredients', headers={'If-Match': '"1"'},
+                                    json={'ingredients': [{'name': 'Salt'}]})
+        self.assertEqual(response.status_code, 200)
+
+    def test_append_to_missing_or_foreign_recipe(self):
+        response = self.client.post(f'/api/recipes/{self.recipe_id + 1000}/ingredients',
+                                    json={'ingredients': [{'name': 'Salt'}]})
+        self.assertEqual(response.status_code, 404)
+        other = self.login('other_append_user')
+        response = other.post(f'{self.url}/ingredients', json={'ingredients': [{'name': 'Salt'}]})
+        self.assertEqual(response.status_code, 403)
+
+    def test_put_if_match(self):
+        response = self.client.put(self.url, headers={'If-Match': '"1"'}, json={'title': 'A'})
+        self.assertEqual(response.json['version'], 2)
+        # A second editor still holding version 1 must not clobber the first
+        response = self.client.put(self.url, headers={'If-Match': '"1"'}, json={'title': 'B'})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json, {'error': 'Recipe was modified by another request',
+                                         'version': 2})
+        self.assertEqual(self.client.get(self.url).json['title'], 'A')
+
+    def test_etag_round_trips_through_if_match(self):
+        etag = self.client.get(self.url).headers['ETag']
+        self.assertEqual(etag, '"1"')
+        response = self.client.put(self.url, headers={'If-Match': etag}, json={'title': 'A'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['ETag'], '"2"')
+
+        response = self.client.post(f'{self.url}/ingredients',
+                                    headers={'If-Match': response.headers['ETag']},
+                                    json={'ingredients': [{'name': 'Salt'}]})
+        self.assertEqual(response.headers['ETag'], '"3"')
+        response = self.client.patch(f'{self.url}/ingredients',
+                                     headers={'If-Match': response.headers['ETag']},
+                                     json={'operations': [{'op': 'remove', 'index': 0}]})
+        self.assertEqual(response.headers['ETag'], '"4"')
+        self.assertEqual(self.client.get(self.url).headers['ETag'], response.headers['ETag'])
+        self.assertEqual(self.client.put(self.url, headers={'If-Match': etag},
+                                         json={'title': 'B'}).status_code, 409)
+
+    def test_deleted_recipe_etag_never_matches_a_new_recipe(self):
+        etag = self.client.get(self.url).headers['ETag']
+        self.client.delete(self.url)
+        recipe_id = self.create_recipe('Stew again', ['Beef'])
+        self.assertNotEqual(recipe_id, self.recipe_id)
+        self.assertEqual(self.client.get(self.url, headers={'If-None-Match': etag})
+                         .status_code, 404)
+        self.assertEqual(self.client.put(self.url, headers={'If-Match': etag},
+                                         json={'title': 'B'}).status_code, 404)
+
+    def test_stale_write_is_rejected(self):
+        editor = Session(engine)
+        recipe = editor.get(Recipe, self.recipe_id)
+        self.client.put(self.url, json={'title': 'Concurrent'})
+        recipe.title = 'Stale'
+        with self.assertRaises(StaleDataError):
+            editor.commit()
+        editor.close()
+
+    def test_patch_operations(self):
+        response = self.client.patch(f'{self.url}/ingredients', json={'operations': [
+            {'op': 'add', 'ingredient': {'name': 'Onion'}},
+            {'op': 'replace', 'index': 0, 'ingredient': {'name': 'Lamb', 'quantity': '1 kg'}},
+        ]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([i['name'] for i in response.json['ingredients']], ['Lamb', 'Onion'])
+        response = self.client.patch(f'{self.url}/ingredients', headers={'If-Match': '"2"'},
+                                     json={'operations': [{'op': 'remove', 'index': 0}]})
+        self.assertEqual(response.json['ingredients'], [{'name': 'Onion', 'quantity': ''}])
+        names = [name for (name,) in session.query(RecipeIngredient.name)
+                 .filter_by(recipe_id=self.recipe_id)]
+        self.assertEqual(names, ['Onion'])
+
+    def test_patch_invalid_operation(self):
+        response = self.client.patch(f'{self.url}/ingredients',
+                                     json={'operations': [{'op': 'remove', 'index': 5}]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json, {'error': 'Operation 0: index out of range'})
+        self.assertEqual(self.client.get(self.url).json['version'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
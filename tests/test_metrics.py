@@ -0,0 +1,77 @@
+import unittest
+
+from flask import Flask
+
+from main import app
+from metrics import Histogram, MetricsRegistry, RequestStats, init_metrics
+from models import Base, engine, session
+
+
+class TestRegistry(unittest.TestCase):
+    def test_histogram_is_cumulative(self):
+        histogram = Histogram((0.1, 1.0))
+        for value in (0.05, 0.5, 0.7, 3.0):
+            histogram.observe(value)
+        self.assertEqual(list(histogram.cumulative()),
+                         [(0.1, 1), (1.0, 3), (float('inf'), 4)])
+
+    def test_render(self):
+        registry = MetricsRegistry(buckets=(0.1,))
+        stats = RequestStats()
+        stats.sql_count = 3
+        registry.observe_request('get_recipe', 'GET', 200, 0.05, stats, 120)
+        registry.add_collector(lambda: [('queue_depth', 'gauge', 'Depth.', {'route': 'x'}, 2)])
+        text = registry.render()
+        self.assertIn('recipe_http_request_duration_seconds_bucket'
+                      '{endpoint="get_recipe",method="GET",le="0.1"} 1', text)
+        self.assertIn('recipe_http_requests_total'
+                      '{endpoint="get_recipe",method="GET",status="200"} 1', text)
+        self.assertIn('recipe_http_sql_statements_total'
+                      '{endpoint="get_recipe",method="GET"} 3', text)
+        self.assertIn('recipe_http_response_bytes_total'
+                      '{endpoint="get_recipe",method="GET"} 120', text)
+        self.assertIn('# TYPE queue_depth gauge\nqueue_depth{route="x"} 2', text)
+
+
+class TestRequestInstrumentation(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        Base.metadata.create_all(engine)
+
+    def test_metrics_endpoint(self):
+        client = app.test_client()
+        client.post('/api/login', json={'username': 'nobody', 'password': 'x'})
+        text = client.get('/metrics').data.decode()
+        self.assertIn('recipe_http_requests_total'
+                      '{endpoint="login",method="POST",status="401"}', text)
+        self.assertIn('recipe_http_json_duration_seconds_total'
+                      '{endpoint="login",method="POST",op="decode"}', text)
+        self.assertIn('recipe_cache_hits_total{cache="recipes"}', text)
+
+    def test_sql_statements_are_counted(self):
+        registry = app.extensions['metrics']
+        app.test_client().get('/api/recipes/search', query_string={'q': 'x'})
+        app.test_client().post('/api/login', json={'username': 'nobody', 'password': 'x'})
+        self.assertGreaterEqual(registry._sql_count[('login', 'POST')], 1)
+
+    def test_slow_request_log(self):
+        slow_app = Flask(__name__)
+        slow_app.config['SLOW_REQUEST_THRESHOLD_MS'] = 0
+        init_metrics(slow_app, engine)
+
+        @slow_app.route('/ping')
+        def ping():
+            return {'pong': True}
+
+        with self.assertLogs(slow_app.logger, 'WARNING') as logs:
+            slow_app.test_client().get('/ping')
+        self.assertIn('Slow request: GET /ping -> 200', logs.output[0])
+
+    @classmethod
+    def tearDownClass(cls):
+        session.remove()
+        Base.metadata.drop_all(engine)
+
+
+if __name__ == '__main__':
+    unittest.main()
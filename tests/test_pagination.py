@@ -0,0 +1,82 @@
+import unittest
+
+from pagination import clamp_limit, decode_cursor, encode_cursor, keyset_slice
+from tests import ApiTestCase
+
+
+class TestCursor(unittest.TestCase):
+    def test_round_trip(self):
+        cursor = encode_cursor([42, 'title'])
+        self.assertEqual(decode_cursor(cursor, 2), [42, 'title'])
+        self.assertIsNone(decode_cursor('', 1))
+
+    def test_invalid_cursor(self):
+        for cursor in ('!!', 'bm90IGpzb24', encode_cursor([1, 2])):
+            with self.assertRaises(ValueError):
+                decode_cursor(cursor, 1)
+
+    def test_clamp_limit(self):
+        self.assertEqual(clamp_limit(None, 10), 10)
+        self.assertEqual(clamp_limit(0, 10), 1)
+        self.assertEqual(clamp_limit(5000, 10, maximum=100), 100)
+
+    def test_keyset_slice(self):
+        ids = [2, 3, 5, 8, 13]
+        page, cursor = keyset_slice(ids, '', 2)
+        self.assertEqual(page, [2, 3])
+        page, cursor = keyset_slice(ids, cursor, 2)
+        self.assertEqual(page, [5, 8])
+        page, cursor = keyset_slice(ids, cursor, 2)
+        self.assertEqual((page, cursor), ([13], None))
+
+
+class TestKeysetPagination(ApiTestCase):
+    username = 'cursor_user'
+
+    def create_recipes(self, count):
+        return [self.create_recipe(f'Cursor {i}', ['salt']) for i in range(count)]
+
+    def walk(self, **params):
+        seen, cursor = [], ''
+        while cursor is not None:
+            response = self.client.get(
+                '/api/recipes', query_string=dict(cursor=cursor, **params))
+            self.assertEqual(response.status_code, 200)
+            seen.extend(recipe['id'] for recipe in response.json['recipes'])
+            cursor = response.json['next_cursor']
+        return seen
+
+    def test_walks_every_recipe_once(self):
+        created = self.create_recipes(7)
+        seen = self.walk(limit=3)
+        self.assertEqual(seen, sorted(seen))
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertTrue(set(created) <= set(seen))
+
+    def test_cursor_with_ingredient_filter(self):
+        created = self.create_recipes(3)
+        seen = self.walk(limit=2, ingredient='salt')
+        self.assertTrue(set(created) <= set(seen))
+
+    def test_inserts_do_not_shift_pages(self):
+        self.create_recipes(4)
+        first = self.client.get('/api/recipes', query_string={'cursor': '', 'limit': 2}).json
+        self.create_recipes(1)
+        second = self.client.get('/api/recipes', query_string={
+            'cursor': first['next_cursor'], 'limit': 2}).json
+        self.assertGreater(second['recipes'][0]['id'], first['recipes'][-1]['id'])
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/recipes', query_string={'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json, {'error': 'Invalid cursor'})
+
+    def test_page_parameter_still_works(self):
+        self.create_recipes(2)
+        response = self.client.get('/api/recipes', query_string={'page': 1, 'limit': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+import random
+import threading
+import unittest
+from unittest.mock import Mock
+
+from main import app
+from changes import prune_changes
+from models import Recipe, RecipeIngredient, User, session
+from pantry import PantryIndex
+from tests import ApiTestCase, another_process
+
+
+class TestPantryMatch(ApiTestCase):
+    username = 'pantry_user'
+
+    def setUp(self):
+        app.extensions['pantry_index'].clear()
+        super().setUp()
+
+    def match(self, pantry, **params):
+        response = self.client.post('/api/recipes/match',
+                                    json=dict(pantry=pantry, limit=100, **params))
+        self.assertEqual(response.status_code, 200)
+        return response.json
+
+    def test_ranking_and_missing(self):
+        pancakes = self.create_recipe('Pancakes', ['Flour', 'Egg', 'Milk'])
+        omelette = self.create_recipe('Omelette', ['Egg', 'Butter'])
+        crepes = self.create_recipe('Crepes', ['Flour', 'Egg', 'Milk', 'Sugar', 'Vanilla'])
+
+        results = self.match(['egg', 'FLOUR', 'milk'])
+        self.assertIn({'id': pancakes, 'title': 'Pancakes', 'coverage': 1.0, 'missing': []},
+                      results)
+        self.assertNotIn(omelette, [r['id'] for r in results])
+
+        ids = [r['id'] for r in self.match(['egg', 'flour', 'milk'], max_missing=2)]
+        self.assertLess(ids.index(pancakes), ids.index(omelette))
+        self.assertLess(ids.index(omelette), ids.index(crepes))
+        crepe = next(r for r in self.match(['egg', 'flour', 'milk'], max_missing=2)
+                     if r['id'] == crepes)
+        self.assertEqual(sorted(crepe['missing']), ['sugar', 'vanilla'])
+        self.assertEqual(crepe['coverage'], 0.6)
+
+    def test_index_follows_writes(self):
+        recipe_id = self.create_recipe('Toast', ['Bread', 'Marmite'])
+        self.assertIn(recipe_id, [r['id'] for r in self.match(['bread', 'marmite'])])
+
+        self.client.put(f'/api/recipes/{recipe_id}',
+                        json={'ingredients': [{'name': 'Bread'}, {'name': 'Jam'}]})
+        self.assertNotIn(recipe_id, [r['id'] for r in self.match(['bread', 'marmite'])])
+        self.assertIn(recipe_id, [r['id'] for r in self.match(['bread', 'jam'])])
+
+        self.client.post(f'/api/recipes/{recipe_id}/ingredients',
+                         json={'ingredients': [{'name': 'Butter'}]})
+        self.assertNotIn(recipe_id, [r['id'] for r in self.match(['bread', 'jam'])])
+
+        self.client.delete(f'/api/recipes/{recipe_id}')
+        self.assertNotIn(recipe_id, [r['id'] for r in self.match(['bread', 'jam', 'butter'])])
+
+    def test_index_follows_other_processes(self):
+        recipe_id = self.create_recipe('Porridge', ['Oats', 'Milk'])
+        self.assertIn(recipe_id, [r['id'] for r in self.match(['oats', 'milk'])])
+        user_id = session.query(User).filter_by(username=self.username).one().id
+        session.remove()
+
+        with another_process() as other:
+            recipe = Recipe(title='Muesli', ingredients='[{"name": "Oats"}]', created_by=user_id,
+                            ingredient_rows=[RecipeIngredient.from_dict(0, {'name': 'Oats'})])
+            other.add(recipe)
+            other.commit()
+            muesli = recipe.id
+            other.delete(other.get(Recipe, recipe_id))
+            other.commit()
+        ids = [r['id'] for r in self.match(['oats', 'milk'])]
+        self.assertIn(muesli, ids)
+        self.assertNotIn(recipe_id, ids)
+
+        # Missed changes rebuild the index
+        with another_process() as other:
+            recipe = Recipe(title='Oat milk', ingredients='[{"name": "Milk"}]', created_by=user_id,
+                            ingredient_rows=[RecipeIngredient.from_dict(0, {'name': 'Milk'})])
+            other.add(recipe)
+            other.commit()
+            oat_milk = recipe.id
+        prune_changes(session, keep=0)
+        self.assertIn(oat_milk, [r['id'] for r in self.match(['oats', 'milk'])])
+
+    def test_invalid_requests(self):
+        for body in ({}, {'pantry': 'egg'}, {'pantry': [1]},
+                     {'pantry': ['egg'], 'max_missing': 99}):
+            response = self.client.post('/api/recipes/match', json=body)
+            self.assertEqual(response.status_code, 400)
+
+    def test_matches_brute_force(self):
+        rng = random.Random(7)
+        vocabulary = [f'ingredient {i}' for i in range(40)]
+        for number in range(60):
+            self.create_recipe(f'Random {number}', rng.sample(vocabulary, rng.randint(1, 8)))
+
+        index = PantryIndex(max_missing=2)
+        index.build(session)
+        recipes = {}
+        for recipe_id, keys in index._recipes.items():
+            recipes[recipe_id] = {index._names[i] for i in keys}
+        for _ in range(20):
+            pantry = set(rng.sample(vocabulary, rng.randint(3, 20)))
+            for max_missing in range(3):
+                expected = {recipe_id for recipe_id, keys in recipes.items()
+                            if len(keys - pantry) <= max_missing and keys & pantry}
+                found = {m.recipe_id for m in index.match(pantry, max_missing, limit=10 ** 6)}
+                self.assertEqual(found, expected)
+
+    def test_build_does_not_block_writes(self):
+        recipe_id = self.create_recipe('Porridge', ['Oats', 'Milk'])
+        rows = session.query(RecipeIngredient.recipe_id, RecipeIngredient.name_key) \
+            .order_by(RecipeIngredient.recipe_id).all()
+        index = PantryIndex()
+        unblocked = []
+
+        def scan(batch_size):
+            # A write lands while the build is still reading
+            writer = threading.Thread(target=index.invalidate, args=(recipe_id,))
+            writer.start()
+            writer.join(timeout=5)
+            unblocked.append(not writer.is_alive())
+            return iter(rows)
+
+        scanning = Mock()
+        scanning.query.return_value.order_by.return_value.yield_per.side_effect = scan
+        index.build(scanning)
+        self.assertEqual(unblocked, [True])
+        self.assertIn(recipe_id, index._recipes)
+        self.assertEqual(index.stats()['pending'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import json
+import unittest
+
+from sqlalchemy import create_engine, inspect, text
+
+from migrations import (add_missing_columns, add_missing_indexes, enable_recipe_autoincrement,
+                        normalize_legacy_recipes)
+from models import Recipe, normalize_ingredients, session
+from tests import ApiTestCase
+
+
+class TestNormalizeIngredients(unittest.TestCase):
+    def test_adds_missing_quantity(self):
+        ingredients = [{'name': 'salt'}, {'name': 'egg', 'quantity': '2'}]
+        self.assertEqual(normalize_ingredients(ingredients),
+                         [{'name': 'salt', 'quantity': ''},
+                          {'name': 'egg', 'quantity': '2'}])
+        # The input is not modified in place
+        self.assertEqual(ingredients[0], {'name': 'salt'})
+
+    def test_add_missing_columns(self):
+        old_engine = create_engine('sqlite://')
+        with old_engine.begin() as connection:
+            connection.execute(text(
+                'CREATE TABLE recipes (id INTEGER PRIMARY KEY, title VARCHAR(255))'))
+        self.assertIn('recipes.payload', add_missing_columns(old_engine))
+        columns = {c['name'] for c in inspect(old_engine).get_columns('recipes')}
+        self.assertIn('payload', columns)
+        self.assertEqual(add_missing_columns(old_engine), [])
+
+    def test_enable_recipe_autoincrement(self):
+        old_engine = create_engine('sqlite://')
+        with old_engine.begin() as connection:
+            connection.execute(text('CREATE TABLE recipes (id INTEGER PRIMARY KEY, '
+                                    'title VARCHAR(255) NOT NULL)'))
+            connection.execute(text("INSERT INTO recipes (id, title) VALUES (1, 'a'), (2, 'b')"))
+        add_missing_columns(old_engine)
+        self.assertTrue(enable_recipe_autoincrement(old_engine))
+        self.assertIn('ix_recipes_created_by', add_missing_indexes(old_engine))
+        self.assertFalse(enable_recipe_autoincrement(old_engine))
+
+        with old_engine.begin() as connection:
+            self.assertEqual(connection.execute(text('SELECT id, title, version FROM recipes'))
+                             .all(), [(1, 'a', 1), (2, 'b', 1)])
+            connection.execute(text('DELETE FROM recipes WHERE id = 2'))
+            connection.execute(text("INSERT INTO recipes (title) VALUES ('c')"))
+            self.assertEqual(connection.execute(text(
+                "SELECT id FROM recipes WHERE title = 'c'")).scalar(), 3)
+
+
+class TestStoredPayload(ApiTestCase):
+    username = 'payload_user'
+
+    def test_normalized_at_write_time(self):
+        data = {'title': 'Omelette', 'description': '', 'instructions': '',
+                'ingredients': [{'name': 'egg'}]}
+        recipe_id = self.client.post('/api/recipes', json=data).json['id']
+
+        recipe = session.get(Recipe, recipe_id)
+        self.assertEqual(json.loads(recipe.ingredients),
+                         [{'name': 'egg', 'quantity': ''}])
+        self.assertEqual(json.loads(recipe.payload)['id'], recipe_id)
+
+        response = self.client.get(f'/api/recipes/{recipe_id}')
+        self.assertEqual(response.json['ingredients'], [{'name': 'egg', 'quantity': ''}])
+        self.assertFalse(session.dirty)
+
+    def test_payload_follows_updates(self):
+        data = {'title': 'Tea', 'description': '', 'instructions': '',
+                'ingredients': [{'name': 'leaves', 'quantity': '1 tsp'}]}
+        recipe_id = self.client.post('/api/recipes', json=data).json['id']
+        self.client.put(f'/api/recipes/{recipe_id}', json={'title': 'Green tea'})
+        self.client.post(f'/api/recipes/{recipe_id}/ingredients',
+                         json={'ingredients': [{'name': 'water'}]})
+
+        body = self.client.get(f'/api/recipes/{recipe_id}').json
+        self.assertEqual(body['title'], 'Green tea')
+        self.assertEqual(body['ingredients'][-1], {'name': 'water', 'quantity': ''})
+
+    def test_legacy_rows(self):
+        legacy = Recipe(title='Legacy', description='', instructions='',
+                        ingredients='[{"name": "rice"}]')
+        broken = Recipe(title='Broken', description='', instructions='',
+                        ingredients='not json')
+        session.add_all([legacy, broken])
+        session.commit()
+        legacy_id, broken_id = legacy.id, broken.id
+        session.execute(text('UPDATE recipes SET payload = NULL WHERE id IN (:a, :b)'),
+                        {'a': legacy_id, 'b': broken_id})
+        session.commit()
+
+        # Served normalized even before the migration runs
+        response = self.client.get(f'/api/recipes/{legacy_id}')
+        self.assertEqual(response.json['ingredients'], [{'name': 'rice', 'quantity': ''}])
+
+        normalized, skipped = normalize_legacy_recipes(session)
+        self.assertEqual((normalized, skipped), (1, 1))
+        session.expire_all()
+        self.assertEqual(json.loads(session.get(Recipe, legacy_id).payload)['ingredients'],
+                         [{'name': 'rice', 'quantity': ''}])
+        self.assertIsNone(session.get(Recipe, broken_id).payload)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import unittest
+
+from sqlalchemy import event
+
+from main import app
+from models import engine
+from projection import RECIPE_FIELDS, parse_fields
+from tests import ApiTestCase
+
+
+class TestParseFields(unittest.TestCase):
+    def test_named_sets_and_fields(self):
+        self.assertEqual(parse_fields('summary'), ('id', 'title', 'created_by'))
+        self.assertEqual(parse_fields('ingredients,title'), ('id', 'title', 'ingredients'))
+        self.assertEqual(parse_fields('summary,description'),
+                         ('id', 'title', 'description', 'created_by'))
+        self.assertEqual(parse_fields(None), RECIPE_FIELDS)
+        self.assertEqual(parse_fields('', default='summary'), ('id', 'title', 'created_by'))
+
+    def test_unknown_field(self):
+        with self.assertRaises(ValueError):
+            parse_fields('title,password')
+
+
+class TestSparseFieldsets(ApiTestCase):
+    username = 'fields_user'
+
+    def setUp(self):
+        app.extensions['recipe_cache'].clear()
+        super().setUp()
+        self.recipe_id = self.create_recipe('Lentil soup', ['lentils'],
+                                            description='A long description',
+                                            instructions='Simmer')
+
+    def statements_during(self, *args, **kwargs):
+        statements = []
+
+        def record(conn, cursor, statement, *rest):
+            statements.append(statement)
+
+        event.listen(engine, 'before_cursor_execute', record)
+        try:
+            response = self.client.get(*args, **kwargs)
+        finally:
+            event.remove(engine, 'before_cursor_execute', record)
+        return response, statements
+
+    def test_listing_defaults_to_summary(self):
+        response, statements = self.statements_during(
+            '/api/recipes', query_string={'cursor': '', 'limit': 100})
+        recipe = next(r for r in response.json['recipes'] if r['id'] == self.recipe_id)
+        self.assertEqual(recipe, {'id': self.recipe_id, 'title': 'Lentil soup',
+                                  'created_by': recipe['created_by']})
+        listing = [s for s in statements if 'FROM recipes' in s]
+        self.assertTrue(listing)
+        for column in ('description', 'instructions', 'ingredients', 'payload'):
+            self.assertNotIn(f'recipes.{column}', listing[0])
+
+    def test_listing_with_fields(self):
+        response = self.client.get('/api/recipes', query_string={
+            'cursor': '', 'limit': 100, 'fields': 'ingredients'})
+        recipe = next(r for r in response.json['recipes'] if r['id'] == self.recipe_id)
+        self.assertEqual(recipe, {'id': self.recipe_id,
+                                  'ingredients': [{'name': 'lentils', 'quantity': ''}]})
+
+        full = self.client.get('/api/recipes', query_string={'page': 1, 'fields': 'full'})
+        self.assertIn('instructions', full.json[0])
+
+    def test_get_recipe_with_fields(self):
+        url = f'/api/recipes/{self.recipe_id}'
+        self.assertEqual(set(self.client.get(url).json), set(RECIPE_FIELDS))
+        self.assertEqual(self.client.get(url, query_string={'fields': 'title'}).json,
+                         {'id': self.recipe_id, 'title': 'Lentil soup'})
+
+        self.client.put(url, json={'title': 'Red lentil soup'})
+        self.assertEqual(self.client.get(url, query_string={'fields': 'title'}).json['title'],
+                         'Red lentil soup')
+
+    def test_search_with_fields(self):
+        response = self.client.get('/api/recipes/search', query_string={'q': 'lentil'})
+        self.assertEqual(set(response.json[0]), {'id', 'title', 'created_by'})
+        response = self.client.get('/api/recipes/search',
+                                   query_string={'q': 'lentil', 'fields': 'full'})
+        self.assertEqual(response.json[0]['description'], 'A long description')
+
+    def test_unknown_field(self):
+        response = self.client.get('/api/recipes', query_string={'fields': 'secret'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json, {'error': 'Unknown field: secret'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -40,7 +40,9 @@ class TestRoutes(unittest.TestCase):
         data = {}
         response = self.client.post('/api/register', json=data)
         self.assertEqual(response.status_code, 400)
-        self.assertEqual(response.json, {'error': 'Missing field(s)'})
+        missing = ['Missing data for required field.']
+        self.assertEqual(response.json, {'error': 'Missing field(s)', 'errors': {
+            'username': missing, 'email': missing, 'password': missing}})
 
     def test_register_user_existing_user(self):
         # Simulate registration with existing username
@@ -71,21 +73,21 @@ class TestRoutes(unittest.TestCase):
         data = {'email': 'new_user@example.com', 'password': 'password123'}
         response = self.client.post('/api/register', json=data)
         self.assertEqual(response.status_code, 400)
-        self.assertEqual(response.json, {'error': 'Missing field(s)'})
+        self.assertEqual(response.json, {'error': 'Missing field(s)', 'errors': {'username': ['Missing data for required field.']}})
 
     def test_register_user_missing_email(self):
         # Simulate registration with missing email
         data = {'username': 'new_user', 'password': 'password123'}
         response = self.client.post('/api/register', json=data)
         self.assertEqual(response.status_code, 400)
-        self.assertEqual(response.json, {'error': 'Missing field(s)'})
+        self.assertEqual(response.json, {'error': 'Missing field(s)', 'errors': {'email': ['Missing data for required field.']}})
 
     def test_register_user_missing_password(self):
         # Simulate registration with missing password
         data = {'username': 'new_user', 'email': 'new_user@example.com'}
         response = self.client.post('/api/register', json=data)
         self.assertEqual(response.status_code, 400)
-        self.assertEqual(response.json, {'error': 'Missing field(s)'})
+        self.assertEqual(response.json, {'error': 'Missing field(s)', 'errors': {'password': ['Missing data for required field.']}})
 
     def test_register_user_password_strength(self):
         # Simulate registration with weak password
@@ -93,7 +95,8 @@ class TestRoutes(unittest.TestCase):
                 'email': 'weak_password@example.com', 'password': '123456'}
         response = self.client.post('/api/register', json=data)
         self.assertEqual(response.status_code, 400)
-        self.assertEqual(response.json, {'error': 'Weak password'})
+        self.assertEqual(response.json, {'error': 'Weak password',
+                                         'errors': {'password': ['Shorter than minimum length 8.']}})
 
 
 class TestLogin(unittest.TestCase):
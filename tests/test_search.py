@@ -0,0 +1,127 @@
+import unittest
+
+from changes import prune_changes
+from main import app
+from models import Recipe, session
+from search import build_match_query, ingredient_text, rebuild_index
+from tests import ApiTestCase, another_process
+
+
+class TestSearch(ApiTestCase):
+    username = 'search_user'
+
+    def search(self, keyword, **params):
+        response = self.client.get('/api/recipes/search',
+                                   query_string=dict(q=keyword, **params))
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.json]
+
+    def test_build_match_query(self):
+        self.assertEqual(build_match_query('Garl tom'), '"garl"* "tom"*')
+        self.assertEqual(build_match_query('"; DROP'), '"drop"*')
+        self.assertIsNone(build_match_query('  ?! '))
+
+    def test_ingredient_text_ignores_keys(self):
+        text = ingredient_text('[{"name": "Basil", "quantity": "2"}]')
+        self.assertEqual(text, 'Basil')
+        self.assertEqual(ingredient_text('not json'), '')
+
+    def test_prefix_match_and_ranking(self):
+        by_ingredient = self.create_recipe(
+            'Pasta', [{'name': 'zucchinis', 'quantity': '1'}])
+        by_title = self.create_recipe(
+            'Zucchini bread', [{'name': 'flour', 'quantity': '1 cup'}])
+
+        ids = self.search('zucch')
+        self.assertEqual(ids[:2], [by_title, by_ingredient])
+
+    def test_json_keys_are_not_indexed(self):
+        self.create_recipe('Plain toast', [{'name': 'bread', 'quantity': ''}])
+        self.assertEqual(self.search('quantity'), [])
+
+    def test_update_and_delete_keep_index_in_sync(self):
+        recipe_id = self.create_recipe(
+            'Stew', [{'name': 'parsnip', 'quantity': '2'}])
+
+        self.client.put(f'/api/recipes/{recipe_id}',
+                        json={'ingredients': [{'name': 'turnip', 'quantity': '2'}]})
+        self.assertNotIn(recipe_id, self.search('parsnip'))
+        self.assertIn(recipe_id, self.search('turnip'))
+
+        self.assertEqual(self.search('parmesan'), [])
+        self.client.post(f'/api/recipes/{recipe_id}/ingredients',
+                         json={'ingredients': [{'name': 'leek', 'quantity': '1'}]})
+        self.assertIn(recipe_id, self.search('leek'))
+
+        self.client.delete(f'/api/recipes/{recipe_id}')
+        self.assertNotIn(recipe_id, self.search('turnip'))
+
+    def test_pagination(self):
+        for i in range(12):
+            self.create_recipe(f'Paged lentil {i}', [{'name': 'lentils'}])
+        first = self.search('paged lentil')
+        second = self.search('paged lentil', page=2)
+        self.assertEqual(len(first), 10)
+        self.assertEqual(len(second), 2)
+        self.assertFalse(set(first) & set(second))
+
+    def test_rebuild_index(self):
+        recipe_id = self.create_recipe(
+            'Rebuilt gazpacho', [{'name': 'cucumber'}])
+        self.assertGreaterEqual(rebuild_index(session), 1)
+        self.assertIn(recipe_id, self.search('gazpacho'))
+
+    def test_repeat_searches_are_cached(self):
+        search_cache = app.extensions['search_cache']
+        recipe_id = self.create_recipe('Cached paella', [{'name': 'saffron'}])
+        self.assertEqual(self.search('cached paella'), [recipe_id])
+        hits = search_cache.hits
+        # Case and punctuation do not change the query
+        self.assertEqual(self.search('Cached, PAELLA'), [recipe_id])
+        self.assertEqual(search_cache.hits, hits + 1)
+
+        # Another user's writes leave this user's results cached
+        other = self.login('other_search_user')
+        other.post('/api/recipes', json={'title': 'Cached paella', 'description': '',
+                                         'instructions': '', 'ingredients': []})
+        self.search('cached paella')
+        self.assertEqual(search_cache.hits, hits + 2)
+
+    def test_writes_of_other_processes_refresh_cached_results(self):
+        recipe_id = self.create_recipe('Distant gazpacho', [{'name': 'cucumber'}])
+        self.assertEqual(self.search('distant gazpacho'), [recipe_id])
+        user_id = session.get(Recipe, recipe_id).created_by
+        session.remove()
+        with another_process() as other:
+            recipe = Recipe(title='Distant gazpacho verde', ingredients='[]', created_by=user_id)
+            other.add(recipe)
+            other.commit()
+            second_id = recipe.id
+        self.assertEqual(set(self.search('distant gazpacho')), {recipe_id, second_id})
+
+        with another_process() as other:
+            other.get(Recipe, recipe_id).title = 'Moved'
+            other.commit()
+        session.remove()
+        prune_changes(session, keep=0)
+        # Missed changes drop every cached search
+        self.assertEqual(self.search('distant gazpacho'), [second_id])
+
+    def test_own_writes_refresh_cached_results(self):
+        recipe_id = self.create_recipe('Refreshed risotto', [{'name': 'arborio'}])
+        self.assertEqual(self.search('refreshed risotto'), [recipe_id])
+        second_id = self.create_recipe('Refreshed risotto verde', [{'name': 'peas'}])
+        self.assertEqual(set(self.search('refreshed risotto')), {recipe_id, second_id})
+
+        self.client.put(f'/api/recipes/{second_id}', json={'title': 'Pea soup'})
+        self.assertEqual(self.search('refreshed risotto'), [recipe_id])
+        self.assertEqual(self.search('parmesan'), [])
+        self.client.post(f'/api/recipes/{recipe_id}/ingredients',
+                         json={'ingredients': [{'name': 'parmesan'}]})
+        self.assertEqual(self.search('parmesan'), [recipe_id])
+        self.client.delete(f'/api/recipes/{recipe_id}')
+        self.assertEqual(self.search('refreshed risotto'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import unittest
+
+from sqlalchemy import update
+
+from migrations import backfill_ingredient_amounts
+from models import RecipeIngredient, session
+from tests import ApiTestCase
+from units import Quantity, display_quantity, parse_quantity
+
+
+class TestParseQuantity(unittest.TestCase):
+    def test_units_are_converted(self):
+        for text, expected in [
+            ('2 cups', Quantity(473.176, 'ml')),
+            ('1/2 tsp', Quantity(2.46446, 'ml')),
+            ('1 1/2 Tbsp.', Quantity(22.1802, 'ml')),
+            ('1½ lb', Quantity(680.388, 'g')),
+            ('250g', Quantity(250.0, 'g')),
+            ('2-3 cloves', Quantity(3.0, 'clove')),
+            ('3', Quantity(3.0, '')),
+            ('2 large', Quantity(2.0, '')),
+            ('1 cinnamon stick', Quantity(1.0, '')),
+        ]:
+            with self.subTest(text=text):
+                amount, unit = parse_quantity(text)
+                self.assertAlmostEqual(amount, expected.amount, places=3)
+                self.assertEqual(unit, expected.unit)
+
+    def test_unreadable_quantities(self):
+        for text in ('', None, 'to taste', 'a pinch', '1/0 cup'):
+            self.assertIsNone(parse_quantity(text))
+
+    def test_display_quantity(self):
+        self.assertEqual(display_quantity(1500.0, 'ml'), (1.5, 'l'))
+        self.assertEqual(display_quantity(14.7868, 'ml'), (14.79, 'ml'))
+        self.assertEqual(display_quantity(3.0, 'clove'), (3, 'clove'))
+
+
+class TestShoppingList(ApiTestCase):
+    username = 'shopping_user'
+
+    def create_recipe(self, title, ingredients):
+        return super().create_recipe(title, [{'name': name, 'quantity': quantity}
+                                             for name, quantity in ingredients])
+
+    def test_totals_are_merged_and_scaled(self):
+        pancakes = self.create_recipe('Pancakes', [
+            ('Flour', '1 cup'), ('Milk', '250 ml'), ('Egg', '2'), ('Salt', 'to taste')])
+        crepes = self.create_recipe('Crepes', [
+            ('flour', '1/2 cup'), ('milk', '1 l'), ('egg', '3'), ('Butter', '50 g')])
+
+        response = self.client.post('/api/shopping-list', json={'recipes': [
+            {'id': pancakes, 'multiplier': 2}, {'id': crepes}, {'id': 0}]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['missing'], [0])
+        items = {item['name'].lower(): item for item in response.json['items']}
+        self.assertEqual(items['flour'], {'name': 'Flour', 'amount': 591.47, 'unit': 'ml',
+                                          'recipes': 2})
+        self.assertEqual(items['milk']['amount'], 1.5)
+        self.assertEqual(items['milk']['unit'], 'l')
+        self.assertEqual(items['egg']['amount'], 7)
+        self.assertEqual(items['butter']['unit'], 'g')
+        self.assertEqual(items['salt'], {'name': 'Salt', 'amount': None, 'unit': None,
+                                         'recipes': 1})
+
+    def test_invalid_plans(self):
+        for body in (None, {'recipes': 1}, {'recipes': [{'id': 'x'}]},
+                     {'recipes': [{'id': 1, 'multiplier': 0}]},
+                     {'recipes': [{'id': 1}] * 101}):
+            with self.subTest(body=body):
+                self.assertEqual(
+                    self.client.post('/api/shopping-list', json=body).status_code, 400)
+
+    def test_backfill_amounts(self):
+        recipe_id = self.create_recipe('Old', [('Rice', '2 cups'), ('Salt', 'to taste')])
+        session.execute(update(RecipeIngredient.__table__)
+                        .where(RecipeIngredient.recipe_id == recipe_id)
+                        .values(amount=None, unit=None))
+        session.commit()
+
+        self.assertGreaterEqual(backfill_ingredient_amounts(session, batch_size=1), 1)
+        rows = session.query(RecipeIngredient.amount, RecipeIngredient.unit) \
+            .filter_by(recipe_id=recipe_id).order_by(RecipeIngredient.position).all()
+        self.assertEqual([(round(amount, 3), unit) for amount, unit in rows[:1]],
+                         [(473.176, 'ml')])
+        self.assertEqual(tuple(rows[1]), (None, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
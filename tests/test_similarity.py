@@ -0,0 +1,119 @@
+import json
+import unittest
+
+from sqlalchemy import event
+
+from main import app
+from changes import prune_changes
+from models import Recipe, RecipeIngredient, RecipeSignature, engine, session
+from similarity import compute_signature, rebuild_signatures
+from tests import ApiTestCase, another_process
+
+
+class TestSimilarRecipes(ApiTestCase):
+    username = 'similar_user'
+
+    def setUp(self):
+        app.extensions['similarity_index'].clear()
+        super().setUp()
+
+    def similar_ids(self, recipe_id):
+        response = self.client.get(f'/api/recipes/{recipe_id}/similar')
+        self.assertEqual(response.status_code, 200)
+        return [r['id'] for r in response.json]
+
+    def test_signature_estimates_jaccard(self):
+        first = compute_signature({f'item {i}' for i in range(20)})
+        second = compute_signature({f'item {i}' for i in range(2, 20)})
+        agreement = sum(a == b for a, b in zip(first, second)) / len(first)
+        self.assertAlmostEqual(agreement, 0.9, delta=0.15)
+        self.assertEqual(compute_signature(['b', 'a']), compute_signature(['a', 'b', 'a']))
+        self.assertIsNone(compute_signature([]))
+
+    def test_similar_ranked_by_jaccard(self):
+        base = ['Flour', 'Egg', 'Milk', 'Butter', 'Sugar', 'Salt']
+        recipe_id = self.create_recipe('Pancakes', base)
+        close = self.create_recipe('Crepes', base[:5] + ['Vanilla'])
+        closest = self.create_recipe('Waffles', base)
+        unrelated = self.create_recipe('Salad', ['Lettuce', 'Tomato', 'Cucumber'])
+
+        response = self.client.get(f'/api/recipes/{recipe_id}/similar')
+        self.assertEqual(response.json[0], {'id': closest, 'title': 'Waffles', 'similarity': 1.0})
+        ids = [r['id'] for r in response.json]
+        self.assertLess(ids.index(closest), ids.index(close))
+        self.assertNotIn(unrelated, ids)
+        self.assertNotIn(recipe_id, ids)
+
+    def test_index_follows_writes(self):
+        names = ['Rice', 'Saffron', 'Chicken', 'Peas', 'Paprika']
+        recipe_id = self.create_recipe('Paella', names)
+        other = self.create_recipe('Arroz', names)
+        self.assertIn(other, self.similar_ids(recipe_id))
+
+        self.client.put(f'/api/recipes/{other}', json={'ingredients': [{'name': 'Ice'}]})
+        self.assertNotIn(other, self.similar_ids(recipe_id))
+
+        self.client.put(f'/api/recipes/{other}',
+                        json={'ingredients': [{'name': name} for name in names[:4]]})
+        self.client.post(f'/api/recipes/{other}/ingredients',
+                         json={'ingredients': [{'name': 'Paprika'}]})
+        self.assertIn(other, self.similar_ids(recipe_id))
+
+        self.client.delete(f'/api/recipes/{other}')
+        self.assertNotIn(other, self.similar_ids(recipe_id))
+
+    def test_index_follows_other_processes(self):
+        names = ['Beans', 'Tortilla', 'Cheese', 'Salsa']
+        recipe_id = self.create_recipe('Burrito', names)
+        other_id = self.create_recipe('Quesadilla', names)
+        self.assertIn(other_id, self.similar_ids(recipe_id))
+
+        with another_process() as other:
+            owner_id = other.get(Recipe, other_id).created_by
+            other.delete(other.get(Recipe, other_id))
+            other.commit()
+        self.assertNotIn(other_id, self.similar_ids(recipe_id))
+
+        # Missed changes rebuild the index
+        with another_process() as other:
+            recipe = Recipe(title='Nachos', created_by=owner_id,
+                            ingredients=json.dumps([{'name': name} for name in names]),
+                            ingredient_rows=[RecipeIngredient.from_dict(position, {'name': name})
+                                             for position, name in enumerate(names)])
+            other.add(recipe)
+            other.commit()
+            third_id = recipe.id
+        prune_changes(session, keep=0)
+        self.assertIn(third_id, self.similar_ids(recipe_id))
+
+    def test_delete_with_foreign_keys_enforced(self):
+        # As on Postgres: the signature row must be gone before its recipe is
+        def enforce_foreign_keys(dbapi_connection, connection_record):
+            dbapi_connection.execute('PRAGMA foreign_keys=ON')
+
+        session.remove()
+        engine.dispose()
+        event.listen(engine, 'connect', enforce_foreign_keys)
+        self.addCleanup(engine.dispose)
+        self.addCleanup(event.remove, engine, 'connect', enforce_foreign_keys)
+
+        recipe_id = self.create_recipe('Soup', ['Leek', 'Potato'])
+        self.assertEqual(self.client.delete(f'/api/recipes/{recipe_id}').status_code, 200)
+        self.assertIsNone(session.get(RecipeSignature, recipe_id))
+
+    def test_missing_recipe(self):
+        self.assertEqual(self.client.get('/api/recipes/999999/similar').status_code, 404)
+
+    def test_rebuild_matches_write_time_signatures(self):
+        self.create_recipe('Curry', ['Chickpeas', 'Cumin', 'Tomato'])
+        stored = dict(session.query(RecipeSignature.recipe_id, RecipeSignature.signature))
+        self.assertEqual(rebuild_signatures(session, workers=0), len(stored))
+        self.assertEqual(dict(session.query(RecipeSignature.recipe_id,
+                                            RecipeSignature.signature)), stored)
+        self.assertEqual(rebuild_signatures(session, workers=2, batch_size=2), len(stored))
+        self.assertEqual(dict(session.query(RecipeSignature.recipe_id,
+                                            RecipeSignature.signature)), stored)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import unittest
+
+from tests import ApiTestCase
+from validation import (load_ingredients, load_new_recipe, load_recipe_update,
+                        load_registration)
+
+MISSING = ['Missing data for required field.']
+
+
+def recipe(**overrides):
+    return {'title': 'Soup', 'description': 'Hot', 'instructions': 'Boil',
+            'ingredients': [{'name': 'water', 'quantity': '1 l'}], **overrides}
+
+
+class TestLoaders(unittest.TestCase):
+    def test_valid_recipe(self):
+        data, errors, message = load_new_recipe(recipe(notes='ignored'))
+        self.assertIsNone(errors)
+        self.assertIsNone(message)
+        self.assertEqual(data, recipe())
+
+    def test_collects_every_error(self):
+        data, errors, message = load_new_recipe({
+            'title': 5, 'id': 1,
+            'ingredients': [{'name': 'salt'}, 'pepper', {'quantity': 2}, {'name': ' '}]})
+        self.assertIsNone(data)
+        self.assertEqual(message, 'Field "id" is not allowed')
+        self.assertEqual(errors, {
+            'title': ['Not a valid string.'],
+            'description': MISSING,
+            'instructions': MISSING,
+            'ingredients': {1: {'_schema': ['Invalid input type.']},
+                            2: {'name': MISSING},
+                            3: {'name': ['Must be a non-empty string.']}},
+            'id': ['Not allowed.'],
+        })
+
+    def test_legacy_messages(self):
+        self.assertEqual(load_new_recipe(['not', 'a', 'dict']).message,
+                         'Recipe must be a JSON object')
+        self.assertEqual(load_new_recipe({'title': 'x'}).message,
+                         'Missing field(s): description, instructions, ingredients')
+        self.assertEqual(load_new_recipe(recipe(ingredients='flour')).message,
+                         'Ingredients must be a list of dictionaries')
+        self.assertEqual(load_new_recipe(recipe(ingredients=[{'quantity': 1}])).message,
+                         'Each ingredient must be a dictionary with "name" key')
+        self.assertEqual(load_new_recipe(recipe(ingredients=[{'name': 'x', 'quantity': []}])).errors,
+                         {'ingredients': {0: {'quantity': ['Must be a string or a number.']}}})
+
+    def test_update_is_partial_and_ignores_server_fields(self):
+        data, errors, _ = load_recipe_update({'id': 4, 'created_by': 1, 'version': 2,
+                                              'title': 'New'})
+        self.assertIsNone(errors)
+        self.assertEqual(data, {'title': 'New'})
+        self.assertEqual(load_recipe_update({'ingredients': ['flour']}).errors,
+                         {'ingredients': {0: {'_schema': ['Invalid input type.']}}})
+
+    def test_ingredients_body(self):
+        self.assertEqual(load_ingredients({}).data, {'ingredients': []})
+        self.assertEqual(load_ingredients({'ingredients': {'name': 'x'}}).errors,
+                         {'ingredients': ['Not a valid list.']})
+
+    def test_registration(self):
+        data, errors, _ = load_registration({'username': 'Alice', 'email': 'A@Example.com',
+                                             'password': 'password123'})
+        self.assertIsNone(errors)
+        self.assertEqual(data, {'username': 'alice', 'email': 'a@example.com',
+                                'password': 'password123'})
+        self.assertEqual(load_registration(None).message, 'Missing field(s)')
+        self.assertEqual(load_registration({'username': 'a', 'email': 'b',
+                                            'password': 'short'}).message, 'Weak password')
+
+
+class TestValidatedRoutes(ApiTestCase):
+    username = 'validation_user'
+
+    def setUp(self):
+        super().setUp()
+        self.recipe_id = self.client.post('/api/recipes', json=recipe()).json['id']
+
+    def test_create_reports_all_errors(self):
+        response = self.client.post('/api/recipes', json={'title': 'x', 'ingredients': [1]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json, {
+            'error': 'Missing field(s): description, instructions',
+            'errors': {'description': MISSING, 'instructions': MISSING,
+                       'ingredients': {'0': {'_schema': ['Invalid input type.']}}}})
+
+    def test_update_checks_ingredients(self):
+        response = self.client.put(f'/api/recipes/{self.recipe_id}',
+                                   json={'ingredients': [{'name': 'salt'}, 'pepper']})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json['errors'],
+                         {'ingredients': {'1': {'_schema': ['Invalid input type.']}}})
+
+        # A recipe as it was read can be sent back with changes
+        current = self.client.get(f'/api/recipes/{self.recipe_id}').json
+        response = self.client.put(f'/api/recipes/{self.recipe_id}',
+                                   json={**current, 'title': 'Broth'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(f'/api/recipes/{self.recipe_id}').json['title'],
+                         'Broth')
+
+    def test_add_ingredients_checks_items(self):
+        response = self.client.post(f'/api/recipes/{self.recipe_id}/ingredients',
+                                    json={'ingredients': [{'quantity': '1'}]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json, {
+            'error': 'Each ingredient must be a dictionary with "name" key',
+            'errors': {'ingredients': {'0': {'name': MISSING}}}})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+"""
+Parsing of free-form ingredient quantities into canonical amounts.
+
+"2 cups", "1 1/2 tbsp", "½ lb" and "3 cloves" become an amount in a
+canonical unit: millilitres for volumes, grams for weights, and the unit
+itself for countable units such as cloves or cans (a bare number has the
+unit ''). Quantities that cannot be read, such as "to taste" or "", parse to
+None and are kept only as the original text.
+
+The parse happens once, when ingredient rows are written (see
+RecipeIngredient.from_dict), so aggregating amounts is plain SQL.
+"""
+import re
+from collections import namedtuple
+from fractions import Fraction
+
+Quantity = namedtuple('Quantity', ['amount', 'unit'])
+
+VOLUME_UNIT = 'ml'
+MASS_UNIT = 'g'
+
+# Alias -> (canonical unit, factor to the canonical unit)
+UNITS = {}
+
+
+def _add_units(canonical, factor, *aliases):
+    for alias in aliases:
+        UNITS[alias] = (canonical, factor)
+
+
+_add_units(VOLUME_UNIT, 1, 'ml', 'milliliter', 'milliliters', 'millilitre', 'millilitres')
+_add_units(VOLUME_UNIT, 10, 'cl', 'centiliter', 'centiliters', 'centilitre', 'centilitres')
+_add_units(VOLUME_UNIT, 100, 'dl', 'deciliter', 'deciliters', 'decilitre', 'decilitres')
+_add_units(VOLUME_UNIT, 1000, 'l', 'liter', 'liters', 'litre', 'litres')
+_add_units(VOLUME_UNIT, 4.92892, 'tsp', 'tsps', 'teaspoon', 'teaspoons')
+_add_units(VOLUME_UNIT, 14.7868, 'tbsp', 'tbsps', 'tbs', 'tbl', 'tablespoon', 'tablespoons')
+_add_units(VOLUME_UNIT, 29.5735, 'fl oz', 'fl. oz', 'fluid ounce', 'fluid ounces')
+_add_units(VOLUME_UNIT, 236.588, 'cup', 'cups', 'c')
+_add_units(VOLUME_UNIT, 473.176, 'pint', 'pints', 'pt')
+_add_units(VOLUME_UNIT, 946.353, 'quart', 'quarts', 'qt')
+_add_units(VOLUME_UNIT, 3785.41, 'gallon', 'gallons', 'gal')
+_add_units(MASS_UNIT, 0.001, 'mg', 'milligram', 'milligrams')
+_add_units(MASS_UNIT, 1, 'g', 'gr', 'gram', 'grams', 'gramme', 'grammes')
+_add_units(MASS_UNIT, 1000, 'kg', 'kilo', 'kilos', 'kilogram', 'kilograms')
+_add_units(MASS_UNIT, 28.3495, 'oz', 'ounce', 'ounces')
+_add_units(MASS_UNIT, 453.592, 'lb', 'lbs', 'pound', 'pounds')
+for _unit, _plural in (('bunch', 'bunches'), ('can', 'cans'), ('clove', 'cloves'),
+                       ('dash', 'dashes'), ('handful', 'handfuls'), ('head', 'heads'),
+                       ('jar', 'jars'), ('leaf', 'leaves'), ('package', 'packages'),
+                       ('piece', 'pieces'), ('pinch', 'pinches'), ('slice', 'slices'),
+                       ('sprig', 'sprigs'), ('stalk', 'stalks'), ('stick', 'sticks')):
+    _add_units(_unit, 1, _unit, _plural)
+
+UNICODE_FRACTIONS = {'½': '1/2', '⅓': '1/3', '⅔': '2/3', '¼': '1/4', '¾': '3/4',
+                     '⅕': '1/5', '⅛': '1/8', '⅜': '3/8', '⅝': '5/8', '⅞': '7/8'}
+
+# Mixed numbers and fractions first, so "1/2" is not read as 1
+_NUMBER = r'\d+\s+\d+/\d+|\d+/\d+|\d+(?:\.\d+)?|\.\d+'
+# A number, optionally the upper end of a range such as "2-3" or "2 to 3"
+QUANTITY_RE = re.compile(
+    rf'^(?P<low>{_NUMBER})(?:\s*(?:-|–|to)\s*(?P<high>{_NUMBER}))?\s*(?P<rest>.*)$')
+# A unit must end its word, so "1 cinnamon stick" is not 1 cup
+UNIT_RE = re.compile(r'^(?P<unit>{})\.?(?![a-z])'.format(
+    '|'.join(re.escape(alias) for alias in sorted(UNITS, key=len, reverse=True))))
+
+
+def _number(text):
+    return float(sum(Fraction(part) for part in text.split()))
+
+
+def parse_quantity(text):
+    """
+    The canonical Quantity of a free-form quantity, or None if it has no
+    leading number. Ranges count at their upper end; words after the number
+    that are not a known unit ("2 large") leave it a plain count.
+    """
+    if text is None:
+        return None
+    text = str(text).strip().lower()
+    for symbol, fraction in UNICODE_FRACTIONS.items():
+        # "1½" -> "1 1/2"
+        text = re.sub(rf'(\d)?{symbol}', lambda m: f'{m.group(1)} {fraction}'
+                      if m.group(1) else fraction, text)
+    match = QUANTITY_RE.match(text)
+    if match is None:
+        return None
+    try:
+        amount = _number(match.group('high') or match.group('low'))
+    except (ValueError, ZeroDivisionError):
+        return None
+
+    unit_match = UNIT_RE.match(match.group('rest'))
+    if unit_match is None:
+        return Quantity(amount, '')
+    unit, factor = UNITS[unit_match.group('unit')]
+    return Quantity(amount * factor, unit)
+
+
+def display_quantity(amount, unit):
+    """``(amount, unit)`` in a readable unit (1500 ml -> 1.5 l), rounded to 2 decimals."""
+    if unit == VOLUME_UNIT and amount >= 1000:
+        amount, unit = amount / 1000, 'l'
+    elif unit == MASS_UNIT and amount >= 1000:
+        amount, unit = amount / 1000, 'kg'
+    amount = round(float(amount), 2)
+    return (int(amount) if amount.is_integer() else amount), unit
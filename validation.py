@@ -0,0 +1,168 @@
+"""
+Request validation, built once at import from the schemas in schema.py.
+
+Each loader validates and normalizes a request body in a single pass and
+returns a Validated tuple: ``data`` is the cleaned body, or ``errors`` maps
+every offending field to its messages (ingredient problems keyed by list
+index) and ``message`` summarizes them in the wording the API has always used.
+"""
+from collections import namedtuple
+
+from marshmallow import (EXCLUDE, Schema, ValidationError, fields, post_load, validate,
+                         validates_schema)
+
+from schema import RecipeSchema, UserSchema
+
+REQUIRED_RECIPE_FIELDS = ('title', 'description', 'instructions', 'ingredients')
+DISALLOWED_RECIPE_FIELDS = ('created_by', 'id')
+# Columns the app maintains itself
+SERVER_RECIPE_FIELDS = ('id', 'created_by', 'payload', 'version')
+MIN_PASSWORD_LENGTH = 8
+
+MISSING = fields.Field.default_error_messages['required']
+
+Validated = namedtuple('Validated', ['data', 'errors', 'message'])
+
+
+def ingredient_errors(ingredient):
+    """Messages for one ingredient by key, empty when it is valid."""
+    if not isinstance(ingredient, dict):
+        return {'_schema': ['Invalid input type.']}
+    errors = {}
+    if 'name' not in ingredient:
+        errors['name'] = [MISSING]
+    elif not isinstance(ingredient['name'], str) or not ingredient['name'].strip():
+        errors['name'] = ['Must be a non-empty string.']
+    quantity = ingredient.get('quantity')
+    if quantity is not None and (isinstance(quantity, bool)
+                                 or not isinstance(quantity, (str, int, float))):
+        errors['quantity'] = ['Must be a string or a number.']
+    return errors
+
+
+class IngredientList(fields.Field):
+    """
+    A list of ingredient objects. Items are checked in one loop rather than through
+    a nested schema per item, which keeps large lists cheap. Normalization is left
+    to Recipe.set_ingredients.
+    """
+    default_error_messages = {'invalid': 'Not a valid list.'}
+
+    def _deserialize(self, value, attr, data, **kwargs):
+        if not isinstance(value, list):
+            raise self.make_error('invalid')
+        errors = {}
+        for index, ingredient in enumerate(value):
+            problems = ingredient_errors(ingredient)
+            if problems:
+                errors[index] = problems
+        if errors:
+            raise ValidationError(errors)
+        return value
+
+
+class NewRecipeSchema(RecipeSchema):
+    class Meta(RecipeSchema.Meta):
+        load_instance = False
+        exclude = SERVER_RECIPE_FIELDS
+        unknown = EXCLUDE
+
+    description = fields.String(required=True, allow_none=True)
+    instructions = fields.String(required=True, allow_none=True)
+    ingredients = IngredientList(required=True)
+
+    @validates_schema(pass_original=True, skip_on_field_errors=False)
+    def reject_server_fields(self, data, original, **kwargs):
+        disallowed = [field for field in DISALLOWED_RECIPE_FIELDS if field in original]
+        if disallowed:
+            raise ValidationError({field: ['Not allowed.'] for field in disallowed})
+
+
+class UserRegistrationSchema(UserSchema):
+    class Meta(UserSchema.Meta):
+        load_instance = False
+        exclude = ('id',)
+        unknown = EXCLUDE
+
+    password = fields.String(required=True,
+                             validate=validate.Length(min=MIN_PASSWORD_LENGTH))
+
+    @post_load
+    def lowercase_names(self, data, **kwargs):
+        data['username'] = data['username'].lower()
+        data['email'] = data['email'].lower()
+        return data
+
+
+class IngredientsSchema(Schema):
+    class Meta:
+        unknown = EXCLUDE
+
+    ingredients = IngredientList(load_default=list)
+
+
+_new_recipe_schema = NewRecipeSchema()
+# Updates keep every field optional
+_recipe_update_schema = NewRecipeSchema(partial=True)
+_ingredients_schema = IngredientsSchema()
+_registration_schema = UserRegistrationSchema()
+
+
+def _load(schema, data, summarize, partial=None):
+    if not isinstance(data, dict):
+        # marshmallow would load None as an empty object
+        errors = {'_schema': ['Invalid input type.']}
+        return Validated(None, errors, summarize(errors))
+    try:
+        return Validated(schema.load(data, partial=partial), None, None)
+    except ValidationError as e:
+        errors = e.normalized_messages()
+        return Validated(None, errors, summarize(errors))
+
+
+def _recipe_message(errors):
+    if '_schema' in errors:
+        return 'Recipe must be a JSON object'
+    for field in DISALLOWED_RECIPE_FIELDS:
+        if field in errors:
+            return f'Field "{field}" is not allowed'
+    missing = [field for field in REQUIRED_RECIPE_FIELDS if errors.get(field) == [MISSING]]
+    if missing:
+        return f'Missing field(s): {", ".join(missing)}'
+    if 'ingredients' in errors:
+        if isinstance(errors['ingredients'], list):
+            return 'Ingredients must be a list of dictionaries'
+        return 'Each ingredient must be a dictionary with "name" key'
+    field, messages = next(iter(errors.items()))
+    return f'{field}: {messages[0]}'
+
+
+def _registration_message(errors):
+    if '_schema' in errors or any(messages == [MISSING] for messages in errors.values()):
+        return 'Missing field(s)'
+    if 'password' in errors:
+        return 'Weak password'
+    field, messages = next(iter(errors.items()))
+    return f'{field}: {messages[0]}'
+
+
+def load_new_recipe(data):
+    return _load(_new_recipe_schema, data, _recipe_message)
+
+
+def load_recipe_update(data):
+    # Updates may carry the recipe as it was read, so id and created_by are ignored
+    if isinstance(data, dict) and any(field in data for field in DISALLOWED_RECIPE_FIELDS):
+        data = {key: value for key, value in data.items()
+                if key not in DISALLOWED_RECIPE_FIELDS}
+    return _load(_recipe_update_schema, data, _recipe_message, partial=True)
+
+
+def load_ingredients(data):
+    """{"ingredients": [...]} bodies, as for appending ingredients."""
+    return _load(_ingredients_schema, data, _recipe_message)
+
+
+def load_registration(data):
+    return _load(_registration_schema, data, _registration_message)
+